@@ -8,6 +8,7 @@ from flask_jwt_extended import JWTManager
 from flask_restplus import Api
 
 from extensions.flask_redis import redis_store
+from extensions.flask_es import es_store
 from config import Config, instances
 
 from .auth_controller import api as auth_ns
@@ -69,6 +70,7 @@ def create_app(instance_name):
     app.config.from_object(instances[instance_name])
     app.config.from_pyfile(f'{Config.BASEDIR}/config-{instance_name}.cfg', silent=True)
     redis_store.init_app(app)
+    es_store.init_app(app)
     CORS(app)
 
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = 100000
@@ -14,8 +14,9 @@ api = Namespace('category', description='Namespace for category service')
 
 from core.category_services import add_category_category_dependency, get_category_id_from_name, search_categories, get_category_details
 from core.category_services import create_category_id, calculate_dependency_percentage
+from core.category_catalogue_services import publish_category_catalogue_update
 from core.training_model_services import category_wise_problem_solve_for_users
-from core.user_category_edge_services import get_category_toppers
+from core.user_category_edge_services import get_category_toppers, get_user_category_rank, get_root_category_toppers
 
 _http_headers = {'Content-Type': 'application/json'}
 
@@ -112,6 +113,7 @@ class CategoryByID(Resource):
                     data['updated_at'] = int(time.time())
                     response = rs.put(url=search_url, json=data, headers=_http_headers).json()
                     if 'result' in response:
+                        publish_category_catalogue_update()
                         app.logger.info('Update category_details api completed')
                         return response['result'], 200
                     else:
@@ -135,6 +137,7 @@ class CategoryByID(Resource):
             print(response)
             if 'result' in response:
                 if response['result'] == 'deleted':
+                    publish_category_catalogue_update()
                     app.logger.info('Delete category_details api completed')
                     return response['result'], 200
                 else:
@@ -179,6 +182,7 @@ class CreateCategory(Resource):
                         'dependency_factor': cat['factor']
                     }
                     add_category_category_dependency(edge)
+                publish_category_catalogue_update()
                 app.logger.info('Create category api completed')
                 return response['_id'], 201
             app.logger.error('Elasticsearch down, response: ' + str(response))
@@ -315,3 +319,33 @@ class CategoryToppers(Resource):
             }
         except Exception as e:
             return {'message': str(e)}, 500
+
+
+@api.route('/user/toppers/<string:category_id>/rank/<string:user_id>')
+class CategoryUserRank(Resource):
+
+    @api.doc('get rank of a user within a category')
+    def get(self, category_id, user_id):
+        try:
+            app.logger.info('category user rank api called')
+            rank = get_user_category_rank(category_id, user_id)
+            if rank is None:
+                return {'message': 'not found'}, 404
+            return rank
+        except Exception as e:
+            return {'message': str(e)}, 500
+
+
+@api.route('/user/root-toppers')
+class RootCategoryToppers(Resource):
+
+    @api.doc('get toppers of every root category')
+    def get(self):
+        try:
+            app.logger.info('root category toppers api called')
+            size = int(request.args.get('size', 10))
+            return {
+                "category_list": get_root_category_toppers(size)
+            }
+        except Exception as e:
+            return {'message': str(e)}, 500
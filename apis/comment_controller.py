@@ -12,7 +12,8 @@ from commons.jwt_helpers import access_required
 
 api = Namespace('comment', description='Namespace for comment service')
 
-from core.user_services import get_user_details
+from core.user_services import get_user_card
+from core.comment_services import set_comment_ref_id
 
 _http_headers = {'Content-Type': 'application/json'}
 
@@ -93,7 +94,7 @@ class CommentByID(Resource):
                 data['id'] = response['_id']
                 data['comment_id'] = response['_id']
                 data['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data['updated_at']))
-                user_details = get_user_details(data['comment_writer'])
+                user_details = get_user_card(data['comment_writer'])
                 data['comment_writer_handle'] = user_details['username']
                 data['comment_writer_skill_color'] = user_details['skill_color']
                 app.logger.info('Get comment_details method completed')
@@ -162,6 +163,7 @@ class CreateComment(Resource):
 
         data['created_at'] = int(time.time())
         data['updated_at'] = int(time.time())
+        data = set_comment_ref_id(data)
 
         post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index, _es_type)
         response = rs.post(url=post_url, json=data, headers=_http_headers).json()
@@ -210,7 +212,7 @@ class SearchComment(Resource):
                 comment['comment_id'] = hit['_id']
                 comment['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(comment['updated_at']))
                 if 'comment_writer' in comment:
-                    user_details = get_user_details(comment['comment_writer'])
+                    user_details = get_user_card(comment['comment_writer'])
                     comment['comment_writer_handle'] = user_details['username']
                     comment['comment_writer_skill_color'] = user_details['skill_color']
                 item_list.append(comment)
@@ -10,7 +10,8 @@ from flask_jwt_extended import jwt_required
 from jwt.exceptions import *
 from commons.jwt_helpers import access_required
 
-from core.user_services import get_user_details
+from core.user_services import get_user_card
+from core.follower_services import follow_user, unfollow_user
 
 api = Namespace('user_follower', description='Namespace for user_follower service')
 
@@ -86,28 +87,10 @@ class UserFollow(Resource):
     def put(self, user_id):
         try:
             app.logger.info('Follow api called')
-            print('user_id: ', user_id)
             current_user = get_jwt_identity().get('id')
-            rs = requests.session()
-            data = {
-                'user_id': user_id,
-                'followed_by': current_user
-            }
-
-            print('data: ', data)
-
-            data['created_at'] = int(time.time())
-            data['updated_at'] = int(time.time())
-
-            post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_followers, _es_type)
-            response = rs.post(url=post_url, json=data, headers=_http_headers).json()
-            print('response: ', response)
-
-            if 'result' in response and response['result'] == 'created':
-                app.logger.info('Create comment method completed')
-                return response['_id'], 201
-            app.logger.error('Elasticsearch down, response: ' + str(response))
-            return response, 500
+            edge_id = follow_user(user_id, current_user)
+            app.logger.info('Follow api completed')
+            return edge_id, 201
 
         except Exception as e:
             return {'message': str(e)}, 500
@@ -121,14 +104,7 @@ class UserUnfollow(Resource):
     def put(self, user_id):
         try:
             current_user = get_jwt_identity().get('id')
-            rs = requests.session()
-            must = [
-                {'term': {'user_id': user_id}},
-                {'term': {'followed_by': current_user}},
-            ]
-            query_json = {'query': {'bool': {'must': must}}}
-            url = 'http://{}/{}/{}/_delete_by_query'.format(app.config['ES_HOST'], _es_index_followers, _es_type)
-            response = rs.post(url=url, json=query_json, headers=_http_headers).json()
+            response = unfollow_user(user_id, current_user)
             return response, 200
 
         except Exception as e:
@@ -190,7 +166,7 @@ class FollowerList(Resource):
                     data = hit['_source']
                     user_id = data['followed_by']
                     try:
-                        user_details = get_user_details(user_id)
+                        user_details = get_user_card(user_id)
                     except Exception as e:
                         app.logger.error(f'User not found {user_id}')
                         continue
@@ -236,7 +212,7 @@ class FollowingList(Resource):
                     user_id = data['user_id']
                     print('Find User: ', user_id)
                     try:
-                        user_details = get_user_details(user_id)
+                        user_details = get_user_card(user_id)
                     except Exception as e:
                         app.logger.error(f'User not found {user_id}')
                         continue
@@ -12,7 +12,7 @@ from commons.jwt_helpers import access_required
 
 api = Namespace('user_job', description='Namespace for user_job service')
 
-from core.job_services import search_jobs, update_pending_job, add_pending_job
+from core.job_services import search_jobs, update_pending_job, add_pending_job, get_job_progress, INTERACTIVE
 from core.user_services import get_user_details
 
 _http_headers = {'Content-Type': 'application/json'}
@@ -92,7 +92,8 @@ class CreateJob(Resource):
             data = request.get_json()
             job_ref_id = data['job_ref_id']
             job_type = data['job_type']
-            response = add_pending_job(job_ref_id, logged_in_user_role, job_type)
+            job_lane = data.get('job_lane', INTERACTIVE)
+            response = add_pending_job(job_ref_id, logged_in_user_role, job_type, job_lane)
             return response, 200
         except Exception as e:
             return {'message': str(e)}, 500
@@ -114,6 +115,21 @@ class UpdateJob(Resource):
             return {'message': str(e)}, 500
 
 
+@api.route('/<string:job_id>/progress')
+class JobProgress(Resource):
+
+    @api.doc('get fan-out progress of a bulk sync job')
+    def get(self, job_id):
+        try:
+            app.logger.info('job progress api called')
+            progress = get_job_progress(job_id)
+            if progress is None:
+                return {'message': 'not found'}, 404
+            return progress
+        except Exception as e:
+            return {'message': str(e)}, 500
+
+
 @api.route('/search', defaults={'page': 0})
 @api.route('/search/<int:page>')
 class SearchJob(Resource):
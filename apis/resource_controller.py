@@ -14,7 +14,7 @@ api = Namespace('resource', description='Namespace for resource service')
 
 from core.resource_services import add_resources, search_resource
 
-from core.user_services import get_user_details
+from core.user_services import get_user_card
 from core.vote_services import get_vote_count_list
 
 _http_headers = {'Content-Type': 'application/json'}
@@ -96,7 +96,7 @@ class ResourceByID(Resource):
                 data['id'] = response['_id']
                 data['resource_id'] = response['_id']
                 data['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data['updated_at']))
-                user_details = get_user_details(data['resource_writer'])
+                user_details = get_user_card(data['resource_writer'])
                 data['resource_writer_handle'] = user_details['username']
                 data['resource_writer_skill_color'] = user_details['skill_color']
                 data['vote_count'] = get_vote_count_list(data['resource_id'])
@@ -118,14 +118,16 @@ class TeamByID(Resource):
                 post_data.pop('member_list', None)
 
             search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index, _es_type, team_id)
+            update_url = 'http://{}/{}/_update/{}'.format(app.config['ES_HOST'], _es_index, team_id)
             response = rs.get(url=search_url, headers=_http_headers).json()
             if 'found' in response:
                 if response['found']:
                     data = response['_source']
-                    for key, value in post_data.items():
-                        data[key] = value
-                    data['updated_at'] = int(time.time())
-                    response = rs.put(url=search_url, json=data, headers=_http_headers).json()
+                    changes = dict(post_data)
+                    changes['updated_at'] = int(time.time())
+                    data.update(changes)
+                    # Only the changed fields are sent so concurrent follow counter updates are kept
+                    response = rs.post(url=update_url, json={'doc': changes}, headers=_http_headers).json()
                     if 'result' in response:
                         add_team_members_bulk(member_list, team_id, data['team_type'], current_user)
                         app.logger.info('Update team_details method completed')
@@ -188,6 +190,8 @@ class CreateTeam(Resource):
             data['total_score'] = 0
             data['target_score'] = 0
             data['solve_count'] = 0
+            data['follower_count'] = 0
+            data['following_count'] = 0
 
             member_list = []
             if 'member_list' in data:
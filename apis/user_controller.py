@@ -10,7 +10,9 @@ from flask_jwt_extended.exceptions import *
 from jwt.exceptions import *
 from commons.jwt_helpers import access_required
 
-from core.user_services import search_user, get_user_details, dtsearch_user
+from core.user_services import search_user, get_user_details, dtsearch_user, search_ranked_users, invalidate_user_card
+from core.leaderboard_services import get_leaderboard_rank, get_leaderboard_neighbours, remove_user_from_leaderboards, \
+    leaderboard_list, SKILL, SOLVE_COUNT, CONTRIBUTION
 from core.rating_services import add_user_ratings, get_user_rating_history
 from core.sync_services import user_problem_data_sync, user_training_model_sync
 from core.job_services import add_pending_job
@@ -124,21 +126,24 @@ class User(Resource):
             user_data = request.get_json()
 
             search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index, _es_type, user_id)
+            update_url = 'http://{}/{}/_update/{}'.format(app.config['ES_HOST'], _es_index, user_id)
             app.logger.info('Elasticsearch query : ' + str(search_url))
             response = rs.get(url=search_url, headers=_http_headers).json()
             app.logger.info('Elasticsearch response :' + str(response))
 
             if 'found' in response:
                 if response['found']:
-                    user = response['_source']
+                    changes = {}
                     for key in user_data:
                         if key not in ignore_fields and user_data[key]:
-                            user[key] = user_data[key]
+                            changes[key] = user_data[key]
 
-                    app.logger.info('Elasticsearch query : ' + str(search_url))
-                    response = rs.put(url=search_url, json=user, headers=_http_headers).json()
+                    # Only the changed fields are sent so concurrent follow counter updates are kept
+                    app.logger.info('Elasticsearch query : ' + str(update_url))
+                    response = rs.post(url=update_url, json={'doc': changes}, headers=_http_headers).json()
                     app.logger.info('Elasticsearch response :' + str(response))
                     if 'result' in response:
+                        invalidate_user_card(user_id)
                         app.logger.info('Update user API completed')
                         return response['result'], 200
                 app.logger.info('User not found')
@@ -163,6 +168,8 @@ class User(Resource):
             response = rs.delete(url=search_url, headers=_http_headers).json()
             app.logger.info('Elasticsearch response :' + str(response))
             if 'found' in response:
+                invalidate_user_card(user_id)
+                remove_user_from_leaderboards(user_id)
                 app.logger.info('Delete user API completed')
                 return response['result'], 200
             app.logger.error('Elasticsearch down')
@@ -186,19 +193,21 @@ class AdminUserControl(Resource):
             user_data = request.get_json()
 
             search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index, _es_type, user_id)
+            update_url = 'http://{}/{}/_update/{}'.format(app.config['ES_HOST'], _es_index, user_id)
             response = rs.get(url=search_url, headers=_http_headers).json()
 
             if 'found' in response:
                 if response['found']:
-                    user = response['_source']
+                    changes = {}
                     for key in user_data:
                         if key in allowed_fields and user_data[key]:
-                            user[key] = user_data[key]
+                            changes[key] = user_data[key]
 
-                    app.logger.info('Elasticsearch query : ' + str(search_url))
-                    response = rs.put(url=search_url, json=user, headers=_http_headers).json()
+                    app.logger.info('Elasticsearch query : ' + str(update_url))
+                    response = rs.post(url=update_url, json={'doc': changes}, headers=_http_headers).json()
                     app.logger.info('Elasticsearch response :' + str(response))
                     if 'result' in response:
+                        invalidate_user_card(user_id)
                         app.logger.info('Update user API completed')
                         return response['result'], 200
                 app.logger.info('User not found')
@@ -260,6 +269,8 @@ class CreateUser(Resource):
             user_data['target_score'] = 0
             user_data['solve_count'] = 0
             user_data['contribution'] = 0
+            user_data['follower_count'] = 0
+            user_data['following_count'] = 0
             post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index, _es_type)
             response = rs.post(url=post_url, json=user_data, headers=_http_headers).json()
 
@@ -384,6 +395,8 @@ class ActivateUser(Resource):
             user_data['target_score'] = 0
             user_data['solve_count'] = 0
             user_data['contribution'] = 0
+            user_data['follower_count'] = 0
+            user_data['following_count'] = 0
             post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index, _es_type)
             response = rs.post(url=post_url, json=user_data, headers=_http_headers).json()
 
@@ -418,6 +431,7 @@ class ChangePassword(Resource):
             new_pass = md5(user_data['new_password'].encode(encoding='utf-8')).hexdigest()
 
             search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index, _es_type, user_id)
+            update_url = 'http://{}/{}/_update/{}'.format(app.config['ES_HOST'], _es_index, user_id)
             response = rs.get(url=search_url, headers=_http_headers).json()
 
             if 'found' in response:
@@ -425,8 +439,7 @@ class ChangePassword(Resource):
                     data = response['_source']
                     if data['password'] != old_pass:
                         return 'Wrong password', 409
-                    data['password'] = new_pass
-                    upd_response = rs.put(url=search_url, json=data, headers=_http_headers)
+                    upd_response = rs.post(url=update_url, json={'doc': {'password': new_pass}}, headers=_http_headers)
                     if upd_response.ok:
                         app.logger.info('Password has been updated')
                         return 'updated', 200
@@ -553,13 +566,12 @@ class ConfirmPassword(Resource):
 
             new_pass = md5(user_data['new_password'].encode(encoding='utf-8')).hexdigest()
             search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index, _es_type, user_id)
+            update_url = 'http://{}/{}/_update/{}'.format(app.config['ES_HOST'], _es_index, user_id)
             response = rs.get(url=search_url, headers=_http_headers).json()
 
             if 'found' in response:
                 if response['found']:
-                    data = response['_source']
-                    data['password'] = new_pass
-                    upd_response = rs.put(url=search_url, json=data, headers=_http_headers)
+                    upd_response = rs.post(url=update_url, json={'doc': {'password': new_pass}}, headers=_http_headers)
                     if upd_response.ok:
                         app.logger.info('Password has been updated')
                         return 'updated', 200
@@ -601,7 +613,7 @@ class SearchUser(Resource):
             param = request.get_json()
             size = param.get('size', _es_size)
             param.pop('size', None)
-            user_list = search_user(param, page*size, size, sort_by='skill_value', sort_order='desc')
+            user_list = search_ranked_users(param, page*size, size, SKILL)
             return {
                 'user_list': user_list
             }
@@ -661,7 +673,7 @@ class SearchUser(Resource):
             param = request.get_json()
             size = param.get('size', _es_size)
             param.pop('size', None)
-            user_list = search_user(param, page*size, size, sort_by='solve_count', sort_order='desc')
+            user_list = search_ranked_users(param, page*size, size, SOLVE_COUNT)
             return {
                 'user_list': user_list
             }
@@ -681,7 +693,7 @@ class SearchUser(Resource):
             param = request.get_json()
             size = param.get('size', _es_size)
             param.pop('size', None)
-            user_list = search_user(param, page*size, size, sort_by='contribution', sort_order='desc')
+            user_list = search_ranked_users(param, page*size, size, CONTRIBUTION)
             return {
                 'user_list': user_list
             }
@@ -690,6 +702,40 @@ class SearchUser(Resource):
             return {'message': str(e)}, 500
 
 
+@api.route('/leaderboard/<string:board>/rank/<string:user_id>')
+class LeaderboardRank(Resource):
+
+    @api.doc('get rank of a user on a leaderboard')
+    def get(self, board, user_id):
+        app.logger.info('Leaderboard rank API called')
+        try:
+            if board not in leaderboard_list:
+                return {'message': 'bad request'}, 400
+            rank = get_leaderboard_rank(board, user_id)
+            if rank is None:
+                return {'message': 'not found'}, 404
+            return rank
+        except Exception as e:
+            return {'message': str(e)}, 500
+
+
+@api.route('/leaderboard/<string:board>/around/<string:user_id>')
+class LeaderboardNeighbours(Resource):
+
+    @api.doc('get users ranked around a user on a leaderboard')
+    def get(self, board, user_id):
+        app.logger.info('Leaderboard neighbours API called')
+        try:
+            if board not in leaderboard_list:
+                return {'message': 'bad request'}, 400
+            radius = int(request.args.get('radius', 5))
+            return {
+                'user_list': get_leaderboard_neighbours(board, user_id, radius)
+            }
+        except Exception as e:
+            return {'message': str(e)}, 500
+
+
 @api.route('/sync/<string:user_id>')
 class Sync(Resource):
 
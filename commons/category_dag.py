@@ -0,0 +1,54 @@
+class CategoryDependencyGraph:
+
+    def __init__(self, category_id_list, edge_list):
+        # An edge (category_id_1 -> category_id_2) means category_id_1 depends on category_id_2
+        self.category_id_list = []
+        self.dependency_map = {}
+        self.dependent_map = {}
+        for category_id in category_id_list:
+            self.add_category(category_id)
+        for edge in edge_list:
+            self.add_category(edge['category_id_1'])
+            self.add_category(edge['category_id_2'])
+            if edge['category_id_2'] not in self.dependency_map[edge['category_id_1']]:
+                self.dependency_map[edge['category_id_1']].append(edge['category_id_2'])
+                self.dependent_map[edge['category_id_2']].append(edge['category_id_1'])
+        self.order, self.cyclic_categories = self.generate_topological_order()
+
+    def add_category(self, category_id):
+        if category_id not in self.dependency_map:
+            self.category_id_list.append(category_id)
+            self.dependency_map[category_id] = []
+            self.dependent_map[category_id] = []
+
+    def generate_topological_order(self):
+        pending_count = {}
+        queue = []
+        for category_id in self.category_id_list:
+            pending_count[category_id] = len(self.dependency_map[category_id])
+            if pending_count[category_id] == 0:
+                queue.append(category_id)
+
+        order = []
+        idx = 0
+        while idx < len(queue):
+            category_id = queue[idx]
+            idx += 1
+            order.append(category_id)
+            for dependent_id in self.dependent_map[category_id]:
+                pending_count[dependent_id] -= 1
+                if pending_count[dependent_id] == 0:
+                    queue.append(dependent_id)
+
+        cyclic_categories = []
+        for category_id in self.category_id_list:
+            if pending_count[category_id] > 0:
+                cyclic_categories.append(category_id)
+        return order, cyclic_categories
+
+    def is_acyclic(self):
+        return len(self.cyclic_categories) == 0
+
+    def get_topological_order(self):
+        # Categories stuck on a cycle are appended in their original order so callers still visit them once
+        return self.order + self.cyclic_categories
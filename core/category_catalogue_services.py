@@ -0,0 +1,182 @@
+import time
+import copy
+import threading
+from flask import current_app as app
+
+from extensions.flask_es import es_store
+from extensions.flask_redis import redis_store
+
+from commons.category_dag import CategoryDependencyGraph
+
+_es_index_category = 'cfs_categories'
+_es_index_category_dependency = 'cfs_category_dependencies'
+_es_type = '_doc'
+_es_catalogue_size = 10000
+
+_catalogue_lock = threading.Lock()
+_catalogue_state = {
+    'catalogue': None,
+    'stale': True,
+    'subscriber': None,
+}
+
+
+def _catalogue_version_key():
+    return f'{app.config["REDIS_PREFIX_CATEGORY_CATALOGUE"]}:version'
+
+
+def _catalogue_channel():
+    return f'{app.config["REDIS_PREFIX_CATEGORY_CATALOGUE"]}:channel'
+
+
+def _listen_catalogue_updates(redis_client, channel, retry_interval):
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+            # Any bump published while we were not subscribed is lost, so start from a reload
+            _catalogue_state['stale'] = True
+            for message in pubsub.listen():
+                catalogue = _catalogue_state['catalogue']
+                if catalogue is None or str(message['data']) != str(catalogue['version']):
+                    _catalogue_state['stale'] = True
+        except Exception as e:
+            _catalogue_state['stale'] = True
+            time.sleep(retry_interval)
+
+
+def _start_catalogue_subscriber():
+    subscriber = _catalogue_state['subscriber']
+    if subscriber is not None and subscriber.is_alive():
+        return
+    retry_interval = int(app.config.get('CATEGORY_CATALOGUE_RETRY_INTERVAL', 5))
+    subscriber = threading.Thread(target=_listen_catalogue_updates, name='category-catalogue-subscriber',
+                                  args=(redis_store.redis_client, _catalogue_channel(), retry_interval), daemon=True)
+    subscriber.start()
+    _catalogue_state['subscriber'] = subscriber
+
+
+def _search_all(index):
+    query_json = {'query': {'match_all': {}}}
+    query_json['size'] = _es_catalogue_size
+    response = es_store.search(index, query_json)
+    if 'hits' in response:
+        return response['hits']['hits']
+    app.logger.error('Elasticsearch down, response: ' + str(response))
+    raise Exception('Internal server error')
+
+
+def load_category_catalogue():
+    app.logger.info('load_category_catalogue called')
+    try:
+        version = redis_store.connection.get(_catalogue_version_key())
+        catalogue = {
+            'version': int(version) if version else 0,
+            'loaded_at': int(time.time()),
+            'category_by_id': {},
+            'category_id_by_name': {},
+            'category_id_by_root': {},
+            'dependency_list_by_category': {},
+            'dependent_list_by_category': {},
+        }
+        for hit in _search_all(_es_index_category):
+            category = hit['_source']
+            category_id = hit['_id']
+            catalogue['category_by_id'][category_id] = category
+            catalogue['category_id_by_name'][category['category_name']] = category_id
+            catalogue['category_id_by_root'].setdefault(category['category_root'], []).append(category_id)
+
+        edge_list = []
+        for hit in _search_all(_es_index_category_dependency):
+            edge = hit['_source']
+            edge['id'] = hit['_id']
+            catalogue['dependency_list_by_category'].setdefault(edge['category_id_1'], []).append(edge)
+            catalogue['dependent_list_by_category'].setdefault(edge['category_id_2'], []).append(edge)
+            edge_list.append(edge)
+
+        dependency_graph = CategoryDependencyGraph(list(catalogue['category_by_id'].keys()), edge_list)
+        if not dependency_graph.is_acyclic():
+            app.logger.error(f'Category dependencies do not form a DAG, cyclic categories: {dependency_graph.cyclic_categories}')
+        catalogue['topological_order'] = dependency_graph.get_topological_order()
+        catalogue['cyclic_categories'] = dependency_graph.cyclic_categories
+        app.logger.info(f'load_category_catalogue completed for version: {catalogue["version"]}')
+        return catalogue
+    except Exception as e:
+        raise e
+
+
+def get_category_catalogue():
+    _start_catalogue_subscriber()
+    catalogue = _catalogue_state['catalogue']
+    ttl = int(app.config.get('CATEGORY_CATALOGUE_TTL', 3600))
+    if catalogue is None or _catalogue_state['stale'] or catalogue['loaded_at'] + ttl < int(time.time()):
+        with _catalogue_lock:
+            catalogue = _catalogue_state['catalogue']
+            if catalogue is None or _catalogue_state['stale'] or catalogue['loaded_at'] + ttl < int(time.time()):
+                _catalogue_state['stale'] = False
+                try:
+                    catalogue = load_category_catalogue()
+                except Exception as e:
+                    _catalogue_state['stale'] = True
+                    raise e
+                _catalogue_state['catalogue'] = catalogue
+    return catalogue
+
+
+def publish_category_catalogue_update():
+    try:
+        es_store.request('POST', es_store.url(f'{_es_index_category},{_es_index_category_dependency}', '_refresh'))
+        version = redis_store.connection.incr(_catalogue_version_key())
+        redis_store.connection.publish(_catalogue_channel(), version)
+        _catalogue_state['stale'] = True
+        app.logger.info(f'category catalogue version bumped to: {version}')
+        return version
+    except Exception as e:
+        raise e
+
+
+def get_catalogue_category(category_id):
+    catalogue = get_category_catalogue()
+    category = catalogue['category_by_id'].get(category_id, None)
+    if category is None:
+        return None
+    return copy.deepcopy(category)
+
+
+def get_catalogue_category_id_from_name(category_name):
+    catalogue = get_category_catalogue()
+    return catalogue['category_id_by_name'].get(category_name, None)
+
+
+def get_catalogue_category_list(category_root=None):
+    catalogue = get_category_catalogue()
+    if category_root is None:
+        category_id_list = list(catalogue['category_by_id'].keys())
+    else:
+        category_id_list = catalogue['category_id_by_root'].get(category_root, [])
+    item_list = []
+    for category_id in category_id_list:
+        category = copy.deepcopy(catalogue['category_by_id'][category_id])
+        category['category_id'] = category_id
+        item_list.append(category)
+    return item_list
+
+
+def get_catalogue_dependency_list(category_id_1):
+    catalogue = get_category_catalogue()
+    return copy.deepcopy(catalogue['dependency_list_by_category'].get(category_id_1, []))
+
+
+def get_catalogue_dependent_list(category_id_2):
+    catalogue = get_category_catalogue()
+    return copy.deepcopy(catalogue['dependent_list_by_category'].get(category_id_2, []))
+
+
+def get_catalogue_topological_order():
+    catalogue = get_category_catalogue()
+    return list(catalogue['topological_order'])
+
+
+def get_catalogue_cyclic_categories():
+    catalogue = get_category_catalogue()
+    return list(catalogue['cyclic_categories'])
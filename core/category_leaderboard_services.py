@@ -0,0 +1,150 @@
+import time
+from flask import current_app as app
+
+from extensions.flask_es import es_store
+from extensions.flask_redis import redis_store
+
+_es_index_user = 'cfs_users'
+_es_index_user_category = 'cfs_user_category_edges'
+_es_type = '_doc'
+
+
+def _category_leaderboard_key(category_id):
+    return f'{app.config["REDIS_PREFIX_CATEGORY_LEADERBOARD"]}:{category_id}'
+
+
+def _category_leaderboard_built_key():
+    return f'{app.config["REDIS_PREFIX_CATEGORY_LEADERBOARD"]}:built'
+
+
+def update_category_leaderboard(category_id, user_id, skill_value, pipe=None):
+    try:
+        if pipe is not None:
+            pipe.zadd(_category_leaderboard_key(category_id), {user_id: float(skill_value or 0)})
+            return
+        redis_store.connection.zadd(_category_leaderboard_key(category_id), {user_id: float(skill_value or 0)})
+    except Exception as e:
+        raise e
+
+
+def remove_user_from_category_leaderboards(user_id, category_id_list):
+    try:
+        pipe = redis_store.connection.pipeline()
+        for category_id in category_id_list:
+            pipe.zrem(_category_leaderboard_key(category_id), user_id)
+        pipe.execute()
+    except Exception as e:
+        raise e
+
+
+def is_category_leaderboard_built():
+    # Every sync zadds its categories, so a board that was never rebuilt only holds the users synced since deploy
+    try:
+        return redis_store.connection.exists(_category_leaderboard_built_key()) > 0
+    except Exception as e:
+        raise e
+
+
+def get_category_leaderboard_size(category_id):
+    try:
+        return redis_store.connection.zcard(_category_leaderboard_key(category_id))
+    except Exception as e:
+        raise e
+
+
+def get_category_leaderboard_page(category_id, start, size):
+    try:
+        entry_list = redis_store.connection.zrevrange(_category_leaderboard_key(category_id), start, start + size - 1, withscores=True)
+        item_list = []
+        rank = start + 1
+        for user_id, score in entry_list:
+            item_list.append({'user_id': user_id, 'skill_value': score, 'rank': rank})
+            rank += 1
+        return item_list
+    except Exception as e:
+        raise e
+
+
+def get_category_leaderboard_page_list(category_id_list, size):
+    try:
+        pipe = redis_store.connection.pipeline()
+        for category_id in category_id_list:
+            pipe.zrevrange(_category_leaderboard_key(category_id), 0, size - 1, withscores=True)
+        page_map = {}
+        for category_id, entry_list in zip(category_id_list, pipe.execute()):
+            page_map[category_id] = []
+            rank = 1
+            for user_id, score in entry_list:
+                page_map[category_id].append({'user_id': user_id, 'skill_value': score, 'rank': rank})
+                rank += 1
+        return page_map
+    except Exception as e:
+        raise e
+
+
+def get_category_leaderboard_rank(category_id, user_id):
+    try:
+        key = _category_leaderboard_key(category_id)
+        pipe = redis_store.connection.pipeline()
+        pipe.exists(_category_leaderboard_built_key())
+        pipe.zrevrank(key, user_id)
+        pipe.zscore(key, user_id)
+        built, position, score = pipe.execute()
+        if not built or position is None:
+            return None
+        return {'category_id': category_id, 'user_id': user_id, 'skill_value': score, 'rank': position + 1}
+    except Exception as e:
+        raise e
+
+
+def search_existing_user_id_set(user_id_list):
+    # Team syncs share the edge index, so an edge is ranked only when its owner is a user
+    try:
+        user_id_list = list(dict.fromkeys(user_id_list))
+        if len(user_id_list) == 0:
+            return set()
+        response = es_store.mget(_es_index_user, user_id_list, source='false')
+        if 'docs' not in response:
+            app.logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+        return {doc['_id'] for doc in response['docs'] if doc.get('found', False)}
+    except Exception as e:
+        raise e
+
+
+def rebuild_category_leaderboards():
+    app.logger.info('rebuild_category_leaderboards called')
+    try:
+        # Fill shadow sets and swap them in so readers never see a half built board
+        rebuild_suffix = f'rebuild:{int(time.time())}'
+        rebuilt_category_set = set()
+        edge_count = 0
+        query_json = {'query': {'match_all': {}}}
+        query_json['_source'] = ['user_id', 'category_id', 'skill_value']
+        for hit_list in es_store.search_pages(_es_index_user_category, query_json):
+            user_id_set = search_existing_user_id_set([hit['_source']['user_id'] for hit in hit_list])
+            pipe = redis_store.connection.pipeline()
+            for hit in hit_list:
+                edge = hit['_source']
+                if edge['user_id'] not in user_id_set:
+                    continue
+                rebuilt_category_set.add(edge['category_id'])
+                pipe.zadd(f'{_category_leaderboard_key(edge["category_id"])}:{rebuild_suffix}', {edge['user_id']: float(edge.get('skill_value', 0) or 0)})
+                edge_count += 1
+            pipe.execute()
+
+        built_key = _category_leaderboard_built_key()
+        pipe = redis_store.connection.pipeline()
+        for key in redis_store.connection.scan_iter(match=_category_leaderboard_key('*')):
+            if ':rebuild:' in key or key == built_key:
+                continue
+            if key.split(':')[-1] not in rebuilt_category_set:
+                pipe.delete(key)
+        for category_id in rebuilt_category_set:
+            pipe.rename(f'{_category_leaderboard_key(category_id)}:{rebuild_suffix}', _category_leaderboard_key(category_id))
+        pipe.set(built_key, int(time.time()))
+        pipe.execute()
+        app.logger.info(f'rebuild_category_leaderboards completed for {len(rebuilt_category_set)} categories, {edge_count} edges')
+        return len(rebuilt_category_set)
+    except Exception as e:
+        raise e
@@ -1,12 +1,14 @@
 import time
 import json
-import requests
 import string
 import re
 from flask import current_app as app
 
-_http_headers = {'Content-Type': 'application/json'}
+from extensions.flask_es import es_store
 
+from core.category_catalogue_services import get_catalogue_category, get_catalogue_category_id_from_name, \
+    get_catalogue_category_list, get_catalogue_dependency_list, get_catalogue_dependent_list, \
+    publish_category_catalogue_update
 from core.problem_services import get_problem_count_for_category
 from core.user_category_edge_services import get_user_category_data
 from core.comment_services import get_comment_list, get_comment_count
@@ -30,35 +32,31 @@ def create_category_id(category_name):
 def get_category_details(cat_id, user_id = None):
     app.logger.info(f'get_category_details function called for cat_id: {cat_id}, user_id: {user_id}')
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_category, _es_type, cat_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
-        if 'found' in response:
-            if response['found']:
-                data = response['_source']
-                data['category_id'] = response['_id']
-                data['comment_list'] = get_comment_list(response['_id'])
-                data['vote_count'] = get_vote_count_list(response['_id'])
-                data['comment_count'] = get_comment_count(response['_id'])
-                data['resource_list'] = search_resource({'resource_ref_id': response['_id']}, 0, _es_size)
-                data['problem_count'] = 0
-                if data['category_root'] == 'root':
-                    data['problem_count'] = get_problem_count_for_category({'category_root': data['category_name']})
+        data = get_catalogue_category(cat_id)
+        if data:
+            data['category_id'] = cat_id
+            data['comment_list'] = get_comment_list(cat_id)
+            data['vote_count'] = get_vote_count_list(cat_id)
+            data['comment_count'] = get_comment_count(cat_id)
+            data['resource_list'] = search_resource({'resource_ref_id': cat_id}, 0, _es_size)
+            data['problem_count'] = 0
+            if data['category_root'] == 'root':
+                data['problem_count'] = get_problem_count_for_category({'category_root': data['category_name']})
+            else:
+                data['problem_count'] = get_problem_count_for_category({'category_name': data['category_name']})
+
+            if user_id:
+                cat_info = get_user_category_data(user_id, data['category_id'])
+                if cat_info:
+                    skill_value = float(cat_info.get('skill_value', 0))
+                    data['skill_value'] = "{:.2f}".format(skill_value)
+                    skill = Skill()
+                    data['skill_title'] = skill.get_skill_title(skill_value)
                 else:
-                    data['problem_count'] = get_problem_count_for_category({'category_name': data['category_name']})
-
-                if user_id:
-                    cat_info = get_user_category_data(user_id, data['category_id'])
-                    if cat_info:
-                        skill_value = float(cat_info.get('skill_value', 0))
-                        data['skill_value'] = "{:.2f}".format(skill_value)
-                        skill = Skill()
-                        data['skill_title'] = skill.get_skill_title(skill_value)
-                    else:
-                        data['skill_value'] = 0
-                        data['skill_title'] = "NA"
-                app.logger.info('get_category_details completed')
-                return data
+                    data['skill_value'] = 0
+                    data['skill_title'] = "NA"
+            app.logger.info('get_category_details completed')
+            return data
         return None
     except Exception as e:
         raise e
@@ -66,34 +64,20 @@ def get_category_details(cat_id, user_id = None):
 
 def get_category_id_from_name(category_name):
     try:
-        rs = requests.session()
-        must = [
-            {'term': {'category_name': category_name}}
-        ]
-        query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = 1
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_category, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-
-        if 'hits' in response:
-            for hit in response['hits']['hits']:
-                return hit['_id']
-        return None
+        return get_catalogue_category_id_from_name(category_name)
     except Exception as e:
         raise e
 
 
 def add_category_category_dependency(data):
     try:
-        rs = requests.session()
-
         data['created_at'] = int(time.time())
         data['updated_at'] = int(time.time())
 
-        post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_category_dependency, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        response = es_store.index(_es_index_category_dependency, data)
 
         if 'result' in response and response['result'] == 'created':
+            publish_category_catalogue_update()
             return response['_id'], 201
         app.logger.error('Elasticsearch down, response: ' + str(response))
         return response, 500
@@ -103,25 +87,14 @@ def add_category_category_dependency(data):
 
 def find_category_dependency_list(category_id_1):
     try:
-        rs = requests.session()
-        must = [
-            {'term': {'category_id_1': category_id_1}}
-        ]
-        query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_category_dependency, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
         item_list = []
-        if 'hits' in response:
-            for hit in response['hits']['hits']:
-                category = hit['_source']
-                category.pop('category_id_1', None)
-                category['category_info'] = get_category_details(category['category_id_2'])
-                category['category_id'] = category['category_id_2']
-                category.pop('category_id_2', None)
-                item_list.append(category)
-            return item_list
-        app.logger.error('Elasticsearch down, response: ' + str(response))
+        for category in get_catalogue_dependency_list(category_id_1):
+            category.pop('id', None)
+            category.pop('category_id_1', None)
+            category['category_info'] = get_category_details(category['category_id_2'])
+            category['category_id'] = category['category_id_2']
+            category.pop('category_id_2', None)
+            item_list.append(category)
         return item_list
     except Exception as e:
         raise e
@@ -129,25 +102,14 @@ def find_category_dependency_list(category_id_1):
 
 def find_dependent_category_list(category_id_2):
     try:
-        rs = requests.session()
-        must = [
-            {'term': {'category_id_2': category_id_2}}
-        ]
-        query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_category_dependency, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
         item_list = []
-        if 'hits' in response:
-            for hit in response['hits']['hits']:
-                category = hit['_source']
-                category.pop('category_id_2', None)
-                category['category_info'] = get_category_details(category['category_id_1'])
-                category['category_id'] = category['category_id_1']
-                category.pop('category_id_1', None)
-                item_list.append(category)
-            return item_list
-        app.logger.error('Elasticsearch down, response: ' + str(response))
+        for category in get_catalogue_dependent_list(category_id_2):
+            category.pop('id', None)
+            category.pop('category_id_2', None)
+            category['category_info'] = get_category_details(category['category_id_1'])
+            category['category_id'] = category['category_id_1']
+            category.pop('category_id_1', None)
+            item_list.append(category)
         return item_list
     except Exception as e:
         raise e
@@ -157,9 +119,8 @@ def find_category_dependency_list_for_multiple_categories(category_list):
     try:
         dependent_categories = []
         for category in category_list:
-            dep_list = find_category_dependency_list(category)
-            for category_data in dep_list:
-                category_id = category_data['category_id']
+            for edge in get_catalogue_dependency_list(category):
+                category_id = edge['category_id_2']
                 if category_id not in dependent_categories:
                     dependent_categories.append(category_id)
         return dependent_categories
@@ -170,8 +131,6 @@ def find_category_dependency_list_for_multiple_categories(category_list):
 def search_categories(param, from_value, size_value, heavy = False):
     try:
         query_json = {'query': {'match_all': {}}}
-        rs = requests.session()
-
         must = []
         keyword_fields = ['category_title', 'category_root']
         user_id = param.get('user_id', None)
@@ -212,8 +171,28 @@ def search_categories(param, from_value, size_value, heavy = False):
         query_json['from'] = from_value
         query_json['size'] = size_value
         print('query_json: ', json.dumps(query_json))
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_category, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+
+        # Exact filters are answered from the catalogue, full text search still goes to elasticsearch
+        text_search = False
+        for f in param:
+            if f not in keyword_fields and param[f]:
+                text_search = True
+
+        if text_search:
+            response = es_store.search(_es_index_category, query_json)
+        else:
+            hits = []
+            for category in get_catalogue_category_list(param.get('category_root', None) or None):
+                if 'category_root' not in param and category['category_root'] == 'root':
+                    continue
+                if param.get('category_title', None) and category.get('category_title', None) != param['category_title']:
+                    continue
+                category_difficulty = category.get('category_difficulty', None)
+                if category_difficulty is None or not minimum_difficulty <= float(category_difficulty) <= maximum_difficulty:
+                    continue
+                category_id = category.pop('category_id')
+                hits.append({'_id': category_id, '_source': category})
+            response = {'hits': {'hits': hits[from_value:from_value+size_value]}}
         # print('response: ', response)
         item_list = []
         if 'hits' in response:
@@ -245,34 +224,23 @@ def search_categories(param, from_value, size_value, heavy = False):
 def calculate_dependency_percentage():
     try:
         app.logger.info('calculate_dependency_percentage called')
-        rs = requests.session()
-        category_list = search_categories({}, 0, _es_size)
+        category_list = get_catalogue_category_list()
         for category in category_list:
+            if category['category_root'] == 'root':
+                continue
             category_id = category['category_id']
-            must = [
-                {'term': {'category_id_1': category_id}}
-            ]
-            query_json = {'query': {'bool': {'must': must}}}
-            query_json['size'] = _es_size
-            search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_category_dependency, _es_type)
-            response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-
-            dcat_list = []
+            dcat_list = get_catalogue_dependency_list(category_id)
             total_factor = 0
-            if 'hits' in response:
-                for hit in response['hits']['hits']:
-                    dcat = hit['_source']
-                    dcat['id'] = hit['_id']
-                    total_factor += float(dcat['dependency_factor'])
-                    dcat_list.append(dcat)
+            for dcat in dcat_list:
+                total_factor += float(dcat['dependency_factor'])
 
             for dcat in dcat_list:
                 id = dcat['id']
                 dcat.pop('id', None)
                 own_factor = float(dcat['dependency_factor'])
                 dcat['dependency_percentage'] = own_factor*100.0/total_factor
-                url = 'http://{}/{}/{}/{}/'.format(app.config['ES_HOST'], _es_index_category_dependency, _es_type, id)
-                rs.put(url=url, json=dcat, headers=_http_headers).json()
+                es_store.index(_es_index_category_dependency, dcat, id)
+        publish_category_catalogue_update()
         app.logger.info('calculate_dependency_percentage completed')
     except Exception as e:
         raise e
@@ -1,11 +1,10 @@
 import time
 import json
-import requests
 from flask import current_app as app
 
-from core.user_services import get_user_details
+from extensions.flask_es import es_store
 
-_http_headers = {'Content-Type': 'application/json'}
+from core.user_services import get_user_cards
 
 _es_index_classroom_tasks = 'cfs_classroom_tasks'
 _es_index_classroom_classes = 'cfs_classroom_classes'
@@ -20,7 +19,6 @@ EXPIRED = 'EXPIRED'
 
 def search_task_lists(param, from_val, size_val):
     try:
-        rs = requests.session()
         query_json = {'query': {'match_all': {}}}
 
         must = []
@@ -38,14 +36,14 @@ def search_task_lists(param, from_val, size_val):
         query_json['from'] = from_val
         query_json['size'] = size_val
         query_json['sort'] = [{'updated_at': {'order': 'desc'}}]
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_classroom_tasks, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_classroom_tasks, query_json)
         item_list = []
         if 'hits' in response:
+            user_card_map = get_user_cards([hit['_source']['task_added_by'] for hit in response['hits']['hits']])
             for hit in response['hits']['hits']:
                 data = hit['_source']
                 data['id'] = hit['_id']
-                user_details = get_user_details(data['task_added_by'])
+                user_details = user_card_map[data['task_added_by']]
                 data['task_added_by_user_handle'] = user_details['username']
                 data['task_added_by_user_skill_color'] = user_details['skill_color']
                 item_list.append(data)
@@ -57,7 +55,6 @@ def search_task_lists(param, from_val, size_val):
 
 def search_class_lists(param, from_val, size_val):
     try:
-        rs = requests.session()
         query_json = {'query': {'match_all': {}}}
 
         must = []
@@ -75,14 +72,14 @@ def search_class_lists(param, from_val, size_val):
         query_json['from'] = from_val
         query_json['size'] = size_val
         query_json['sort'] = [{'updated_at': {'order': 'desc'}}]
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_classroom_classes, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_classroom_classes, query_json)
         item_list = []
         if 'hits' in response:
+            user_card_map = get_user_cards([hit['_source']['class_moderator_id'] for hit in response['hits']['hits']])
             for hit in response['hits']['hits']:
                 data = hit['_source']
                 data['id'] = hit['_id']
-                user_details = get_user_details(data['class_moderator_id'])
+                user_details = user_card_map[data['class_moderator_id']]
                 data['class_moderator_id_user_handle'] = user_details['username']
                 data['class_moderator_skill_color'] = user_details['skill_color']
                 item_list.append(data)
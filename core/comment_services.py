@@ -1,44 +1,56 @@
 import time
 import json
-import requests
 from flask import current_app as app
 import random
 
-from core.user_services import get_user_details
+from extensions.flask_es import es_store
 
-from core.vote_services import get_vote_count_list
+from core.user_services import get_user_cards
 
-_http_headers = {'Content-Type': 'application/json'}
+from core.vote_services import get_vote_count_list_for_ref_list
 
 _es_index_comment = 'cfs_comments'
 
 _es_type = '_doc'
 _es_size = 100
+_es_thread_size = 1000
 
 
-def dfs_comment_tree(cur_node_id):
+def get_comment_ref_id(comment_parent_id):
     try:
-        rs = requests.session()
-        must = [{'term': {'comment_parent_id': cur_node_id}}]
+        response = es_store.get(_es_index_comment, comment_parent_id)
+        if 'found' in response:
+            if response['found']:
+                return response['_source'].get('comment_ref_id', comment_parent_id)
+            return comment_parent_id
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def set_comment_ref_id(data):
+    # Replies carry the ref id of the thread root so a whole thread is fetched with one query
+    try:
+        if 'comment_parent_id' in data:
+            data['comment_ref_id'] = get_comment_ref_id(data['comment_parent_id'])
+        return data
+    except Exception as e:
+        raise e
+
+
+def find_thread_comment_list(comment_ref_id, size=_es_thread_size):
+    try:
+        must = [{'term': {'comment_ref_id': comment_ref_id}}]
         query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_comment, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        print('response: ', json.dumps(response))
+        query_json['sort'] = [{'created_at': {'order': 'asc'}}]
+        query_json['size'] = size
+        response = es_store.search(_es_index_comment, query_json)
         if 'hits' in response:
             comment_list = []
             for hit in response['hits']['hits']:
                 data = hit['_source']
                 data['comment_id'] = hit['_id']
-                data['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data['updated_at']))
-                if 'comment_writer' in data:
-                    user_details = get_user_details(data['comment_writer'])
-                    data['comment_writer_handle'] = user_details['username']
-                    data['comment_writer_skill_color'] = user_details['skill_color']
-                data['comment_id'] = hit['_id']
-                data['vote_count'] = get_vote_count_list(data['comment_id'])
-                child_list = dfs_comment_tree(data['comment_id'])
-                data['comment_list'] = child_list
                 comment_list.append(data)
             return comment_list
         app.logger.error('Elasticsearch down, response: ' + str(response))
@@ -47,26 +59,142 @@ def dfs_comment_tree(cur_node_id):
         raise e
 
 
+def build_comment_tree(comment_ref_id, comment_list, max_depth=None):
+    child_list_map = {}
+    for comment in comment_list:
+        child_list_map.setdefault(comment.get('comment_parent_id', comment_ref_id), []).append(comment)
+
+    def attach_children(comment, depth):
+        child_list = child_list_map.get(comment['comment_id'], [])
+        if max_depth is not None and depth >= max_depth:
+            comment['comment_list'] = []
+            comment['reply_count'] = len(child_list)
+            return
+        comment['comment_list'] = child_list
+        for child in child_list:
+            attach_children(child, depth + 1)
+
+    root_list = child_list_map.get(comment_ref_id, [])
+    for comment in root_list:
+        attach_children(comment, 1)
+    return root_list
+
+
+def hydrate_comment_list(comment_list):
+    writer_details = get_user_cards([comment['comment_writer'] for comment in comment_list if 'comment_writer' in comment])
+    vote_count_map = get_vote_count_list_for_ref_list([comment['comment_id'] for comment in comment_list])
+
+    for comment in comment_list:
+        comment['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(comment['updated_at']))
+        if comment.get('comment_writer', None) in writer_details:
+            user_details = writer_details[comment['comment_writer']]
+            comment['comment_writer_handle'] = user_details['username']
+            comment['comment_writer_skill_color'] = user_details['skill_color']
+        comment['vote_count'] = vote_count_map[comment['comment_id']]
+    return comment_list
+
+
+def get_comment_list(blog_id, max_depth=None, size=_es_thread_size):
+    try:
+        comment_list = hydrate_comment_list(find_thread_comment_list(blog_id, size))
+        return build_comment_tree(blog_id, comment_list, max_depth)
+    except Exception as e:
+        raise e
+
+
+def get_comment_list_for_ref_list(ref_id_list, max_depth=None):
+    try:
+        comment_list_map = {}
+        for ref_id in ref_id_list:
+            comment_list_map[ref_id] = []
+        if len(ref_id_list) == 0:
+            return comment_list_map
+
+        query_json = {'query': {'bool': {'must': [{'terms': {'comment_ref_id': list(ref_id_list)}}]}}}
+        query_json['sort'] = [{'created_at': {'order': 'asc'}}]
+        comment_list = []
+        for hit_list in es_store.search_pages(_es_index_comment, query_json):
+            for hit in hit_list:
+                data = hit['_source']
+                data['comment_id'] = hit['_id']
+                comment_list.append(data)
+
+        thread_map = {}
+        for comment in hydrate_comment_list(comment_list):
+            thread_map.setdefault(comment['comment_ref_id'], []).append(comment)
+        for ref_id, thread in thread_map.items():
+            comment_list_map[ref_id] = build_comment_tree(ref_id, thread, max_depth)
+        return comment_list_map
+    except Exception as e:
+        raise e
+
+
+def backfill_comment_ref_ids():
+    app.logger.info('backfill_comment_ref_ids called')
+    try:
+        parent_map = {}
+        ref_map = {}
+        query_json = {'query': {'match_all': {}}}
+        query_json['_source'] = ['comment_parent_id', 'comment_ref_id']
+        for hit_list in es_store.search_pages(_es_index_comment, query_json):
+            for hit in hit_list:
+                parent_map[hit['_id']] = hit['_source'].get('comment_parent_id', None)
+                ref_map[hit['_id']] = hit['_source'].get('comment_ref_id', None)
+
+        def find_root(comment_id):
+            # The first ancestor that is not a comment is the problem, category or blog the thread hangs off
+            visited = set()
+            cur_id = comment_id
+            while cur_id in parent_map and cur_id not in visited:
+                visited.add(cur_id)
+                if parent_map[cur_id] is None:
+                    return ref_map[cur_id]
+                cur_id = parent_map[cur_id]
+            return cur_id
+
+        updated = 0
+        with es_store.bulk_writer() as writer:
+            for comment_id in parent_map:
+                comment_ref_id = find_root(comment_id)
+                if comment_ref_id is not None and comment_ref_id != ref_map[comment_id]:
+                    writer.upsert(_es_index_comment, comment_id, {'comment_ref_id': comment_ref_id})
+                    updated += 1
+        app.logger.info(f'backfill_comment_ref_ids completed, updated: {updated}')
+        return updated
+    except Exception as e:
+        raise e
+
+
 def get_comment_count(blog_id):
     try:
-        rs = requests.session()
         must = [{'term': {'comment_ref_id': blog_id}}]
         query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = 0
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_comment, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        if 'hits' in response:
-            return response['hits']['total']['value']
+        response = es_store.count(_es_index_comment, query_json)
+        if 'count' in response:
+            return response['count']
         app.logger.error('Elasticsearch down, response: ' + str(response))
         raise Exception('Internal server error')
     except Exception as e:
         raise e
 
 
-def get_comment_list(blog_id):
+def get_comment_count_for_ref_list(ref_id_list):
     try:
-        comment_list = dfs_comment_tree(blog_id)
-        return comment_list
+        comment_count_map = {}
+        for ref_id in ref_id_list:
+            comment_count_map[ref_id] = 0
+        if len(ref_id_list) == 0:
+            return comment_count_map
+
+        query_json = {'query': {'bool': {'must': [{'terms': {'comment_ref_id': list(ref_id_list)}}]}}}
+        query_json['size'] = 0
+        query_json['aggs'] = {'comment_ref': {'terms': {'field': 'comment_ref_id', 'size': len(ref_id_list)}}}
+        response = es_store.search(_es_index_comment, query_json)
+        if 'aggregations' in response:
+            for bucket in response['aggregations']['comment_ref']['buckets']:
+                comment_count_map[bucket['key']] = bucket['doc_count']
+            return comment_count_map
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
     except Exception as e:
         raise e
-
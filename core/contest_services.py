@@ -1,18 +1,17 @@
 import time
 import json
-import requests
 from flask import current_app as app
 import random
 
+from extensions.flask_es import es_store
+
 from core.problem_services import get_problem_details, search_problems, find_problems_by_status_filtered_for_user_list, get_user_problem_status
 from core.team_services import get_team_details
 from models.contest_model import ContestModel
-from core.user_services import get_user_details, get_user_details_public
+from core.user_services import get_user_details_public, get_user_card, get_user_cards
 from core.follower_services import get_following_list
 from commons.skillset import Skill
 
-_http_headers = {'Content-Type': 'application/json'}
-
 _es_index_contest = 'cfs_contests'
 _es_index_announcement = 'cfs_contest_announcements'
 _es_index_contest_configs = 'cfs_contest_configs'
@@ -39,15 +38,12 @@ def get_problem_order(x):
 
 def get_contest_details(contest_id):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_contest, _es_type, contest_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_contest, contest_id)
         if 'found' in response:
             if response['found']:
                 data = response['_source']
                 data['id'] = response['_id']
-                setter_data = get_user_details(data['setter_id'])
-                data['setter_handle'] = setter_data['username']
+                setter_data = get_user_card(data['setter_id'])
                 data['setter_handle'] = setter_data['username']
                 data['setter_skill_color'] = setter_data['skill_color']
                 data['problem_set'] = find_problem_set_for_contest(contest_id)
@@ -61,11 +57,9 @@ def get_contest_details(contest_id):
 
 def create_contest(data):
     try:
-        rs = requests.session()
         data['created_at'] = int(time.time())
         data['updated_at'] = int(time.time())
-        post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_contest, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        response = es_store.index(_es_index_contest, data)
         if 'result' in response and response['result'] == 'created':
             return response['_id']
         raise Exception('ES Down')
@@ -75,7 +69,6 @@ def create_contest(data):
 
 def add_problem_for_contest(problem_id, contest_id, pos):
     try:
-        rs = requests.session()
         data = {
             'problem_id': problem_id,
             'problem_order': get_problem_order(pos),
@@ -83,8 +76,7 @@ def add_problem_for_contest(problem_id, contest_id, pos):
             'created_at': int(time.time()),
             'updated_at': int(time.time())
         }
-        post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_contest_problem_edges, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        response = es_store.index(_es_index_contest_problem_edges, data)
         if 'result' in response and response['result'] == 'created':
             return response['_id']
         raise Exception('ES Down')
@@ -94,11 +86,9 @@ def add_problem_for_contest(problem_id, contest_id, pos):
 
 def find_problem_set_for_contest(contest_id):
     try:
-        rs = requests.session()
         query_json = {'query': {'bool': {'must': [{'term': {'contest_id': contest_id}}]}}}
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_contest_problem_edges, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_contest_problem_edges, query_json)
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
@@ -115,10 +105,8 @@ def find_problem_set_for_contest(contest_id):
 
 def delete_problem_set_for_contest(contest_id):
     try:
-        rs = requests.session()
         query_json = {'query': {'bool': {'must': [{'term': {'contest_id': contest_id}}]}}}
-        search_url = 'http://{}/{}/{}/_delete_by_query'.format(app.config['ES_HOST'], _es_index_contest_problem_edges, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.delete_by_query(_es_index_contest_problem_edges, query_json)
         if 'deleted' in response:
             return {'message': 'success'}
         raise Exception('ES Down')
@@ -155,11 +143,9 @@ def create_problem_set(data, contest_id):
 
 def find_contest_configs(contest_level):
     try:
-        rs = requests.session()
         query_json = {'query': {'bool': {'must': {'term': {'contest_level': contest_level}}}}}
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_contest_configs, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_contest_configs, query_json)
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
@@ -197,8 +183,6 @@ def reupload_problem_set_for_contest(contest_id, problem_list):
 def search_contests(param, from_value, size_value):
     try:
         query_json = {'query': {'match_all': {}}}
-        rs = requests.session()
-
         must = []
         keyword_fields = ['setter_id', 'contest_ref_id', 'contest_type', 'contest_level']
 
@@ -236,14 +220,14 @@ def search_contests(param, from_value, size_value):
         query_json['from'] = from_value
         query_json['size'] = size_value
         print('query_json: ', json.dumps(query_json))
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_contest, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_contest, query_json)
         item_list = []
         if 'hits' in response:
+            setter_card_map = get_user_cards([hit['_source']['setter_id'] for hit in response['hits']['hits']])
             for hit in response['hits']['hits']:
                 data = hit['_source']
                 data['id'] = hit['_id']
-                setter_data = get_user_details(data['setter_id'])
+                setter_data = setter_card_map[data['setter_id']]
                 data['setter_handle'] = setter_data['username']
                 data['setter_skill_color'] = setter_data['skill_color']
                 item_list.append(data)
@@ -327,11 +311,9 @@ def contest_standings(contest_id, user_id=None):
 
 def add_announcement(data):
     try:
-        rs = requests.session()
         data['created_at'] = int(time.time())
         data['updated_at'] = int(time.time())
-        post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_announcement, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        response = es_store.index(_es_index_announcement, data)
         if 'result' in response and response['result'] == 'created':
             return response['_id']
         raise Exception('ES Down')
@@ -341,12 +323,10 @@ def add_announcement(data):
 
 def get_announcements(contest_id):
     try:
-        rs = requests.session()
         must = [{'term': {'contest_id': contest_id}}]
         query_json = {'query': {'bool': {'must': must}}}
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_announcement, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_announcement, query_json)
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
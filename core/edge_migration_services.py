@@ -0,0 +1,101 @@
+import time
+import json
+from flask import current_app as app
+
+from extensions.flask_es import es_store
+
+from core.problem_services import generate_user_problem_edge_id
+from core.user_category_edge_services import generate_user_category_edge_id
+
+_es_index_problem_user = 'cfs_user_problem_edges'
+_es_index_user_category = 'cfs_user_category_edges'
+_es_type = '_doc'
+_es_scroll_size = 2000
+_es_scroll_keep_alive = '5m'
+
+SOLVED = 'SOLVED'
+
+
+def choose_user_problem_edge(edge_list):
+    # A solved edge always wins; among equals the most recently updated one is kept
+    solved_list = [edge for edge in edge_list if edge.get('status', None) == SOLVED]
+    candidate_list = solved_list if len(solved_list) > 0 else edge_list
+    return max(candidate_list, key=lambda edge: edge.get('updated_at', 0) or 0)
+
+
+def choose_user_category_edge(edge_list):
+    return max(edge_list, key=lambda edge: edge.get('updated_at', 0) or 0)
+
+
+def merge_edge_group(hit_list, edge_id, choose_edge):
+    edge_list = [hit['_source'] for hit in hit_list]
+    edge = dict(choose_edge(edge_list))
+    created_at_list = [e['created_at'] for e in edge_list if e.get('created_at', None) is not None]
+    if len(created_at_list) > 0:
+        edge['created_at'] = min(created_at_list)
+    stale_id_list = [hit['_id'] for hit in hit_list if hit['_id'] != edge_id]
+    return edge, stale_id_list
+
+
+def migrate_edge_index(index, ref_field, generate_edge_id, choose_edge):
+    app.logger.info(f'migrate_edge_index called for index: {index}')
+    try:
+        stat = {'scanned': 0, 'rewritten': 0, 'deleted': 0}
+        query_json = {'query': {'match_all': {}}}
+        query_json['size'] = _es_scroll_size
+        query_json['sort'] = [{'user_id': {'order': 'asc'}}, {ref_field: {'order': 'asc'}}]
+        response = es_store.search(index, query_json, params={'scroll': _es_scroll_keep_alive})
+        scroll_id = response.get('_scroll_id', None)
+
+        writer = es_store.bulk_writer()
+        group_key = None
+        group = []
+
+        def flush_group():
+            if len(group) == 0:
+                return
+            edge_id = generate_edge_id(group_key[0], group_key[1])
+            if len(group) == 1 and group[0]['_id'] == edge_id:
+                return
+            edge, stale_id_list = merge_edge_group(group, edge_id, choose_edge)
+            writer.index(index, edge_id, edge)
+            stat['rewritten'] += 1
+            for stale_id in stale_id_list:
+                writer.delete(index, stale_id)
+                stat['deleted'] += 1
+
+        try:
+            while 'hits' in response and len(response['hits']['hits']) > 0:
+                for hit in response['hits']['hits']:
+                    stat['scanned'] += 1
+                    key = (hit['_source']['user_id'], hit['_source'][ref_field])
+                    if key != group_key:
+                        flush_group()
+                        group_key = key
+                        group = []
+                    group.append(hit)
+                response = es_store.scroll(scroll_id, _es_scroll_keep_alive)
+                scroll_id = response.get('_scroll_id', scroll_id)
+            flush_group()
+            writer.flush({'refresh': 'wait_for'})
+        finally:
+            if scroll_id:
+                es_store.clear_scroll(scroll_id)
+
+        if 'hits' not in response:
+            app.logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+        app.logger.info(f'migrate_edge_index completed for index: {index}, stat: {json.dumps(stat)}')
+        return stat
+    except Exception as e:
+        raise e
+
+
+def migrate_user_edge_ids():
+    try:
+        return {
+            _es_index_problem_user: migrate_edge_index(_es_index_problem_user, 'problem_id', generate_user_problem_edge_id, choose_user_problem_edge),
+            _es_index_user_category: migrate_edge_index(_es_index_user_category, 'category_id', generate_user_category_edge_id, choose_user_category_edge),
+        }
+    except Exception as e:
+        raise e
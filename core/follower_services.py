@@ -1,26 +1,37 @@
 import time
 import json
-import requests
 from flask import current_app as app
 
-_http_headers = {'Content-Type': 'application/json'}
+from extensions.flask_es import es_store
 
 _es_index_followers = 'cfs_followers'
+_es_index_user = 'cfs_users'
+_es_index_team = 'cfs_teams'
 
 _es_type = '_doc'
 _es_size = 100
+_es_retry_on_conflict = 5
+_es_rebuild_batch_size = 500
+
+FOLLOWER_COUNT = 'follower_count'
+FOLLOWING_COUNT = 'following_count'
+
+# Documents created before the counters existed keep falling back to counting cfs_followers until rebuilt.
+# They are still reindexed rather than skipped, so the sequence number a rebuild holds goes stale.
+_follow_counter_script = """
+if (ctx._source.containsKey(params.field)) {
+    ctx._source[params.field] += params.delta;
+}
+"""
 
 
 def get_followed_by_count(user_id):
     try:
-        rs = requests.session()
         must = [{'term': {'user_id': user_id}}]
         query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = 0
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_followers, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        if 'hits' in response:
-            return response['hits']['total']['value']
+        response = es_store.count(_es_index_followers, query_json)
+        if 'count' in response:
+            return response['count']
         return 0
 
     except Exception as e:
@@ -29,42 +40,192 @@ def get_followed_by_count(user_id):
 
 def get_following_count(user_id):
     try:
-        rs = requests.session()
         must = [{'term': {'followed_by': user_id}}]
         query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = 0
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_followers, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        if 'hits' in response:
-            return response['hits']['total']['value']
+        response = es_store.count(_es_index_followers, query_json)
+        if 'count' in response:
+            return response['count']
         return 0
 
     except Exception as e:
         raise e
 
 
-def get_follow_stat(user_id):
+def get_follow_stat(user_id, data=None):
     try:
+        if data is not None and FOLLOWER_COUNT in data and FOLLOWING_COUNT in data:
+            return {
+                'following_count': data[FOLLOWING_COUNT],
+                'follower_count': data[FOLLOWER_COUNT]
+            }
         following_count = get_following_count(user_id)
         follower_count = get_followed_by_count(user_id)
         data = {
             'following_count': following_count,
             'follower_count': follower_count
         }
-        print('data: ', data)
         return data
     except Exception as e:
         raise e
 
 
+def generate_follower_edge_id(user_id, followed_by):
+    return f'{user_id}:{followed_by}'
+
+
+def is_following(user_id, followed_by):
+    try:
+        must = [
+            {'term': {'user_id': user_id}},
+            {'term': {'followed_by': followed_by}},
+        ]
+        query_json = {'query': {'bool': {'must': must}}}
+        response = es_store.count(_es_index_followers, query_json)
+        if 'count' in response:
+            return response['count'] > 0
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def apply_follow_counter(ref_id, field, delta):
+    try:
+        script = {
+            'source': _follow_counter_script,
+            'lang': 'painless',
+            'params': {'field': field, 'delta': delta}
+        }
+        params = {'retry_on_conflict': _es_retry_on_conflict}
+        # Users and teams can both be followed, so a miss on users falls through to teams
+        for index in [_es_index_user, _es_index_team]:
+            response = es_store.script_update(index, ref_id, script, params=params)
+            if 'result' in response:
+                return response['result']
+            if response.get('status', None) != 404:
+                app.logger.error('Elasticsearch down, response: ' + str(response))
+                raise Exception('Internal server error')
+        return None
+    except Exception as e:
+        raise e
+
+
+def follow_user(user_id, followed_by):
+    try:
+        edge_id = generate_follower_edge_id(user_id, followed_by)
+        if is_following(user_id, followed_by):
+            return edge_id
+        data = {
+            'user_id': user_id,
+            'followed_by': followed_by,
+            'created_at': int(time.time()),
+            'updated_at': int(time.time()),
+        }
+        response = es_store.index(_es_index_followers, data, edge_id, params={'op_type': 'create', 'refresh': 'wait_for'})
+        if 'result' in response and response['result'] == 'created':
+            apply_follow_counter(user_id, FOLLOWER_COUNT, 1)
+            apply_follow_counter(followed_by, FOLLOWING_COUNT, 1)
+            return edge_id
+        if response.get('status', None) == 409:
+            return edge_id
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def unfollow_user(user_id, followed_by):
+    try:
+        must = [
+            {'term': {'user_id': user_id}},
+            {'term': {'followed_by': followed_by}},
+        ]
+        query_json = {'query': {'bool': {'must': must}}}
+        response = es_store.delete_by_query(_es_index_followers, query_json, params={'refresh': 'true', 'conflicts': 'proceed'})
+        if 'deleted' not in response:
+            app.logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+        if response['deleted'] > 0:
+            apply_follow_counter(user_id, FOLLOWER_COUNT, -response['deleted'])
+            apply_follow_counter(followed_by, FOLLOWING_COUNT, -response['deleted'])
+        return response
+    except Exception as e:
+        raise e
+
+
+def count_follow_edges(field, ref_id_list):
+    query_json = {'query': {'bool': {'must': [{'terms': {field: list(ref_id_list)}}]}}}
+    query_json['size'] = 0
+    query_json['aggs'] = {'follow_ref': {'terms': {'field': field, 'size': len(ref_id_list)}}}
+    response = es_store.search(_es_index_followers, query_json)
+    if 'aggregations' not in response:
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    count_map = {}
+    for bucket in response['aggregations']['follow_ref']['buckets']:
+        count_map[bucket['key']] = bucket['doc_count']
+    return count_map
+
+
+def rebuild_follow_counter_batch(index, ref_id_list):
+    # Sequence numbers are read before counting. A follow that lands after the count bumps the sequence number,
+    # so the write fails with a version conflict and the document is counted again instead of losing the follow
+    while len(ref_id_list) > 0:
+        response = es_store.mget(index, ref_id_list, source='false')
+        if 'docs' not in response:
+            app.logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+        doc_list = [doc for doc in response['docs'] if doc.get('found', False)]
+        if len(doc_list) == 0:
+            return
+        follower_count_map = count_follow_edges('user_id', ref_id_list)
+        following_count_map = count_follow_edges('followed_by', ref_id_list)
+
+        actions = []
+        for doc in doc_list:
+            action = {'update': {'_index': index, '_id': doc['_id'], 'if_seq_no': doc['_seq_no'],
+                                 'if_primary_term': doc['_primary_term']}}
+            data = {
+                FOLLOWER_COUNT: follower_count_map.get(doc['_id'], 0),
+                FOLLOWING_COUNT: following_count_map.get(doc['_id'], 0),
+            }
+            actions.append((action, {'doc': data}))
+        response = es_store.bulk(actions)
+        if 'items' not in response:
+            raise Exception('Elasticsearch bulk request failed: ' + str(response)[:1000])
+
+        conflict_list = []
+        for item in response['items']:
+            result = item['update']
+            if result.get('status', None) == 409:
+                conflict_list.append(result['_id'])
+            elif 'error' in result and result.get('status', None) != 404:
+                raise Exception('Elasticsearch bulk request failed: ' + str(result['error'])[:1000])
+        ref_id_list = conflict_list
+
+
+def rebuild_follow_counters():
+    app.logger.info('rebuild_follow_counters called')
+    try:
+        updated = 0
+        for index in [_es_index_user, _es_index_team]:
+            query_json = {'query': {'match_all': {}}, '_source': False}
+            for hit_list in es_store.search_pages(index, query_json, page_size=_es_rebuild_batch_size):
+                ref_id_list = [hit['_id'] for hit in hit_list]
+                rebuild_follow_counter_batch(index, ref_id_list)
+                updated += len(ref_id_list)
+        app.logger.info(f'rebuild_follow_counters completed for {updated} documents')
+        return updated
+    except Exception as e:
+        raise e
+
+
 def get_following_list(user_id):
     try:
-        rs = requests.session()
         must = [{'term': {'followed_by': user_id}}]
         query_json = {'query': {'bool': {'must': must}}}
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_followers, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_followers, query_json)
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
@@ -1,13 +1,12 @@
 import time
 import json
-import requests
 from flask import current_app as app
 import random
 
-from core.redis_services import add_new_job
-from commons.skillset import Skill
+from extensions.flask_es import es_store
 
-_http_headers = {'Content-Type': 'application/json'}
+from core.redis_services import add_new_job, enqueue_sync_job, get_sync_job_progress
+from commons.skillset import Skill
 
 _es_index_jobs = 'cfs_sync_jobs'
 _es_index_team = 'cfs_teams'
@@ -18,19 +17,21 @@ _es_size = 50
 PENDING = 'PENDING'
 PROCESSING = 'PROCESSING'
 COMPLETED = 'COMPLETED'
+COALESCED = 'COALESCED'
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
 USER_SYNC = 'USER_SYNC'
 TEAM_SYNC = 'TEAM_SYNC'
 
 user_sync_ref_types = ['USER_SYNC', 'USER_SYNC_RESTORE', 'SYNC_ALL_USERS', 'RESTORE_ALL_USERS', 'SYNC_ALL_TEAMS',
                        'RESTORE_ALL_TEAMS']
 team_sync_ref_types = ['TEAM_SYNC', 'TEAM_SYNC_RESTORE']
+bulk_job_types = ['SYNC_ALL_USERS', 'RESTORE_ALL_USERS', 'SYNC_ALL_TEAMS', 'RESTORE_ALL_TEAMS']
 
 
 def get_user_details(user_id):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user, _es_type, user_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_user, user_id)
         print('response: ', response)
         if 'found' in response:
             if response['found']:
@@ -45,9 +46,7 @@ def get_user_details(user_id):
 
 def get_team_details(team_id):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_team, _es_type, team_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_team, team_id)
 
         if 'found' in response:
             if response['found']:
@@ -66,7 +65,6 @@ def get_team_details(team_id):
 def search_jobs(param, page, size):
     try:
         app.logger.info('search_jobs called')
-        rs = requests.session()
         fields = ['job_ref_id', 'job_type', 'status']
         must = []
         for f in param:
@@ -84,8 +82,7 @@ def search_jobs(param, page, size):
         query_json['from'] = page*size
         query_json['size'] = size
         print('query_json: ', query_json)
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_jobs, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_jobs, query_json)
         print('response: ', response)
         if 'hits' in response:
             item_list = []
@@ -108,26 +105,30 @@ def search_jobs(param, page, size):
         raise e
 
 
-def add_pending_job(job_ref_id, logged_in_user_role, job_type):
+def add_pending_job(job_ref_id, logged_in_user_role, job_type, job_lane=INTERACTIVE):
     try:
         app.logger.info('Create job method called')
+        if job_type in bulk_job_types or job_lane != INTERACTIVE:
+            job_lane = BULK
 
         if add_new_job(job_ref_id, logged_in_user_role) is False:
             return {'message': 'failed'}
-
-        rs = requests.session()
         data = {
             'job_ref_id': job_ref_id,
             'job_type': job_type,
+            'job_lane': job_lane,
             'status': PENDING,
             'created_at': int(time.time()),
             'updated_at': int(time.time())
         }
-        post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_jobs, _es_type)
-        print(post_url)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        response = es_store.index(_es_index_jobs, data)
         print(response)
         if 'result' in response and response['result'] == 'created':
+            # The job document stays as the audit record; workers pick the job up from the queue
+            coalesced_job_id = enqueue_sync_job(response['_id'], job_type, job_ref_id, job_lane)
+            if coalesced_job_id:
+                app.logger.info(f'job {response["_id"]} coalesced into pending job {coalesced_job_id}')
+                es_store.update(_es_index_jobs, response['_id'], {'status': COALESCED, 'updated_at': int(time.time())})
             app.logger.info('Create vote method completed')
             return {'message': 'success'}
         app.logger.error('Elasticsearch down, response: ' + str(response))
@@ -139,16 +140,13 @@ def add_pending_job(job_ref_id, logged_in_user_role, job_type):
 def update_pending_job(job_id, updated_job_type):
     try:
         app.logger.info('Create job method called')
-        rs = requests.session()
-        url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_jobs, _es_type, job_id)
-        response = rs.get(url=url,  headers=_http_headers).json()
+        response = es_store.get(_es_index_jobs, job_id)
         if 'found' in response:
             if response['found']:
                 data = response['_source']
                 data['status'] = updated_job_type
                 data['updated_at'] = int(time.time())
-                app.logger.info('Elasticsearch query : ' + str(url))
-                response = rs.put(url=url, json=data, headers=_http_headers).json()
+                response = es_store.index(_es_index_jobs, data, job_id)
                 app.logger.info('Elasticsearch response :' + str(response))
                 if 'result' in response:
                     app.logger.info('update_pending_job completed')
@@ -162,7 +160,6 @@ def update_pending_job(job_id, updated_job_type):
 def last_completed_job_time(job_ref_id):
     try:
         app.logger.info('last_completed_job_time called')
-        rs = requests.session()
         must = [
             {'term': {'status': COMPLETED}},
             {'term': {'job_ref_id': job_ref_id}},
@@ -170,8 +167,7 @@ def last_completed_job_time(job_ref_id):
         query_json = {'query': {'bool': {'must': must}}}
         query_json['sort'] = [{'created_at': {'order': 'desc'}}]
         query_json['size'] = 1
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_jobs, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_jobs, query_json)
         if 'hits' in response:
             for hit in response['hits']['hits']:
                 data = hit['_source']
@@ -181,3 +177,65 @@ def last_completed_job_time(job_ref_id):
         raise Exception('Internal server error')
     except Exception as e:
         raise e
+
+
+def last_completed_job_time_list(job_ref_id_list):
+    # One msearch for a whole page of refs instead of a search per ref
+    try:
+        synced_time_map = {}
+        if len(job_ref_id_list) == 0:
+            return synced_time_map
+        query_list = []
+        for job_ref_id in job_ref_id_list:
+            must = [
+                {'term': {'status': COMPLETED}},
+                {'term': {'job_ref_id': job_ref_id}},
+            ]
+            query_json = {'query': {'bool': {'must': must}}}
+            query_json['sort'] = [{'created_at': {'order': 'desc'}}]
+            query_json['size'] = 1
+            query_list.append(query_json)
+        response = es_store.msearch(_es_index_jobs, query_list)
+        if 'responses' not in response:
+            app.logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+        for job_ref_id, ref_response in zip(job_ref_id_list, response['responses']):
+            if 'hits' not in ref_response:
+                app.logger.error('Elasticsearch down, response: ' + str(ref_response))
+                raise Exception('Internal server error')
+            hit_list = ref_response['hits']['hits']
+            synced_time_map[job_ref_id] = hit_list[0]['_source']['updated_at'] if len(hit_list) > 0 else 'NA'
+        return synced_time_map
+    except Exception as e:
+        raise e
+
+
+def get_job_progress(job_id):
+    try:
+        progress = get_sync_job_progress(job_id)
+        if not progress:
+            return None
+        total = int(progress.get('total', 0))
+        done = int(progress.get('done', 0))
+        failed = int(progress.get('failed', 0))
+        coalesced = int(progress.get('coalesced', 0))
+        remaining = max(0, total - done - failed - coalesced)
+        data = {
+            'job_id': job_id,
+            'total': total,
+            'done': done,
+            'failed': failed,
+            'coalesced': coalesced,
+            'remaining': remaining,
+            'fan_out_completed': 'fan_out_completed_at' in progress,
+            'eta_seconds': None,
+        }
+        # The rate so far covers every child that ran, whether it succeeded or not
+        elapsed = int(time.time()) - int(progress.get('started_at', time.time()))
+        if done + failed > 0 and data['fan_out_completed']:
+            data['eta_seconds'] = int(elapsed * remaining / (done + failed))
+        if 'started_at' in progress:
+            data['started_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(int(progress['started_at'])))
+        return data
+    except Exception as e:
+        raise e
@@ -0,0 +1,174 @@
+import time
+from flask import current_app as app
+
+from extensions.flask_es import es_store
+from extensions.flask_redis import redis_store
+
+_es_index_user = 'cfs_users'
+_es_type = '_doc'
+
+SKILL = 'skill'
+SOLVE_COUNT = 'solve_count'
+CONTRIBUTION = 'contribution'
+
+leaderboard_list = [SKILL, SOLVE_COUNT, CONTRIBUTION]
+leaderboard_sort_fields = {
+    'skill_value': SKILL,
+    'solve_count': SOLVE_COUNT,
+    'contribution': CONTRIBUTION,
+}
+leaderboard_source_fields = ['skill_value', 'decreased_skill_value', 'solve_count', 'contribution']
+
+
+def _leaderboard_key(board):
+    return f'{app.config["REDIS_PREFIX_LEADERBOARD"]}:{board}'
+
+
+def _leaderboard_built_key(board):
+    return f'{_leaderboard_key(board)}:built'
+
+
+def generate_leaderboard_scores(user):
+    return {
+        SKILL: float(user.get('skill_value', 0) or 0) - float(user.get('decreased_skill_value', 0) or 0),
+        SOLVE_COUNT: int(user.get('solve_count', 0) or 0),
+        CONTRIBUTION: int(user.get('contribution', 0) or 0),
+    }
+
+
+def update_user_leaderboards(user_id, user):
+    try:
+        pipe = redis_store.connection.pipeline()
+        for board, score in generate_leaderboard_scores(user).items():
+            pipe.zadd(_leaderboard_key(board), {user_id: score})
+        pipe.execute()
+    except Exception as e:
+        raise e
+
+
+def update_leaderboards_for_users(user_map):
+    try:
+        board_mapping = {board: {} for board in leaderboard_list}
+        for user_id, user in user_map.items():
+            for board, score in generate_leaderboard_scores(user).items():
+                board_mapping[board][user_id] = score
+        pipe = redis_store.connection.pipeline()
+        for board, mapping in board_mapping.items():
+            if len(mapping) > 0:
+                pipe.zadd(_leaderboard_key(board), mapping)
+        pipe.execute()
+    except Exception as e:
+        raise e
+
+
+def remove_user_from_leaderboards(user_id):
+    try:
+        pipe = redis_store.connection.pipeline()
+        for board in leaderboard_list:
+            pipe.zrem(_leaderboard_key(board), user_id)
+        pipe.execute()
+    except Exception as e:
+        raise e
+
+
+def is_leaderboard_built(board):
+    # Syncs zadd into a board before it was ever rebuilt, so only the marker tells a complete board apart
+    try:
+        return redis_store.connection.exists(_leaderboard_built_key(board)) > 0
+    except Exception as e:
+        raise e
+
+
+def get_leaderboard_size(board):
+    try:
+        return redis_store.connection.zcard(_leaderboard_key(board))
+    except Exception as e:
+        raise e
+
+
+def get_leaderboard_page(board, start, size, sort_order='desc'):
+    try:
+        item_list = []
+        if size <= 0:
+            return item_list
+        key = _leaderboard_key(board)
+        if sort_order == 'asc':
+            entry_list = redis_store.connection.zrange(key, start, start + size - 1, withscores=True)
+            total = redis_store.connection.zcard(key)
+        else:
+            entry_list = redis_store.connection.zrevrange(key, start, start + size - 1, withscores=True)
+        rank = start + 1
+        for user_id, score in entry_list:
+            # Ranks always count from the top, whichever direction the page is read in
+            item_rank = rank if sort_order != 'asc' else total - rank + 1
+            item_list.append({'user_id': user_id, 'score': score, 'rank': item_rank})
+            rank += 1
+        return item_list
+    except Exception as e:
+        raise e
+
+
+def get_leaderboard_rank(board, user_id):
+    try:
+        key = _leaderboard_key(board)
+        pipe = redis_store.connection.pipeline()
+        pipe.exists(_leaderboard_built_key(board))
+        pipe.zrevrank(key, user_id)
+        pipe.zscore(key, user_id)
+        built, position, score = pipe.execute()
+        # A rank on a board that was never rebuilt only counts the users synced since deploy
+        if not built or position is None:
+            return None
+        return {'user_id': user_id, 'score': score, 'rank': position + 1}
+    except Exception as e:
+        raise e
+
+
+def get_leaderboard_neighbours(board, user_id, radius):
+    try:
+        user_rank = get_leaderboard_rank(board, user_id)
+        if user_rank is None:
+            return []
+        start = max(0, user_rank['rank'] - 1 - radius)
+        size = user_rank['rank'] - start + radius
+        return get_leaderboard_page(board, start, size)
+    except Exception as e:
+        raise e
+
+
+def rebuild_leaderboards():
+    app.logger.info('rebuild_leaderboards called')
+    try:
+        # Fill shadow sets and swap them in so readers never see a half built board
+        rebuild_key_map = {}
+        for board in leaderboard_list:
+            rebuild_key_map[board] = f'{_leaderboard_key(board)}:rebuild:{int(time.time())}'
+            redis_store.connection.delete(rebuild_key_map[board])
+
+        user_count = 0
+        query_json = {'query': {'match_all': {}}}
+        query_json['_source'] = leaderboard_source_fields
+        for hit_list in es_store.search_pages(_es_index_user, query_json):
+            board_mapping = {board: {} for board in leaderboard_list}
+            for hit in hit_list:
+                for board, score in generate_leaderboard_scores(hit['_source']).items():
+                    board_mapping[board][hit['_id']] = score
+                user_count += 1
+            pipe = redis_store.connection.pipeline()
+            for board, mapping in board_mapping.items():
+                if len(mapping) > 0:
+                    pipe.zadd(rebuild_key_map[board], mapping)
+            pipe.execute()
+
+        pipe = redis_store.connection.pipeline()
+        for board in leaderboard_list:
+            if user_count > 0:
+                pipe.rename(rebuild_key_map[board], _leaderboard_key(board))
+            else:
+                pipe.delete(_leaderboard_key(board))
+            pipe.set(_leaderboard_built_key(board), int(time.time()))
+        pipe.execute()
+        app.logger.info(f'rebuild_leaderboards completed for {user_count} users')
+        return user_count
+    except Exception as e:
+        raise e
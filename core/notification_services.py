@@ -1,11 +1,10 @@
 import time
 import json
-import requests
 from flask import current_app as app
 
-from core.user_services import get_user_details
+from extensions.flask_es import es_store
 
-_http_headers = {'Content-Type': 'application/json'}
+from core.user_services import get_user_cards
 
 _es_user_user_notification = 'cfs_notifications'
 
@@ -19,12 +18,10 @@ UNREAD = 'UNREAD'
 
 def add_notification(data):
     try:
-        rs = requests.session()
         data['created_at'] = int(time.time())
         data['updated_at'] = int(time.time())
         data['status'] = UNREAD
-        post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_user_user_notification, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        response = es_store.index(_es_user_user_notification, data)
         if 'result' in response and response['result'] == 'created':
             return response['_id'], 201
         app.logger.error('Elasticsearch down, response: ' + str(response))
@@ -35,16 +32,14 @@ def add_notification(data):
 
 def update_notification(notification_id, data):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_user_user_notification, _es_type, notification_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_user_user_notification, notification_id)
 
         if 'found' in response:
             if response['found']:
                 es_data = response['_source']
                 for key in data:
                     es_data[key] = data[key]
-                response = rs.put(url=search_url, json=es_data, headers=_http_headers).json()
+                response = es_store.index(_es_user_user_notification, es_data, notification_id)
                 if 'result' in response:
                     return response['result']
             app.logger.info('User not found')
@@ -58,7 +53,6 @@ def update_notification(notification_id, data):
 
 def search_notification(param, size):
     try:
-        rs = requests.session()
         query_json = {'query': {'match_all': {}}}
 
         must = []
@@ -76,17 +70,22 @@ def search_notification(param, size):
         query_json['size'] = size
         query_json['sort'] = [{'created_at': {'order': 'desc'}}]
 
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_user_user_notification, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_user_user_notification, query_json)
         item_list = []
         if 'hits' in response:
+            user_id_list = []
+            for hit in response['hits']['hits']:
+                user_id_list.append(hit['_source']['user_id'])
+                if hit['_source']['sender_id'] != 'System':
+                    user_id_list.append(hit['_source']['sender_id'])
+            user_card_map = get_user_cards(user_id_list)
             for hit in response['hits']['hits']:
                 data = hit['_source']
                 data['id'] = hit['_id']
-                user_details = get_user_details(data['user_id'])
+                user_details = user_card_map[data['user_id']]
                 data['user_id_handle'] = user_details['username']
                 if data['sender_id'] != 'System':
-                    user_details = get_user_details(data['sender_id'])
+                    user_details = user_card_map[data['sender_id']]
                     data['sender_id_handle'] = user_details['username']
                 else:
                     data['sender_id_handle'] = 'System'
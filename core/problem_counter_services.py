@@ -0,0 +1,162 @@
+import time
+import json
+from flask import current_app as app
+
+from extensions.flask_es import es_store
+
+_es_index_problem_counter = 'cfs_problem_counters'
+_es_index_problem_user = 'cfs_user_problem_edges'
+
+_es_type = '_doc'
+_es_scroll_size = 5000
+_es_scroll_keep_alive = '2m'
+_es_bulk_size = 1000
+_es_retry_on_conflict = 5
+
+SOLVED = 'SOLVED'
+
+_increment_script = """
+ctx._source.solve_count += params.solve_count;
+ctx._source.attempt_count += params.attempt_count;
+if (ctx._source.last_solved_at == null || ctx._source.last_solved_at < params.solved_at) {
+    ctx._source.last_solved_at = params.solved_at;
+}
+ctx._source.updated_at = params.updated_at;
+"""
+
+
+def empty_problem_counter(problem_id):
+    return {
+        'problem_id': problem_id,
+        'solve_count': 0,
+        'attempt_count': 0,
+        'last_solved_at': None,
+    }
+
+
+def add_solved_problem_counter(problem_id, attempt_count, solved_at=None):
+    try:
+        if solved_at is None:
+            solved_at = int(time.time())
+        script = {
+            'source': _increment_script,
+            'lang': 'painless',
+            'params': {
+                'solve_count': 1,
+                'attempt_count': attempt_count,
+                'solved_at': solved_at,
+                'updated_at': int(time.time()),
+            }
+        }
+        upsert = {
+            'problem_id': problem_id,
+            'solve_count': 1,
+            'attempt_count': attempt_count,
+            'last_solved_at': solved_at,
+            'updated_at': int(time.time()),
+        }
+        params = {'retry_on_conflict': _es_retry_on_conflict}
+        response = es_store.script_update(_es_index_problem_counter, problem_id, script, upsert, params)
+        if 'result' in response:
+            return response['result']
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def get_problem_counter(problem_id):
+    try:
+        response = es_store.get(_es_index_problem_counter, problem_id)
+        if 'found' in response:
+            if response['found']:
+                data = response['_source']
+                data.pop('updated_at', None)
+                return data
+            return empty_problem_counter(problem_id)
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def get_problem_counter_list(problem_id_list):
+    try:
+        counter_map = {}
+        for problem_id in problem_id_list:
+            counter_map[problem_id] = empty_problem_counter(problem_id)
+        if len(problem_id_list) == 0:
+            return counter_map
+
+        response = es_store.mget(_es_index_problem_counter, problem_id_list)
+        if 'docs' in response:
+            for doc in response['docs']:
+                if doc.get('found', False):
+                    data = doc['_source']
+                    data.pop('updated_at', None)
+                    counter_map[doc['_id']] = data
+            return counter_map
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def generate_problem_counters_from_edges():
+    try:
+        counter_map = {}
+        query_json = {'query': {'bool': {'must': [{'term': {'status': SOLVED}}]}}}
+        query_json['size'] = _es_scroll_size
+        query_json['_source'] = ['problem_id', 'submission_list', 'created_at']
+        response = es_store.search(_es_index_problem_user, query_json, params={'scroll': _es_scroll_keep_alive})
+        scroll_id = response.get('_scroll_id', None)
+        try:
+            while 'hits' in response and len(response['hits']['hits']) > 0:
+                for hit in response['hits']['hits']:
+                    edge = hit['_source']
+                    problem_id = edge['problem_id']
+                    if problem_id not in counter_map:
+                        counter_map[problem_id] = empty_problem_counter(problem_id)
+                    counter = counter_map[problem_id]
+                    counter['solve_count'] += 1
+                    counter['attempt_count'] += len(edge.get('submission_list', []) or [])
+                    solved_at = edge.get('created_at', None)
+                    if solved_at is not None and (counter['last_solved_at'] is None or counter['last_solved_at'] < solved_at):
+                        counter['last_solved_at'] = solved_at
+                response = es_store.scroll(scroll_id, _es_scroll_keep_alive)
+                scroll_id = response.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id:
+                es_store.clear_scroll(scroll_id)
+        if 'hits' not in response:
+            app.logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+        return counter_map
+    except Exception as e:
+        raise e
+
+
+def rebuild_problem_counters():
+    app.logger.info('rebuild_problem_counters called')
+    try:
+        rebuild_started_at = int(time.time())
+        counter_map = generate_problem_counters_from_edges()
+        problem_id_list = list(counter_map.keys())
+        for start in range(0, len(problem_id_list), _es_bulk_size):
+            actions = []
+            for problem_id in problem_id_list[start:start+_es_bulk_size]:
+                counter = counter_map[problem_id]
+                counter['updated_at'] = rebuild_started_at
+                actions.append(({'index': {'_index': _es_index_problem_counter, '_id': problem_id}}, counter))
+            response = es_store.bulk(actions)
+            if 'items' not in response or response.get('errors', False):
+                app.logger.error('Elasticsearch bulk failed, response: ' + json.dumps(response)[:1000])
+                raise Exception('Internal server error')
+
+        # Counters that were not touched by this rebuild belong to problems with no solved edges left
+        query_json = {'query': {'range': {'updated_at': {'lt': rebuild_started_at}}}}
+        es_store.delete_by_query(_es_index_problem_counter, query_json, params={'conflicts': 'proceed'})
+        app.logger.info(f'rebuild_problem_counters completed for {len(problem_id_list)} problems')
+        return len(problem_id_list)
+    except Exception as e:
+        raise e
@@ -3,26 +3,30 @@ import time
 import string
 import re
 
-import requests
 from flask import current_app as app
 
-from core.resource_services import search_resource
-from core.comment_services import get_comment_list, get_comment_count
-from core.vote_services import get_vote_count_list
+from extensions.flask_es import es_store
+
+from core.resource_services import search_resource, search_resource_for_ref_list
+from core.comment_services import get_comment_list, get_comment_list_for_ref_list, get_comment_count, \
+    get_comment_count_for_ref_list
+from core.vote_services import get_vote_count_list, get_vote_count_list_for_ref_list
 from core.user_category_edge_services import get_user_category_data, add_user_category_data
 from models.category_skill_model import CategorySkillGenerator
-from core.user_services import get_user_details
+from core.user_services import get_user_cards
+from core.category_catalogue_services import get_catalogue_category
+from core.problem_counter_services import add_solved_problem_counter, get_problem_counter, get_problem_counter_list
 
 from commons.skillset import Skill
 
-_http_headers = {'Content-Type': 'application/json'}
-
 _es_index_problem_user = 'cfs_user_problem_edges'
 _es_index_problem = 'cfs_problems'
 _es_index_category = 'cfs_categories'
 _es_type = '_doc'
 _es_size = 2000
-_es_max_solved_problem = 2000
+_es_retry_on_conflict = 5
+
+_available_problem_source = ['problem_difficulty', 'problem_type', 'categories']
 
 SOLVED = 'SOLVED'
 UNSOLVED = 'UNSOLVED'
@@ -73,27 +77,15 @@ def merge_problem_data(existing_data, new_data):
 
 def get_solved_count_for_problem(problem_id):
     try:
-        rs = requests.session()
-        must = [
-            {'term': {'problem_id': problem_id}},
-            {'term': {'status': SOLVED}}
-        ]
-        query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = 0
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        if 'hits' in response:
-            return response['hits']['total']['value']
-        return 0
+        counter = get_problem_counter(problem_id)
+        return counter['solve_count']
     except Exception as e:
         raise e
 
 
 def get_problem_details_es_fields(problem_id):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_problem, _es_type, problem_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_problem, problem_id)
         if 'found' in response:
             if response['found']:
                 data = response['_source']
@@ -105,9 +97,7 @@ def get_problem_details_es_fields(problem_id):
 
 def get_problem_details(problem_id, user_id = None):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_problem, _es_type, problem_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_problem, problem_id)
         if 'found' in response:
             if response['found']:
                 data = response['_source']
@@ -127,27 +117,102 @@ def get_problem_details(problem_id, user_id = None):
         raise e
 
 
+def get_solved_count_for_problem_list(problem_id_list):
+    try:
+        solve_count_map = {}
+        counter_map = get_problem_counter_list(problem_id_list)
+        for problem_id in counter_map:
+            solve_count_map[problem_id] = counter_map[problem_id]['solve_count']
+        return solve_count_map
+    except Exception as e:
+        raise e
+
+
+def get_user_problem_status_for_problem_list(user_id, problem_id_list):
+    try:
+        edge_map = {}
+        if len(problem_id_list) == 0:
+            return edge_map
+        edge_id_list = [generate_user_problem_edge_id(user_id, problem_id) for problem_id in problem_id_list]
+        response = es_store.mget(_es_index_problem_user, edge_id_list)
+        if 'docs' in response:
+            for doc in response['docs']:
+                if doc.get('found', False):
+                    edge = doc['_source']
+                    edge['id'] = doc['_id']
+                    edge_map[edge['problem_id']] = edge
+            return edge_map
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def generate_problem_dependency_list(problem):
+    item_list = []
+    for category in problem.get('categories', []):
+        category = dict(category)
+        category['category_info'] = get_category_details(category['category_id'])
+        item_list.append(category)
+    return item_list
+
+
+def get_problem_details_for_problem_list(problem_id_list, user_id=None, heavy=False):
+    try:
+        if len(problem_id_list) == 0:
+            return []
+        response = es_store.mget(_es_index_problem, problem_id_list)
+        if 'docs' not in response:
+            app.logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+
+        problem_list = []
+        for doc in response['docs']:
+            if doc.get('found', False):
+                data = doc['_source']
+                data['id'] = doc['_id']
+                problem_list.append(data)
+
+        found_id_list = [problem['id'] for problem in problem_list]
+        vote_count_map = get_vote_count_list_for_ref_list(found_id_list)
+        solve_count_map = get_solved_count_for_problem_list(found_id_list)
+        comment_count_map = get_comment_count_for_ref_list(found_id_list)
+        comment_list_map = get_comment_list_for_ref_list(found_id_list)
+        resource_map = search_resource_for_ref_list(found_id_list, _es_size)
+        edge_map = {}
+        if user_id:
+            edge_map = get_user_problem_status_for_problem_list(user_id, found_id_list)
+
+        for data in problem_list:
+            problem_id = data['id']
+            data['comment_list'] = comment_list_map[problem_id]
+            data['vote_count'] = vote_count_map[problem_id]
+            data['solve_count'] = solve_count_map[problem_id]
+            data['comment_count'] = comment_count_map[problem_id]
+            data['resource_list'] = resource_map[problem_id]
+            if problem_id in edge_map:
+                data['user_status'] = edge_map[problem_id]['status']
+            if heavy:
+                data['category_dependency_list'] = generate_problem_dependency_list(data)
+        return problem_list
+    except Exception as e:
+        raise e
+
+
 def search_problems_by_category(param, heavy = False):
     user_id = param.get('user_id', None)
     param.pop('user_id', None)
     try:
         problem_list = search_problem_list_simplified(param)
-        item_list = []
-        for problem_id in problem_list:
-            problem_details = get_problem_details(problem_id)
+        item_list = get_problem_details_for_problem_list(problem_list, heavy=heavy)
+        edge_map = {}
+        if user_id:
+            edge_map = get_user_problem_status_for_problem_list(user_id, problem_list)
+        for problem_details in item_list:
             problem_details['solved'] = 'no'
-            if user_id:
-                edge = get_user_problem_status(user_id, problem_id)
-                if edge and edge['status'] == SOLVED:
-                    problem_details['solved'] = 'yes'
-
-            if heavy:
-                dependency_list = find_problem_dependency_list(problem_id)
-                problem_details['category_dependency_list'] = dependency_list
-
-            problem_details['solve_count'] = get_solved_count_for_problem(problem_id)
-
-            item_list.append(problem_details)
+            edge = edge_map.get(problem_details['id'], None)
+            if edge and edge['status'] == SOLVED:
+                problem_details['solved'] = 'yes'
         return item_list
     except Exception as e:
         raise e
@@ -158,21 +223,15 @@ def search_problems_by_category_dt_search(param, start, length, sort_by, sort_or
     param.pop('user_id', None)
     try:
         problem_stat = search_problem_list_simplified_dtsearch(param, start, length, sort_by, sort_order)
-        item_list = []
-        for problem_id in problem_stat['problem_list']:
-            problem_details = get_problem_details(problem_id)
+        item_list = get_problem_details_for_problem_list(problem_stat['problem_list'], heavy=True)
+        edge_map = {}
+        if user_id:
+            edge_map = get_user_problem_status_for_problem_list(user_id, problem_stat['problem_list'])
+        for problem_details in item_list:
             problem_details['solved'] = 'no'
-            if user_id:
-                edge = get_user_problem_status(user_id, problem_id)
-                if edge and edge['status'] == SOLVED:
-                    problem_details['solved'] = 'yes'
-
-            dependency_list = find_problem_dependency_list(problem_id)
-            problem_details['category_dependency_list'] = dependency_list
-
-            problem_details['solve_count'] = get_solved_count_for_problem(problem_id)
-
-            item_list.append(problem_details)
+            edge = edge_map.get(problem_details['id'], None)
+            if edge and edge['status'] == SOLVED:
+                problem_details['solved'] = 'yes'
         return {
             'problem_list': item_list,
             'total': problem_stat['total']
@@ -181,82 +240,91 @@ def search_problems_by_category_dt_search(param, start, length, sort_by, sort_or
         raise e
 
 
+def generate_user_problem_edge_id(user_id, problem_id):
+    return f'{user_id}:{problem_id}'
+
+
 def get_user_problem_status(user_id, problem_id):
     try:
-        rs = requests.session()
-        must = [
-            {'term': {'user_id': user_id}},
-            {'term': {'problem_id': problem_id}}
-        ]
-        query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = 1
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        if 'hits' in response:
-            for hit in response['hits']['hits']:
-                edge = hit['_source']
-                edge['id'] = hit['_id']
+        response = es_store.get(_es_index_problem_user, generate_user_problem_edge_id(user_id, problem_id))
+        if 'found' in response:
+            if response['found']:
+                edge = response['_source']
+                edge['id'] = response['_id']
                 return edge
-        return None
-
+            return None
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
     except Exception as e:
         raise e
 
 
 def get_solved_problem_count_for_user(user_id):
     try:
-        rs = requests.session()
         must = [
             {'term': {'user_id': user_id}},
             {'term': {'status': SOLVED}}
         ]
         query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = 1
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        if 'hits' in response:
-            return response['hits']['total']['value']
+        response = es_store.count(_es_index_problem_user, query_json)
+        if 'count' in response:
+            return response['count']
         return 0
     except Exception as e:
         raise e
 
 
+def get_solved_problem_id_sets(user_id_list):
+    try:
+        solved_map = {user_id: set() for user_id in user_id_list}
+        if len(solved_map) == 0:
+            return solved_map
+        must = [
+            {'terms': {'user_id': list(solved_map.keys())}},
+            {'term': {'status': SOLVED}}
+        ]
+        query_json = {'query': {'bool': {'must': must}}}
+        query_json['_source'] = ['user_id', 'problem_id']
+        for hit_list in es_store.search_pages(_es_index_problem_user, query_json):
+            for hit in hit_list:
+                solved_map[hit['_source']['user_id']].add(hit['_source']['problem_id'])
+        return solved_map
+    except Exception as e:
+        raise e
+
+
+def get_problem_score_map(problem_id_set, score_map=None):
+    # Problems already in score_map are not fetched again, so one map can be carried across batches
+    try:
+        score_map = {} if score_map is None else score_map
+        skill = Skill()
+        missing_list = [problem_id for problem_id in problem_id_set if problem_id not in score_map]
+        for start in range(0, len(missing_list), _es_size):
+            response = es_store.mget(_es_index_problem, missing_list[start:start + _es_size], source='problem_difficulty')
+            if 'docs' not in response:
+                app.logger.error('Elasticsearch down, response: ' + str(response))
+                raise Exception('Internal server error')
+            for doc in response['docs']:
+                score_map[doc['_id']] = 0
+                if doc.get('found', False):
+                    score_map[doc['_id']] = skill.get_problem_score(doc['_source']['problem_difficulty'])
+        return score_map
+    except Exception as e:
+        raise e
+
+
 def get_total_problem_score_for_user(user_list):
     try:
-        rs = requests.session()
-        score_sum = 0
-        marked_problem = {}
-        for user_id in user_list:
-            app.logger.info(f'check for user: {user_id}')
-            must = [
-                {'term': {'user_id': user_id}},
-                {'term': {'status': SOLVED}}
-            ]
-            query_json = {'query': {'bool': {'must': must}}}
-            query_json['size'] = _es_size
-            search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem_user, _es_type)
-            response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-            if 'hits' in response:
-                for hit in response['hits']['hits']:
-                    edge = hit['_source']
-                    problem_id = edge['problem_id']
-                    if problem_id not in marked_problem:
-                        marked_problem[problem_id] = 1
-                        url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_problem, _es_type, problem_id)
-                        presponse = rs.get(url=url, headers=_http_headers).json()
-                        if 'found' in presponse and presponse['found']:
-                            problem_details = presponse['_source']
-                            skill = Skill()
-                            score_sum += skill.get_problem_score(problem_details['problem_difficulty'])
-        return score_sum
+        solved_map = get_solved_problem_id_sets(user_list)
+        problem_id_set = set().union(*solved_map.values())
+        score_map = get_problem_score_map(problem_id_set)
+        return sum(score_map[problem_id] for problem_id in problem_id_set)
     except Exception as e:
         raise e
 
 
 def find_problems_for_user_by_status_filtered(status, user_id, heavy=False):
     try:
-        rs = requests.session()
-
         should = []
         for s in status:
             should.append({'term': {'status': s}})
@@ -267,13 +335,11 @@ def find_problems_for_user_by_status_filtered(status, user_id, heavy=False):
         ]
 
         query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = _es_max_solved_problem
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        query_json['_source'] = ['problem_id', 'status']
 
         problem_list = []
-        if 'hits' in response:
-            for hit in response['hits']['hits']:
+        for hit_list in es_store.search_pages(_es_index_problem_user, query_json):
+            for hit in hit_list:
                 edge = hit['_source']
                 if heavy:
                     problem = get_problem_details(edge['problem_id'])
@@ -301,48 +367,54 @@ def find_problems_by_status_filtered_for_user_list(status, user_list, heavy=Fals
         raise e
 
 
-def available_problems_for_user(user_id):
+def find_unavailable_problem_id_set_for_user(user_id):
     try:
-        problem_list = search_problems({}, 0, _es_size)
-        available_list = []
-        for problem in problem_list:
-            edge = get_user_problem_status(user_id, problem['id'])
-            if edge is None:
-                available_list.append(problem)
-            else:
-                status = edge.get('status', None)
-                if status == UNSOLVED:
-                    available_list.append(problem)
-        return available_list
+        problem_id_set = set()
+        must = [{'term': {'user_id': user_id}}]
+        must_not = [{'term': {'status': UNSOLVED}}]
+        query_json = {'query': {'bool': {'must': must, 'must_not': must_not}}}
+        query_json['_source'] = ['problem_id']
+        for hit_list in es_store.search_pages(_es_index_problem_user, query_json):
+            for hit in hit_list:
+                problem_id_set.add(hit['_source']['problem_id'])
+        return problem_id_set
     except Exception as e:
         raise e
 
 
-def add_user_problem_status(user_id, problem_id, data):
+def available_problems_for_user(user_id, param=None):
+    # Yields the slim problem documents the scorer needs, skipping anything the user already solved, flagged or parked
     try:
-        rs = requests.session()
-        edge = get_user_problem_status(user_id, problem_id)
-
-        if edge is None:
-            data['created_at'] = int(time.time())
-            data['updated_at'] = int(time.time())
-            post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_problem_user, _es_type)
-            response = rs.post(url=post_url, json=data, headers=_http_headers).json()
-            if 'result' in response:
-                return response['_id']
-            raise Exception('Internal server error')
+        unavailable_id_set = find_unavailable_problem_id_set_for_user(user_id)
+        query_json = generate_query_params(param or {})
+        query_json['_source'] = _available_problem_source
+        for hit_list in es_store.search_pages(_es_index_problem, query_json):
+            for hit in hit_list:
+                if hit['_id'] in unavailable_id_set:
+                    continue
+                data = hit['_source']
+                data['id'] = hit['_id']
+                yield data
+    except Exception as e:
+        raise e
 
-        edge_id = edge['id']
-        edge.pop('id', None)
 
-        for f in data:
-            edge[f] = data[f]
+def add_user_problem_status(user_id, problem_id, data, writer=None):
+    try:
+        data['user_id'] = user_id
+        data['problem_id'] = problem_id
+        data['updated_at'] = int(time.time())
+        data.pop('id', None)
 
-        edge['updated_at'] = int(time.time())
+        upsert_data = dict(data)
+        upsert_data['created_at'] = data['updated_at']
+        edge_id = generate_user_problem_edge_id(user_id, problem_id)
 
-        url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_problem_user, _es_type, edge_id)
-        response = rs.put(url=url, json=edge, headers=_http_headers).json()
+        if writer is not None:
+            writer.upsert(_es_index_problem_user, edge_id, data, upsert_data)
+            return edge_id
 
+        response = es_store.update(_es_index_problem_user, edge_id, data, upsert_data=upsert_data)
         if 'result' in response:
             return response['result']
         raise Exception('Internal server error')
@@ -350,6 +422,25 @@ def add_user_problem_status(user_id, problem_id, data):
         raise Exception('Internal server error')
 
 
+_solved_edge_script = """
+if (ctx._source.status == params.data.status) {
+    ctx.op = 'noop';
+} else {
+    ctx._source.putAll(params.data);
+}
+"""
+
+
+def mark_user_problem_solved(user_id, problem_id, data):
+    # Only the update that moves the edge to SOLVED reports a change, an overlapping sync sees a noop
+    script = {'source': _solved_edge_script, 'lang': 'painless', 'params': {'data': data}}
+    params = {'retry_on_conflict': _es_retry_on_conflict}
+    response = es_store.script_update(_es_index_problem_user, generate_user_problem_edge_id(user_id, problem_id), script, data, params)
+    if 'result' not in response:
+        raise Exception('Internal server error')
+    return response['result'] != 'noop'
+
+
 def apply_solved_problem_for_user(user_id, problem_id, problem_details, submission_list, updated_categories, root_category_solve_count):
     app.logger.info(f'apply_solved_problem_for_user for user_id: {user_id}, problem_id: {problem_id}')
     app.logger.info('current updated_categories: ' + json.dumps(updated_categories))
@@ -358,19 +449,19 @@ def apply_solved_problem_for_user(user_id, problem_id, problem_details, submissi
         up_edge = get_user_problem_status(user_id, problem_id)
         if up_edge is not None and up_edge['status'] == SOLVED:
             return
-        rs = requests.session()
         data = {
             'user_id': user_id,
             'problem_id': problem_id,
             'submission_list': submission_list,
-            'status': SOLVED
+            'status': SOLVED,
+            'created_at': int(time.time()),
+            'updated_at': int(time.time())
         }
         # Insert User Problem Solved Status Here
-        post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_problem_user, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        if not mark_user_problem_solved(user_id, problem_id, data):
+            return
 
-        if 'result' not in response:
-            raise Exception('Internal server error')
+        add_solved_problem_counter(problem_id, len(submission_list), data['created_at'])
 
         # Update dependent category skill
         problem_difficulty = problem_details['problem_difficulty']
@@ -434,23 +525,14 @@ def apply_solved_problem_for_user(user_id, problem_id, problem_details, submissi
 
 def get_category_details(cat_id):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_category, _es_type, cat_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
-        if 'found' in response:
-            if response['found']:
-                data = response['_source']
-                return data
-        return None
+        return get_catalogue_category(cat_id)
     except Exception as e:
         raise e
 
 
 def find_problem_dependency_list(problem_id):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_problem, _es_type, problem_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_problem, problem_id)
         item_list = []
         if 'found' in response:
             if response['found']:
@@ -522,13 +604,11 @@ def generate_query_params(param):
 
 def search_problem_list_simplified(param, sort_by='problem_difficulty', sort_order='asc'):
     try:
-        rs = requests.session()
         query_json = generate_query_params(param)
         query_json['_source'] = "{}"
         query_json['size'] = _es_size
         query_json['sort'] = [{sort_by: {'order': sort_order}}]
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_problem, query_json)
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
@@ -540,14 +620,12 @@ def search_problem_list_simplified(param, sort_by='problem_difficulty', sort_ord
 
 def search_problem_list_simplified_dtsearch(param, start, length, sort_by, sort_order):
     try:
-        rs = requests.session()
         query_json = generate_query_params(param)
         query_json['_source'] = "{}"
         query_json['from'] = start
         query_json['size'] = length
         query_json['sort'] = [{sort_by: {'order': sort_order}}]
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_problem, query_json)
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
@@ -562,12 +640,10 @@ def search_problem_list_simplified_dtsearch(param, start, length, sort_by, sort_
 
 def search_problems(param, from_value, size_value, heavy = False):
     try:
-        rs = requests.session()
         query_json = generate_query_params(param)
         query_json['from'] = from_value
         query_json['size'] = size_value
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_problem, query_json)
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
@@ -588,7 +664,6 @@ def search_problems(param, from_value, size_value, heavy = False):
 def search_problems_filtered_by_categories(categories):
     app.logger.info('search_problems_filtered_by_categories called')
     try:
-        rs = requests.session()
         should = []
         for category_id in categories:
             uc_edge = categories[category_id]
@@ -608,8 +683,7 @@ def search_problems_filtered_by_categories(categories):
 
         query_json['from'] = 0
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_problem, query_json)
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
@@ -625,13 +699,10 @@ def search_problems_filtered_by_categories(categories):
 
 def get_problem_count_for_category(param):
     try:
-        rs = requests.session()
         query_json = generate_query_params(param)
-        query_json['size'] = 0
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        if 'hits' in response:
-            return response['hits']['total']['value']
+        response = es_store.count(_es_index_problem, query_json)
+        if 'count' in response:
+            return response['count']
         return 0
     except Exception as e:
         raise e
@@ -639,7 +710,6 @@ def get_problem_count_for_category(param):
 
 def get_problem_submission_history(problem_id, start, size):
     try:
-        rs = requests.session()
         must = [
             {'term': {'problem_id': problem_id}},
             {'term': {'status': SOLVED}},
@@ -648,18 +718,17 @@ def get_problem_submission_history(problem_id, start, size):
         query_json['from'] = start
         query_json['size'] = size
         query_json['sort'] = [{'updated_at': {'order': 'desc'}}]
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_problem_user, query_json)
 
         submission_list = []
         resp = {}
         if 'hits' in response:
             order = 1
             resp['total'] = response['hits']['total']['value']
+            user_card_map = get_user_cards([hit['_source']['user_id'] for hit in response['hits']['hits']])
             for hit in response['hits']['hits']:
                 edge = hit['_source']
-                user_id = edge['user_id']
-                user_data = get_user_details(user_id)
+                user_data = user_card_map[edge['user_id']]
                 edge['user_handle'] = user_data['username']
                 edge['user_skill_color'] = user_data['skill_color']
                 edge['order'] = order+start
@@ -674,7 +743,6 @@ def get_problem_submission_history(problem_id, start, size):
 
 def get_user_problem_submission_history(user_id, start, size):
     try:
-        rs = requests.session()
         must = [
             {'term': {'user_id': user_id}},
             {'term': {'status': SOLVED}},
@@ -683,18 +751,17 @@ def get_user_problem_submission_history(user_id, start, size):
         query_json['from'] = start
         query_json['size'] = size
         query_json['sort'] = [{'updated_at': {'order': 'desc'}}]
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_problem_user, query_json)
 
         submission_list = []
         resp = {}
         if 'hits' in response:
             order = 1
             resp['total'] = response['hits']['total']['value']
+            user_card_map = get_user_cards([hit['_source']['user_id'] for hit in response['hits']['hits']])
             for hit in response['hits']['hits']:
                 edge = hit['_source']
-                user_id = edge['user_id']
-                user_data = get_user_details(user_id)
+                user_data = user_card_map[edge['user_id']]
                 edge['user_handle'] = user_data['username']
                 edge['user_skill_color'] = user_data['skill_color']
                 edge['order'] = order+start
@@ -1,14 +1,22 @@
 import json
+import time
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait
 from flask import current_app as app
 
-from core.problem_services import search_problems, apply_solved_problem_for_user, search_problems_filtered_by_categories, get_user_problem_status, add_user_problem_status
-from core.user_services import get_user_details
+from extensions.flask_es import es_store
+
+from core.problem_services import search_problems, apply_solved_problem_for_user, search_problems_filtered_by_categories, get_user_problem_status, add_user_problem_status, \
+    get_user_problem_status_for_problem_list
+from core.user_services import get_user_details, update_user_details
 from scrappers.codechef_scrapper import CodechefScrapper
 from scrappers.codeforces_scrapper import CodeforcesScrapper
 from scrappers.loj_scrapper import LightOJScrapper
 from scrappers.spoj_scrapper import SpojScrapper
 from scrappers.uva_scrapper import UvaScrapper
-from core.category_services import search_categories, find_dependent_category_list
+from core.category_services import search_categories
+from core.category_catalogue_services import get_catalogue_category, get_catalogue_dependent_list
 from core.user_category_edge_services import update_root_category_skill_for_user, get_user_category_data, add_user_category_data
 from models.category_score_model import CategoryScoreGenerator
 from models.problem_score_model import ProblemScoreGenerator
@@ -19,6 +27,9 @@ _es_size = 5000
 
 approved = 'approved'
 
+_judge_fetch_slots = None
+_judge_fetch_slots_lock = threading.Lock()
+
 
 def update_problem_score(user_id, user_skill_level, updated_categories):
     app.logger.info(f'update_problem_score called for: {user_id}, with skill: {user_skill_level}')
@@ -26,9 +37,14 @@ def update_problem_score(user_id, user_skill_level, updated_categories):
     problem_list = search_problems_filtered_by_categories(updated_categories)
     app.logger.info(f'problem_list found of size {len(problem_list)}')
 
+    writer = es_store.bulk_writer()
+    up_edge_list = []
+    problem_diff_list = []
+    category_level_lists = []
+    edge_map = get_user_problem_status_for_problem_list(user_id, [problem['id'] for problem in problem_list])
     for problem in problem_list:
         problem_id = problem['id']
-        up_edge = get_user_problem_status(user_id, problem_id)
+        up_edge = edge_map.get(problem_id, None)
         app.logger.info(f'initial up_edge {up_edge}')
 
         if up_edge is None:
@@ -73,12 +89,18 @@ def update_problem_score(user_id, user_skill_level, updated_categories):
             app.logger.info(f'uc_edge: {uc_edge}')
             dcat_level_list.append(uc_edge['skill_level'])
         app.logger.info(f'dcat_level_list: {dcat_level_list}')
-        relevant_score = problem_score_generator.generate_score(int(float(problem['problem_difficulty'])), dcat_level_list, user_skill_level)
+        up_edge_list.append(up_edge)
+        problem_diff_list.append(int(float(problem['problem_difficulty'])))
+        category_level_lists.append(dcat_level_list)
+
+    relevant_score_list = problem_score_generator.generate_score_list(problem_diff_list, category_level_lists, user_skill_level)
+    for up_edge, relevant_score in zip(up_edge_list, relevant_score_list):
         up_edge['relevant_score'] = relevant_score['score']
         up_edge.pop('id', None)
         app.logger.info(f'final up_edge {up_edge}')
-        add_user_problem_status(user_id, problem_id, up_edge)
-        app.logger.info(f'user problem status added')
+        add_user_problem_status(user_id, up_edge['problem_id'], up_edge, writer)
+    writer.flush()
+    app.logger.info('user problem status added')
 
 
 def sync_problems(user_id, oj_problem_set):
@@ -116,11 +138,11 @@ def sync_problems(user_id, oj_problem_set):
             app.logger.info(f'uc_edge 2: {uc_edge}')
             updated_categories[category_id] = uc_edge
             # UPDATE DEPENDENT CATEGORY CONTRIBUTION
-            dependent_cat_list = find_dependent_category_list(category_id)
+            dependent_cat_list = get_catalogue_dependent_list(category_id)
             app.logger.info(f'dependent_cat_list: {dependent_cat_list}')
             for dcat in dependent_cat_list:
-                dcat_id = dcat['category_id']
-                dcat_category_root = dcat['category_info']['category_root']
+                dcat_id = dcat['category_id_1']
+                dcat_category_root = get_catalogue_category(dcat_id)['category_root']
                 app.logger.info(f'dcat_category_root: {dcat_category_root}')
                 if dcat_id in updated_categories:
                     dcat_uc_edge = updated_categories[dcat_id]
@@ -154,11 +176,13 @@ def sync_problems(user_id, oj_problem_set):
 
         app.logger.info('process of mark categories completed')
 
-        for category_id in updated_categories:
-            uc_edge = updated_categories[category_id]
-            uc_edge.pop('old_skill_level', None)
-            uc_edge.pop('id', None)
-            add_user_category_data(user_id, category_id, uc_edge)
+        # The root category aggregation below reads these edges, so wait for the refresh on flush
+        with es_store.bulk_writer({'refresh': 'wait_for'}) as writer:
+            for category_id in updated_categories:
+                uc_edge = updated_categories[category_id]
+                uc_edge.pop('old_skill_level', None)
+                uc_edge.pop('id', None)
+                add_user_category_data(user_id, category_id, uc_edge, writer, ranked=True)
 
         app.logger.info('updated root categories')
         root_category_list = search_categories({"category_root": "root"}, 0, _es_size)
@@ -175,77 +199,123 @@ def sync_problems(user_id, oj_problem_set):
         raise e
 
 
-def synch_user_problem(user_id):
+def get_judge_watermark(user_info, oj_name):
+    # A watermark only holds for the handle it was taken from. Solves of problems that were not approved yet
+    # sit behind the watermark, so it is dropped for a full scan once every full scan interval
+    watermark = user_info.get(f'{oj_name}_watermark', None)
+    if not watermark or watermark.get('handle', None) != user_info.get(f'{oj_name}_handle', None):
+        return None
+    if time.time() - (watermark.get('full_scan_at', None) or 0) >= int(app.config.get('JUDGE_FULL_SCAN_INTERVAL', 604800)):
+        return None
+    return watermark
+
+
+def save_judge_watermarks(user_id, oj_problem_set):
     try:
-        uva = UvaScrapper()
-        codeforces = CodeforcesScrapper()
-        spoj = SpojScrapper()
-        codechef = CodechefScrapper()
-        lightoj = LightOJScrapper()
+        user_data = {}
+        for problem_set in oj_problem_set:
+            if problem_set.get('watermark', None):
+                user_data[f'{problem_set["oj_name"]}_watermark'] = problem_set['watermark']
+        if len(user_data) > 0:
+            update_user_details(user_id, user_data)
+    except Exception as e:
+        raise e
 
-        user_info = get_user_details(user_id)
-        print('user_info: ', user_info)
-        allowed_judges = ['codeforces', 'uva', 'codechef', 'spoj', 'lightoj']
-
-        oj_problem_set = []
-
-        if 'codeforces' in allowed_judges:
-            handle = user_info.get('codeforces_handle', None)
-            print('Codeforces: ', handle)
-            if handle:
-                problem_stat = codeforces.get_user_info_heavy(handle)
-                oj_problem_set.append({
-                    'problem_list': problem_stat['solved_problems'],
-                    'oj_name': 'codeforces'
-                })
-                app.logger.info(f'codeforces problem_stat: {problem_stat}')
-                print('problem_stat: ',problem_stat)
-
-        if 'codechef' in allowed_judges:
-            handle = user_info.get('codechef_handle', None)
-            print('codechef: ', handle)
-            if handle:
-                problem_stat = codechef.get_user_info_heavy(handle)
-                oj_problem_set.append({
-                    'problem_list': problem_stat['solved_problems'],
-                    'oj_name': 'codechef'
-                })
-
-        if 'uva' in allowed_judges:
-            handle = user_info.get('uva_handle', None)
-            print('uva: ', handle)
-            if handle:
-                problem_stat = uva.get_user_info_heavy(handle)
-                oj_problem_set.append({
-                    'problem_list': problem_stat['solved_problems'],
-                    'oj_name': 'uva'
-                })
-
-        if 'spoj' in allowed_judges:
-            handle = user_info.get('spoj_handle', None)
-            print('spoj: ', handle)
-            if handle:
-                problem_stat = spoj.get_user_info_heavy(handle)
-                oj_problem_set.append({
-                    'problem_list': problem_stat['solved_problems'],
-                    'oj_name': 'spoj'
-                })
-
-        if 'lightoj' in allowed_judges:
-            handle = user_info.get('lightoj_handle', None)
-            app.logger.info(f'lightoj handle: {handle}')
-            if handle:
-                credentials = {
-                    'username': app.config['LIGHTOJ_USERNAME'],
-                    'password': app.config['LIGHTOJ_PASSWORD']
-                }
-                problem_stat = lightoj.get_user_info_heavy(handle, credentials)
-                oj_problem_set.append({
-                    'problem_list': problem_stat['solved_problems'],
-                    'oj_name': 'lightoj'
-                })
 
-        sync_problems(user_id, oj_problem_set)
+def generate_judge_fetcher_list(user_info):
+    uva = UvaScrapper()
+    codeforces = CodeforcesScrapper()
+    spoj = SpojScrapper()
+    codechef = CodechefScrapper()
+    lightoj = LightOJScrapper()
+    allowed_judges = ['codeforces', 'codechef', 'uva', 'spoj', 'lightoj']
 
+    fetcher_list = []
+    for oj_name in allowed_judges:
+        handle = user_info.get(f'{oj_name}_handle', None)
+        app.logger.info(f'{oj_name} handle: {handle}')
+        if not handle:
+            continue
+        if oj_name == 'codeforces':
+            watermark = get_judge_watermark(user_info, oj_name)
+            fetcher_list.append((oj_name, partial(codeforces.get_user_info_heavy, handle, watermark)))
+        if oj_name == 'codechef':
+            fetcher_list.append((oj_name, partial(codechef.get_user_info_heavy, handle)))
+        if oj_name == 'uva':
+            watermark = get_judge_watermark(user_info, oj_name)
+            fetcher_list.append((oj_name, partial(uva.get_user_info_heavy, handle, watermark)))
+        if oj_name == 'spoj':
+            fetcher_list.append((oj_name, partial(spoj.get_user_info_heavy, handle)))
+        if oj_name == 'lightoj':
+            credentials = {
+                'username': app.config['LIGHTOJ_USERNAME'],
+                'password': app.config['LIGHTOJ_PASSWORD']
+            }
+            fetcher_list.append((oj_name, partial(lightoj.get_user_info_heavy, handle, credentials)))
+    return fetcher_list
+
+
+def get_judge_fetch_slots():
+    global _judge_fetch_slots
+    with _judge_fetch_slots_lock:
+        if _judge_fetch_slots is None:
+            _judge_fetch_slots = threading.BoundedSemaphore(int(app.config.get('JUDGE_FETCH_MAX_IN_FLIGHT', 20)))
+        return _judge_fetch_slots
+
+
+def run_judge_fetcher(fetcher, slots):
+    try:
+        return fetcher()
+    finally:
+        slots.release()
+
+
+def fetch_judge_problem_set(fetcher_list):
+    # Judges are fetched side by side; one that fails or overruns the timeout is left out of this sync
+    timeout = float(app.config.get('JUDGE_FETCH_TIMEOUT', 300))
+    deadline = time.time() + timeout
+    slots = get_judge_fetch_slots()
+    oj_problem_set = []
+    if len(fetcher_list) == 0:
+        return oj_problem_set
+    executor = ThreadPoolExecutor(max_workers=len(fetcher_list))
+    try:
+        future_list = []
+        for oj_name, fetcher in fetcher_list:
+            # A fetch holds its slot until the scrapper returns, so fetches that outlived an earlier timeout
+            # still count against the cap instead of piling up behind the rating pool
+            if not slots.acquire(timeout=max(0, deadline - time.time())):
+                app.logger.error(f'{oj_name} fetch skipped, no fetch slot freed up within {timeout} seconds')
+                continue
+            future_list.append((oj_name, executor.submit(run_judge_fetcher, fetcher, slots)))
+        wait([future for oj_name, future in future_list], timeout=max(0, deadline - time.time()))
+        for oj_name, future in future_list:
+            if not future.done():
+                app.logger.error(f'{oj_name} fetch timed out after {timeout} seconds')
+                continue
+            if future.exception() is not None:
+                app.logger.error(f'{oj_name} fetch failed: {future.exception()}')
+                continue
+            problem_stat = future.result()
+            app.logger.info(f'{oj_name} solved count: {len(problem_stat["solved_problems"])}')
+            problem_set = {
+                'problem_list': problem_stat['solved_problems'],
+                'oj_name': oj_name
+            }
+            if problem_stat.get('watermark', None):
+                problem_set['watermark'] = problem_stat['watermark']
+            oj_problem_set.append(problem_set)
+        return oj_problem_set
+    finally:
+        executor.shutdown(wait=False)
+
+
+def synch_user_problem(user_id):
+    try:
+        user_info = get_user_details(user_id)
+        oj_problem_set = fetch_judge_problem_set(generate_judge_fetcher_list(user_info))
+        sync_problems(user_id, oj_problem_set)
+        # Watermarks move only after the new submissions are stored, so a failed sync is retried in full
+        save_judge_watermarks(user_id, oj_problem_set)
     except Exception as e:
         raise e
@@ -1,9 +1,8 @@
 import datetime
 import time
-import requests
 from flask import current_app as app
 
-_http_headers = {'Content-Type': 'application/json'}
+from extensions.flask_es import es_store
 
 _es_index_user_ratings = 'cfs_user_rating_records'
 
@@ -13,13 +12,11 @@ _es_size = 500
 
 def search_user_ratings(user_id):
     try:
-        rs = requests.session()
         must = [{'term': {'user_id': user_id}}]
         query_json = {'query': {'bool': {'must': must}}}
         query_json['sort'] = [{'created_at': {'order': 'asc'}}]
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user_ratings, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_user_ratings, query_json)
         if 'hits' in response:
             item_list = []
             for hit in response['hits']['hits']:
@@ -35,7 +32,6 @@ def search_user_ratings(user_id):
 
 def add_user_ratings(user_id, skill_value, solve_count):
     try:
-        rs = requests.session()
         data = {
             'user_id': user_id,
             'skill_value': skill_value,
@@ -43,8 +39,7 @@ def add_user_ratings(user_id, skill_value, solve_count):
             'created_at': int(time.time()),
             'updated_at': int(time.time())
         }
-        post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user_ratings, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        response = es_store.index(_es_index_user_ratings, data)
         if 'result' in response and response['result'] == 'created':
             return {'message': 'success'}
         app.logger.error('Elasticsearch down, response: ' + str(response))
@@ -53,8 +48,20 @@ def add_user_ratings(user_id, skill_value, solve_count):
         raise e
 
 
-def get_user_rating_history(user_id):
-    rating_list = search_user_ratings(user_id)
+def add_user_rating_list(rating_list, created_at, writer):
+    # Record ids carry the run time, so a rerun of the same run overwrites instead of duplicating
+    for rating in rating_list:
+        data = {
+            'user_id': rating['user_id'],
+            'skill_value': rating['skill_value'],
+            'solve_count': rating['solve_count'],
+            'created_at': created_at,
+            'updated_at': created_at
+        }
+        writer.index(_es_index_user_ratings, f'{rating["user_id"]}:{created_at}', data)
+
+
+def generate_rating_history(rating_list):
     rating_history = []
     for rating_data in rating_list:
         daytime = datetime.datetime.fromtimestamp(rating_data['created_at'])
@@ -75,3 +82,33 @@ def get_user_rating_history(user_id):
         }
         rating_history.append(data)
     return rating_history
+
+
+def get_user_rating_history(user_id):
+    return generate_rating_history(search_user_ratings(user_id))
+
+
+def get_user_rating_history_list(user_id_list):
+    # One msearch for a whole page of users instead of a search per user
+    try:
+        rating_history_map = {}
+        if len(user_id_list) == 0:
+            return rating_history_map
+        query_list = []
+        for user_id in user_id_list:
+            query_json = {'query': {'bool': {'must': [{'term': {'user_id': user_id}}]}}}
+            query_json['sort'] = [{'created_at': {'order': 'asc'}}]
+            query_json['size'] = _es_size
+            query_list.append(query_json)
+        response = es_store.msearch(_es_index_user_ratings, query_list)
+        if 'responses' not in response:
+            app.logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+        for user_id, user_response in zip(user_id_list, response['responses']):
+            if 'hits' not in user_response:
+                app.logger.error('Elasticsearch down, response: ' + str(user_response))
+                raise Exception('Internal server error')
+            rating_history_map[user_id] = generate_rating_history([hit['_source'] for hit in user_response['hits']['hits']])
+        return rating_history_map
+    except Exception as e:
+        raise e
@@ -1,88 +1,172 @@
 import math
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app as app
 import time
 import json
 
+from extensions.flask_es import es_store
+
 from commons.skillset import Skill
-from core.problem_services import get_total_problem_score_for_user
-from core.rating_services import add_user_ratings
+from core.problem_services import get_solved_problem_id_sets, get_problem_score_map
+from core.rating_services import add_user_rating_list
+from core.leaderboard_services import update_leaderboards_for_users
 from core.sync_services import user_problem_data_sync, user_training_model_sync, team_training_model_sync
-from core.team_services import search_teams, get_team_details, update_team_details
-from core.user_services import search_user, get_user_details, update_user_details
+from core.team_services import get_team_member_id_map, reformat_team_data
+from core.user_services import search_user_id_pages, invalidate_user_cards, reformat_user_data
+
+_es_index_user = 'cfs_users'
+_es_index_team = 'cfs_teams'
+_es_type = '_doc'
+_rating_batch_size = 100
+
+_user_rating_source = ['username', 'skill_value', 'decreased_skill_value', 'total_score', 'target_score', 'solve_count', 'contribution']
+_team_rating_source = ['skill_value', 'decreased_skill_value', 'total_score', 'target_score', 'solve_count']
+
+
+def generate_rating_update(details_info, current_problem_score):
+    # details_info is reformatted the way get_user_details and get_team_details return it, so skill_value is
+    # already net of decreased_skill_value and the scores are rounded, as the weekly formula has always read them
+    skill_value = details_info.get('skill_value', 0)
+    previous_problem_score = details_info.get('total_score', 0)
+    target_score = details_info.get('target_score', 0)
+    updated_data = {
+        'total_score': current_problem_score
+    }
+    decrease_factor = 0
+    if current_problem_score < previous_problem_score + target_score:
+        decrease_amount = previous_problem_score + target_score - current_problem_score
+        decrease_factor = math.sqrt(decrease_amount)
+
+    skill = Skill()
+    updated_data['decreased_skill_value'] = details_info.get('decreased_skill_value', 0) + decrease_factor
+    current_skill = skill_value - updated_data['decreased_skill_value']
+    current_skill_level = skill.get_skill_level_from_skill(current_skill)
+    updated_data['target_score'] = skill.generate_next_week_prediction(current_skill_level)
+    return updated_data, current_skill
+
+
+def _run_with_app_context(flask_app, sync_method, ref_id):
+    with flask_app.app_context():
+        sync_method(ref_id)
+
+
+def search_id_list(index):
+    try:
+        id_list = []
+        query_json = {'query': {'match_all': {}}}
+        query_json['_source'] = False
+        for hit_list in es_store.search_pages(index, query_json):
+            id_list += [hit['_id'] for hit in hit_list]
+        return id_list
+    except Exception as e:
+        raise e
+
+
+def load_rating_details(index, id_list, source):
+    try:
+        response = es_store.mget(index, id_list, source=','.join(source))
+        if 'docs' not in response:
+            app.logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+        return {doc['_id']: doc['_source'] for doc in response['docs'] if doc.get('found', False)}
+    except Exception as e:
+        raise e
+
+
+def rate_user_batch(user_id_list, rated_at, score_map):
+    try:
+        details_map = load_rating_details(_es_index_user, user_id_list, _user_rating_source)
+        solved_map = get_solved_problem_id_sets(list(details_map.keys()))
+        get_problem_score_map(set().union(*solved_map.values()), score_map)
+
+        rating_list = []
+        writer = es_store.bulk_writer()
+        for user_id, details_info in details_map.items():
+            current_problem_score = sum(score_map[problem_id] for problem_id in solved_map[user_id])
+            updated_data, current_skill = generate_rating_update(reformat_user_data(dict(details_info)), current_problem_score)
+            updated_data['updated_at'] = rated_at
+            rating_list.append({'user_id': user_id, 'skill_value': current_skill, 'solve_count': details_info.get('solve_count', 0)})
+            writer.update(_es_index_user, user_id, updated_data)
+            details_info.update(updated_data)
+        writer.flush()
+        # Users deleted since the batch was loaded are skipped instead of being recreated
+        for user_id in writer.missing_id_list:
+            details_map.pop(user_id, None)
+        rating_list = [rating for rating in rating_list if rating['user_id'] in details_map]
+        add_user_rating_list(rating_list, rated_at, writer)
+        writer.flush()
+        update_leaderboards_for_users(details_map)
+        invalidate_user_cards(list(details_map.keys()))
+    except Exception as e:
+        raise e
+
+
+def rate_team_batch(team_id_list, rated_at, score_map):
+    try:
+        details_map = load_rating_details(_es_index_team, team_id_list, _team_rating_source)
+        member_map = get_team_member_id_map(list(details_map.keys()))
+        solved_map = get_solved_problem_id_sets(list(set().union(*member_map.values())))
+        get_problem_score_map(set().union(*solved_map.values()), score_map)
+
+        rating_list = []
+        writer = es_store.bulk_writer()
+        for team_id, details_info in details_map.items():
+            # A problem solved by several members counts once for the team
+            problem_id_set = set()
+            for member_id in member_map[team_id]:
+                problem_id_set |= solved_map[member_id]
+            current_problem_score = sum(score_map[problem_id] for problem_id in problem_id_set)
+            updated_data, current_skill = generate_rating_update(reformat_team_data(dict(details_info)), current_problem_score)
+            updated_data['updated_at'] = rated_at
+            rating_list.append({'user_id': team_id, 'skill_value': current_skill, 'solve_count': details_info.get('solve_count', 0)})
+            writer.update(_es_index_team, team_id, updated_data)
+        writer.flush()
+        # Teams deleted since the batch was loaded are skipped instead of being recreated
+        missing_id_set = set(writer.missing_id_list)
+        rating_list = [rating for rating in rating_list if rating['user_id'] not in missing_id_set]
+        add_user_rating_list(rating_list, rated_at, writer)
+        writer.flush()
+    except Exception as e:
+        raise e
+
 
-_es_size = 2000
+def run_rating_sync(id_list, sync_method, rate_batch):
+    # The judge and training model syncs run ahead on the pool; each batch is rated as soon as its syncs finish
+    flask_app = app._get_current_object()
+    rated_at = int(time.time())
+    score_map = {}
+    executor = ThreadPoolExecutor(max_workers=int(app.config.get('RATING_SYNC_WORKERS', 4)))
+    future_map = {}
+    try:
+        for ref_id in id_list:
+            future_map[ref_id] = executor.submit(_run_with_app_context, flask_app, sync_method, ref_id)
+        for start in range(0, len(id_list), _rating_batch_size):
+            batch_id_list = id_list[start:start + _rating_batch_size]
+            for ref_id in batch_id_list:
+                try:
+                    future_map[ref_id].result()
+                except Exception as e:
+                    app.logger.error(f'{sync_method.__name__} failed for {ref_id}, rating the stored data: {e}')
+            rate_batch(batch_id_list, rated_at, score_map)
+            app.logger.info(f'rated {min(start + _rating_batch_size, len(id_list))} of {len(id_list)}')
+    finally:
+        for future in future_map.values():
+            future.cancel()
+        executor.shutdown(wait=True)
 
 
 def user_list_sync():
     app.logger.info(f'user_list_sync called')
-    user_list = search_user({}, 0, _es_size)
-    for user in user_list:
-        id = user['id']
-        user_problem_data_sync(id)
-        app.logger.info(f'user_problem_data_sync done')
-
-        # user_training_model_sync(id)
-        # app.logger.info(f'user_training_model_sync done')
-
-        details_info = get_user_details(id)
-        skill_value = details_info.get('skill_value', 0)
-        solve_count = details_info.get('solve_count', 0)
-        app.logger.info(f'skill_value: {skill_value}, solve_count: {solve_count}')
-        previous_problem_score = details_info['total_score']
-        app.logger.info(f'previous_problem_score: {previous_problem_score}')
-        current_problem_score = get_total_problem_score_for_user([id])
-        app.logger.info(f'current_problem_score: {current_problem_score}')
-
-        updated_data = {
-            'total_score': current_problem_score
-        }
-        decrease_factor = 0
-        if current_problem_score < previous_problem_score + details_info['target_score']:
-            decrease_amount = previous_problem_score + details_info['target_score'] - current_problem_score
-            app.logger.info(f'decrease_amount: {decrease_amount}')
-            decrease_factor = math.sqrt(decrease_amount)
-
-        skill = Skill()
-        updated_data['decreased_skill_value'] = details_info['decreased_skill_value'] + decrease_factor
-        current_skill = skill_value - updated_data['decreased_skill_value']
-        app.logger.info(f'current_skill: {current_skill}')
-        current_skill_level = skill.get_skill_level_from_skill(current_skill)
-        app.logger.info(f'decrease_amount: {current_skill_level}')
-        updated_data['target_score'] = skill.generate_next_week_prediction(current_skill_level)
-        app.logger.info(f'updated_data: {updated_data}')
-        add_user_ratings(id, current_skill, solve_count)
-        update_user_details(id, updated_data)
+    # Only ids are kept; a single user sync can outlive the point in time, so the walk finishes before syncing starts
+    user_id_list = []
+    for id_list in search_user_id_pages():
+        user_id_list += id_list
+    run_rating_sync(user_id_list, user_problem_data_sync, rate_user_batch)
     app.logger.info(f'user_list_sync completed')
 
 
 def team_list_sync():
-    team_list = search_teams({}, 0, _es_size)
-    for team in team_list:
-        id = team['id']
-        team_training_model_sync(id)
-        details_info = get_team_details(id)
-        member_id_list = []
-        for member in details_info['member_list']:
-            member_id_list.append(member['user_id'])
-
-        skill_value = details_info.get('skill_value', 0)
-        solve_count = details_info.get('solve_count', 0)
-        previous_problem_score = details_info['total_score']
-        current_problem_score = get_total_problem_score_for_user(member_id_list)
-        updated_data = {
-            'total_score': current_problem_score
-        }
-        decrease_factor = 0
-        if current_problem_score < previous_problem_score + details_info['target_score']:
-            decrease_amount = previous_problem_score + details_info['target_score'] - current_problem_score
-            decrease_factor = math.sqrt(decrease_amount)
-
-        skill = Skill()
-        updated_data['decreased_skill_value'] = details_info['decreased_skill_value'] + decrease_factor
-        current_skill = skill_value - updated_data['decreased_skill_value']
-        current_skill_level = skill.get_skill_level_from_skill(current_skill)
-        updated_data['target_score'] = skill.generate_next_week_prediction(current_skill_level)
-        add_user_ratings(id, current_skill, solve_count)
-        update_team_details(id, updated_data)
+    app.logger.info(f'team_list_sync called')
+    run_rating_sync(search_id_list(_es_index_team), team_training_model_sync, rate_team_batch)
     app.logger.info(f'team_list_sync completed')
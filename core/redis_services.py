@@ -49,3 +49,47 @@ def add_new_job(user_id, logged_in_user_role=None):
         redis_store.connection.set(redis_user_job_key, 1, timedelta(minutes=app.config["REDIS_PREFIX_USER_JOB_TIMEOUT"]))
         add_pending_job(user_id)
         return True
+
+
+# A job id that is still queued or running comes back as its own id. A bulk job promoted by an interactive
+# request is rewritten with its new lane, so a retry or an expired lease sends it back to the interactive lane
+_enqueue_sync_job_script = """
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1 then
+    return ARGV[1]
+end
+local existing = redis.call('GET', KEYS[1])
+if existing then
+    local existing_job = cjson.decode(existing)
+    if ARGV[3] == 'interactive' and existing_job['job_lane'] == 'bulk' and redis.call('LREM', KEYS[4], 1, existing) == 1 then
+        existing_job['job_lane'] = 'interactive'
+        local promoted = cjson.encode(existing_job)
+        redis.call('SET', KEYS[1], promoted, 'EX', ARGV[4])
+        redis.call('LPUSH', KEYS[3], promoted)
+    end
+    return existing_job['id']
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[4])
+redis.call('SADD', KEYS[2], ARGV[1])
+if ARGV[3] == 'interactive' then
+    redis.call('LPUSH', KEYS[3], ARGV[2])
+else
+    redis.call('LPUSH', KEYS[4], ARGV[2])
+end
+redis.call('LPUSH', KEYS[5], 1)
+redis.call('LTRIM', KEYS[5], 0, 99)
+return false
+"""
+
+
+def enqueue_sync_job(job_id, job_type, job_ref_id, job_lane):
+    # Returns the id of the pending job this one was folded into, or None when it was queued itself
+    queue_key = app.config["REDIS_PREFIX_SYNC_QUEUE"]
+    payload = json.dumps({'id': job_id, 'job_type': job_type, 'job_ref_id': job_ref_id, 'job_lane': job_lane}, sort_keys=True)
+    keys = [f'{queue_key}:coalesce:{job_type}:{job_ref_id}', f'{queue_key}:queued', f'{queue_key}:pending:interactive',
+            f'{queue_key}:pending:bulk', f'{queue_key}:wakeup']
+    return redis_store.connection.eval(_enqueue_sync_job_script, len(keys), *keys, job_id, payload, job_lane,
+                                       app.config["SYNC_JOB_COALESCE_TTL"])
+
+
+def get_sync_job_progress(job_id):
+    return redis_store.connection.hgetall(f'{app.config["REDIS_PREFIX_SYNC_QUEUE"]}:progress:{job_id}')
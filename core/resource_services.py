@@ -1,13 +1,12 @@
 import time
 import json
-import requests
 from flask import current_app as app
 import random
 
-from core.user_services import get_user_details
-from core.vote_services import get_vote_count_list
+from extensions.flask_es import es_store
 
-_http_headers = {'Content-Type': 'application/json'}
+from core.user_services import get_user_cards
+from core.vote_services import get_vote_count_list, get_vote_count_list_for_ref_list
 
 _es_index_resource = 'cfs_resources'
 
@@ -17,12 +16,10 @@ _es_size = 100
 
 def add_resources(data):
     try:
-        rs = requests.session()
         data['created_at'] = int(time.time())
         data['updated_at'] = int(time.time())
 
-        post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_resource, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        response = es_store.index(_es_index_resource, data)
         if 'result' in response and response['result'] == 'created':
             app.logger.info('Create resource method completed')
             return response['_id']
@@ -33,7 +30,6 @@ def add_resources(data):
 
 def search_resource(param, from_val, size):
     try:
-        rs = requests.session()
         query_json = {'query': {'match_all': {}}}
 
         must = []
@@ -52,15 +48,15 @@ def search_resource(param, from_val, size):
         query_json['from'] = from_val
         query_json['sort'] = [{'created_at': {'order': 'desc'}}]
 
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_resource, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_resource, query_json)
         print('response: ', response)
         item_list = []
         if 'hits' in response:
+            writer_map = get_user_cards([hit['_source']['resource_writer'] for hit in response['hits']['hits']])
             for hit in response['hits']['hits']:
                 data = hit['_source']
                 data['id'] = hit['_id']
-                user_details = get_user_details(data['resource_writer'])
+                user_details = writer_map[data['resource_writer']]
                 data['resource_writer_handle'] = user_details['username']
                 data['resource_writer_skill_color'] = user_details['skill_color']
                 data['resource_id'] = hit['_id']
@@ -72,3 +68,45 @@ def search_resource(param, from_val, size):
 
     except Exception as e:
         raise e
+
+
+def search_resource_for_ref_list(ref_id_list, size_per_ref=None):
+    # Pages through every resource of the refs, so a page of problems is never cut off at one search's size
+    try:
+        resource_map = {}
+        for ref_id in ref_id_list:
+            resource_map[ref_id] = []
+        if len(ref_id_list) == 0:
+            return resource_map
+
+        query_json = {'query': {'bool': {'must': [{'terms': {'resource_ref_id': list(ref_id_list)}}]}}}
+        query_json['sort'] = [{'created_at': {'order': 'desc'}}]
+        ref_count_map = {}
+        hit_list = []
+        for page in es_store.search_pages(_es_index_resource, query_json):
+            for hit in page:
+                ref_id = hit['_source']['resource_ref_id']
+                ref_count_map[ref_id] = ref_count_map.get(ref_id, 0) + 1
+                if size_per_ref is None or ref_count_map[ref_id] <= size_per_ref:
+                    hit_list.append(hit)
+
+        writer_map = get_user_cards([hit['_source']['resource_writer'] for hit in hit_list])
+        item_list = []
+        for hit in hit_list:
+            data = hit['_source']
+            data['id'] = hit['_id']
+            user_details = writer_map[data['resource_writer']]
+            data['resource_writer_handle'] = user_details['username']
+            data['resource_writer_skill_color'] = user_details['skill_color']
+            data['resource_id'] = hit['_id']
+            data['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data['updated_at']))
+            item_list.append(data)
+
+        vote_count_map = get_vote_count_list_for_ref_list([data['resource_id'] for data in item_list])
+        for data in item_list:
+            data['vote_count'] = vote_count_map[data['resource_id']]
+            resource_map.setdefault(data['resource_ref_id'], []).append(data)
+        return resource_map
+
+    except Exception as e:
+        raise e
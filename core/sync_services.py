@@ -32,12 +32,7 @@ def user_problem_data_sync(user_id):
 
 def user_training_model_sync(user_id):
     app.logger.info(f'user_training_model_sync service called for user: {user_id}')
-    for count in range(0, 3):
-        sync_category_score_for_user(user_id)
-    # FIXITLATER:
-    # NEED TO FIX THIS LATER, MIGHT NEED TO APPLY RECURSION IN A DAG.
-    # THE CATEGORY DEPENDENCY LIST MUST FORM A DAG. NEED TO WRITE SCRIPT TO VERIFY.
-
+    sync_category_score_for_user(user_id)
     app.logger.info('sync_category_score_for_user done')
 
     skill_value = sync_root_category_score_for_user(user_id)
@@ -1,12 +1,11 @@
 import time
 import json
-import requests
 import datetime
 from flask import current_app as app
 
-_http_headers = {'Content-Type': 'application/json'}
+from extensions.flask_es import es_store
 
-from core.user_services import search_user, get_user_details, get_skill_color
+from core.user_services import search_user, get_user_card, get_skill_color
 from scrappers.codeforces_scrapper import CodeforcesScrapper
 from core.classroom_services import search_task_lists, search_class_lists
 from core.user_services import get_user_details_by_handle_name
@@ -125,16 +124,12 @@ def add_team_members_bulk(member_list, team_id, team_type, logged_in_user):
 
 def update_team_details(team_id, post_data):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_team, _es_type, team_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_team, team_id)
         if 'found' in response:
             if response['found']:
-                data = response['_source']
-                for key, value in post_data.items():
-                    data[key] = value
-                data['updated_at'] = int(time.time())
-                response = rs.put(url=search_url, json=data, headers=_http_headers).json()
+                changes = dict(post_data)
+                changes['updated_at'] = int(time.time())
+                response = es_store.update(_es_index_team, team_id, changes)
                 if 'result' in response:
                     return response['result']
                 else:
@@ -150,9 +145,7 @@ def update_team_details(team_id, post_data):
 
 def get_team_details(team_id):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_team, _es_type, team_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_team, team_id)
 
         if 'found' in response:
             if response['found']:
@@ -162,10 +155,10 @@ def get_team_details(team_id):
                 data['rating_history'] = get_team_rating_history(team_id)
                 data['task_list'] = search_task_lists({'classroom_id': team_id}, 0, 3)
                 data['class_list'] = search_class_lists({'classroom_id': team_id}, 0, 3)
-                user_details = get_user_details(data['team_leader_id'])
+                user_details = get_user_card(data['team_leader_id'])
                 data['team_leader_handle'] = user_details['username']
                 data['team_leader_skill_color'] = user_details['skill_color']
-                data['follow_stat'] = get_follow_stat(data['id'])
+                data['follow_stat'] = get_follow_stat(data['id'], data)
                 data['last_synced_time'] = last_completed_job_time(team_id)
                 data = reformat_team_data(data)
                 return data
@@ -179,14 +172,12 @@ def get_team_details(team_id):
 
 def delete_all_users_from_team(team_id):
     try:
-        rs = requests.session()
         must = [
             {'term': {'team_id': team_id}},
         ]
         query_json = {'query': {'bool': {'must': must}}}
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_delete_by_query'.format(app.config['ES_HOST'], _es_index_user_team_edge, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.delete_by_query(_es_index_user_team_edge, query_json)
         return response
 
     except Exception as e:
@@ -195,14 +186,12 @@ def delete_all_users_from_team(team_id):
 
 def get_all_users_from_team(team_id):
     try:
-        rs = requests.session()
         must = [
             {'term': {'team_id': team_id}},
         ]
         query_json = {'query': {'bool': {'must': must}}}
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user_team_edge, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_user_team_edge, query_json)
 
         item_list = []
 
@@ -219,17 +208,30 @@ def get_all_users_from_team(team_id):
         raise e
 
 
+def get_team_member_id_map(team_id_list):
+    try:
+        member_map = {team_id: [] for team_id in team_id_list}
+        if len(member_map) == 0:
+            return member_map
+        query_json = {'query': {'bool': {'must': [{'terms': {'team_id': list(member_map.keys())}}]}}}
+        query_json['_source'] = ['team_id', 'user_id']
+        for hit_list in es_store.search_pages(_es_index_user_team_edge, query_json):
+            for hit in hit_list:
+                member_map[hit['_source']['team_id']].append(hit['_source']['user_id'])
+        return member_map
+    except Exception as e:
+        raise e
+
+
 def get_user_team_edge(team_id, user_handle):
     try:
-        rs = requests.session()
         must = [
             {'term': {'team_id': team_id}},
             {'term': {'user_handle': user_handle}}
         ]
         query_json = {'query': {'bool': {'must': must}}}
         query_json['size'] = 1
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user_team_edge, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_user_team_edge, query_json)
 
         if 'hits' in response:
             if response['hits']['total']['value'] > 0:
@@ -240,8 +242,6 @@ def get_user_team_edge(team_id, user_handle):
 
 def add_team_member(data):
     try:
-        rs = requests.session()
-
         resp = get_user_team_edge(data['team_id'], data['user_handle'])
 
         if resp is not None:
@@ -250,8 +250,7 @@ def add_team_member(data):
         data['created_at'] = int(time.time())
         data['updated_at'] = int(time.time())
 
-        post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user_team_edge, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        response = es_store.index(_es_index_user_team_edge, data)
 
         if 'result' in response and response['result'] == 'created':
             return response
@@ -264,8 +263,6 @@ def add_team_member(data):
 
 def update_team_member(data):
     try:
-        rs = requests.session()
-
         resp = get_user_team_edge(data['team_id'], data['user_handle'])
 
         if resp is None:
@@ -275,8 +272,7 @@ def update_team_member(data):
         resp_data['status'] = data['status']
         resp_data['updated_at'] = int(time.time())
 
-        url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user_team_edge, _es_type, resp['_id'])
-        response = rs.put(url=url, json=resp_data, headers=_http_headers).json()
+        response = es_store.index(_es_index_user_team_edge, resp_data, resp['_id'])
 
         if 'result' in response:
             return response
@@ -290,14 +286,12 @@ def update_team_member(data):
 
 def delete_team_member(team_id, user_handle):
     try:
-        rs = requests.session()
         resp = get_user_team_edge(team_id, user_handle)
 
         if resp is None:
             raise Exception('Member not found')
 
-        url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user_team_edge, _es_type, resp['_id'])
-        response = rs.delete(url=url, headers=_http_headers).json()
+        response = es_store.delete(_es_index_user_team_edge, resp['_id'])
 
         if 'result' in response:
             return response
@@ -311,7 +305,6 @@ def delete_team_member(team_id, user_handle):
 
 def search_teams(param, from_val, size_val):
     try:
-        rs = requests.session()
         query_json = {'query': {'match_all': {}}}
 
         must = []
@@ -328,8 +321,7 @@ def search_teams(param, from_val, size_val):
 
         query_json['from'] = from_val
         query_json['size'] = size_val
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_team, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_team, query_json)
         if 'hits' in response:
             item_list = []
             for hit in response['hits']['hits']:
@@ -349,8 +341,6 @@ def search_teams(param, from_val, size_val):
 
 def search_teams_for_user(user_handle, param):
     try:
-        rs = requests.session()
-
         must = []
         must.append({'term': {'user_handle': user_handle}})
         for p in param:
@@ -363,8 +353,7 @@ def search_teams_for_user(user_handle, param):
             {'term': {'status': 'deleted'}}
         ]
 
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user_team_edge, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_user_team_edge, query_json)
         if 'hits' in response:
             item_list = []
             rank = 1
@@ -1,25 +1,25 @@
 import time
 import json
-import requests
 from flask import current_app as app
 
+from extensions.flask_es import es_store
+
 from commons.skillset import Skill
 from models.category_skill_model import CategorySkillGenerator
 from models.category_score_model import CategoryScoreGenerator
 from models.problem_score_model import ProblemScoreGenerator
 
-from core.category_services import search_categories, find_category_dependency_list, get_category_details, find_category_dependency_list_for_multiple_categories
+from core.category_services import search_categories, get_category_details, find_category_dependency_list_for_multiple_categories
+from core.category_catalogue_services import get_catalogue_dependency_list, get_catalogue_topological_order
 
 from core.problem_services import get_problem_details, get_solved_problem_count_for_user, \
     find_problems_for_user_by_status_filtered, available_problems_for_user, add_user_problem_status, \
     find_problem_dependency_list, search_problems
-from core.user_category_edge_services import add_user_category_data, get_user_category_data
+from core.user_category_edge_services import add_user_category_data, get_user_category_data, get_user_category_data_list
 from core.team_services import get_team_details, update_team_details
 from core.user_services import get_user_details_by_handle_name, update_user_details
 from commons.skillset import Skill
 
-_http_headers = {'Content-Type': 'application/json'}
-
 
 _es_index_problem_user = 'cfs_user_problem_edges'
 _es_index_user_category = 'cfs_user_category_edges'
@@ -36,7 +36,6 @@ SKIP = 'SKIP'
 
 def generate_skill_value_for_user(user_id):
     app.logger.info('generate_skill_value_for_user: ' + str(user_id))
-    rs = requests.session()
     must = [
         {'term': {'category_root': 'root'}},
         {'term': {'user_id': user_id}},
@@ -45,8 +44,7 @@ def generate_skill_value_for_user(user_id):
     query_json['size'] = _es_size
 
     app.logger.info('generate_skill_value_for_user query_json: ' + json.dumps(query_json))
-    search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user_category, _es_type)
-    response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+    response = es_store.search(_es_index_user_category, query_json)
     app.logger.info('generate_skill_value_for_user response: ' + str(response))
 
     if 'hits' not in response:
@@ -65,7 +63,6 @@ def generate_skill_value_for_user(user_id):
 def search_top_skilled_categoires_for_user(user_id, category_root, sort_field, size, heavy=False):
     try:
         skill = Skill()
-        rs = requests.session()
         must = [{'term': {'user_id': user_id}}]
 
         if category_root == 'root':
@@ -78,8 +75,7 @@ def search_top_skilled_categoires_for_user(user_id, category_root, sort_field, s
         query_json['from'] = 0
         query_json['size'] = size
         query_json['sort'] = [{sort_field: {'order': 'desc'}}]
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user_category, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_user_category, query_json)
         item_list = []
         if 'hits' in response:
             rank = 1
@@ -101,7 +97,6 @@ def search_top_skilled_categoires_for_user(user_id, category_root, sort_field, s
 
 def search_top_skilled_problems_for_user(user_id, sort_field, size, heavy=False):
     try:
-        rs = requests.session()
         must = [{'term': {'user_id': user_id}}]
         must.append({'term': {'status': 'UNSOLVED'}})
         query_json = {'query': {'bool': {'must': must}}}
@@ -109,8 +104,7 @@ def search_top_skilled_problems_for_user(user_id, sort_field, size, heavy=False)
         query_json['from'] = 0
         query_json['size'] = size
         query_json['sort'] = [{sort_field: {'order': 'desc'}}]
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_problem_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_problem_user, query_json)
         item_list = []
         if 'hits' in response:
             rank = 1
@@ -163,7 +157,6 @@ def category_wise_problem_solve_for_users(user_list):
 
 def generate_sync_data_for_root_category(user_id, category, root_solved_count):
     try:
-        rs = requests.session()
         skill_obj = Skill()
         must = [
             {'term': {'category_root': category['category_name']}},
@@ -176,8 +169,7 @@ def generate_sync_data_for_root_category(user_id, category, root_solved_count):
         query_json['aggs'] = aggregate
         query_json['size'] = 0
 
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user_category, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_user_category, query_json)
 
         if 'aggregations' not in response:
             raise Exception('Internal server error')
@@ -223,25 +215,32 @@ def sync_root_category_score_for_user(user_id):
         root_solved_count = root_category_solved_count_by_solved_problem_list(solved_problems)
         category_list = search_categories({'category_root': 'root'}, 0, _es_size)
         skill_value = 0
-        for category in category_list:
-            data = generate_sync_data_for_root_category(user_id, category, root_solved_count)
-            skill_value += data['skill_value_by_percentage']
-            add_user_category_data(user_id, category['category_id'], data)
+        with es_store.bulk_writer() as writer:
+            for category in category_list:
+                data = generate_sync_data_for_root_category(user_id, category, root_solved_count)
+                skill_value += data['skill_value_by_percentage']
+                add_user_category_data(user_id, category['category_id'], data, writer, ranked=True)
         return skill_value
     except Exception as e:
         raise e
 
 
-def generate_sync_data_for_category(user_id, category):
+def generate_sync_data_for_category(user_id, category, skill_level_map = None):
     try:
         category_skill_generator = CategorySkillGenerator()
         factor = float(category.get('factor', 1))
         skill_stat = category_skill_generator.generate_skill(category['solved_stat']['difficulty_wise_count'], factor)
 
+        if skill_level_map is None:
+            skill_level_map = {}
+
         dependent_skill_level = []
-        dependent_categories = find_category_dependency_list(category['category_id'])
+        dependent_categories = get_catalogue_dependency_list(category['category_id'])
         for dcat in dependent_categories:
-            category_details = get_user_category_data(user_id, dcat['category_id'])
+            if dcat['category_id_2'] in skill_level_map:
+                dependent_skill_level.append(skill_level_map[dcat['category_id_2']])
+                continue
+            category_details = get_user_category_data(user_id, dcat['category_id_2'])
             category_level = 0
             if category_details:
                 category_level = category_details.get('skill_level', 0)
@@ -268,67 +267,113 @@ def generate_sync_data_for_category(user_id, category):
         raise e
 
 
-def sync_category_score_for_user(user_id):
+def sync_category_score_in_topological_order(user_id, category_list, ranked=False):
     try:
-        category_list = category_wise_problem_solve_for_users([user_id])
-
+        category_map = {}
         for category in category_list:
-            if category['category_root'] == 'root':
-                continue
-            data = generate_sync_data_for_category(user_id, category)
-            print('after sync data: ', data)
-            add_user_category_data(user_id, category['category_id'], data)
+            category_map[category['category_id']] = category
+
+        ordered_category_list = []
+        for category_id in get_catalogue_topological_order():
+            if category_id in category_map:
+                ordered_category_list.append(category_map.pop(category_id))
+        ordered_category_list += list(category_map.values())
+
+        # Dependencies are computed before their dependents, so every edge is written once with final levels.
+        # The root category aggregation reads these edges next, so wait for the refresh on flush.
+        skill_level_map = {}
+        with es_store.bulk_writer({'refresh': 'wait_for'}) as writer:
+            for category in ordered_category_list:
+                if category['category_root'] == 'root':
+                    continue
+                data = generate_sync_data_for_category(user_id, category, skill_level_map)
+                skill_level_map[category['category_id']] = data['skill_level']
+                add_user_category_data(user_id, category['category_id'], data, writer, ranked)
     except Exception as e:
         raise e
 
 
-def generate_sync_data_for_problem(user_id, user_skill_level, problem):
+def sync_category_score_for_user(user_id):
     try:
+        category_list = category_wise_problem_solve_for_users([user_id])
+        sync_category_score_in_topological_order(user_id, category_list, ranked=True)
+    except Exception as e:
+        raise e
+
+
+def find_scoring_category_id_list(problem):
+    dependent_categories = problem.get('categories', None)
+    if dependent_categories is None:
         dependent_categories = find_problem_dependency_list(problem['id'])
-        problem_score_generator = ProblemScoreGenerator()
-        if problem['problem_type'] == 'classical':
-            dependent_category_id_list = []
-            for category in dependent_categories:
-                category_id = category['category_id']
-                dependent_category_id_list.append(category_id)
-            dependent_dependent_category_list = find_category_dependency_list_for_multiple_categories(dependent_category_id_list)
+    dependent_category_id_list = [category['category_id'] for category in dependent_categories]
+    if problem['problem_type'] == 'classical':
+        return find_category_dependency_list_for_multiple_categories(dependent_category_id_list)
+    return dependent_category_id_list
+
+
+def generate_sync_data_for_problem_list(user_id, user_skill_level, problem_list):
+    try:
+        category_id_lists = [find_scoring_category_id_list(problem) for problem in problem_list]
+        category_id_set = set()
+        for category_id_list in category_id_lists:
+            category_id_set.update(category_id_list)
+        edge_map = get_user_category_data_list(user_id, list(category_id_set))
+
+        problem_diff_list = []
+        category_level_lists = []
+        for problem, category_id_list in zip(problem_list, category_id_lists):
             category_level_list = []
-            for category_id in dependent_dependent_category_list:
-                category_details = get_user_category_data(user_id, category_id)
+            for category_id in category_id_list:
+                category_details = edge_map.get(category_id, None)
                 category_level = 0
                 if category_details:
                     category_level = category_details.get('skill_level', 0)
                 category_level_list.append(category_level)
-            relevant_score = problem_score_generator.generate_score(int(float(problem['problem_difficulty'])),
-                                                                    category_level_list, user_skill_level)
-        else:
-            category_level_list = []
-            for category in dependent_categories:
-                category_id = category['category_id']
-                category_details = get_user_category_data(user_id, category_id)
-                category_level = 0
-                if category_details:
-                    category_level = category_details.get('skill_level', 0)
-                category_level_list.append(category_level)
-            relevant_score = problem_score_generator.generate_score(int(float(problem['problem_difficulty'])),
-                                                                    category_level_list, user_skill_level)
-        data = {
-            'problem_id': problem['id'],
-            'relevant_score': relevant_score['score'],
-            'user_id': user_id,
-            'status': 'UNSOLVED'
-        }
-        return data
+            problem_diff_list.append(int(float(problem['problem_difficulty'])))
+            category_level_lists.append(category_level_list)
+
+        problem_score_generator = ProblemScoreGenerator()
+        relevant_score_list = problem_score_generator.generate_score_list(problem_diff_list, category_level_lists, user_skill_level)
+        data_list = []
+        for problem, relevant_score in zip(problem_list, relevant_score_list):
+            data = {
+                'problem_id': problem['id'],
+                'relevant_score': relevant_score['score'],
+                'user_id': user_id,
+                'status': 'UNSOLVED'
+            }
+            data_list.append(data)
+        return data_list
+    except Exception as e:
+        raise e
+
+
+def generate_sync_data_for_problem(user_id, user_skill_level, problem):
+    try:
+        return generate_sync_data_for_problem_list(user_id, user_skill_level, [problem])[0]
+    except Exception as e:
+        raise e
+
+
+def add_problem_score_list(user_id, user_skill_level, problem_list, writer):
+    try:
+        data_list = generate_sync_data_for_problem_list(user_id, user_skill_level, problem_list)
+        for data in data_list:
+            add_user_problem_status(user_id, data['problem_id'], data, writer)
     except Exception as e:
         raise e
 
 
 def sync_problem_score_for_user(user_id, user_skill_level):
     try:
-        problem_list = available_problems_for_user(user_id)
-        for problem in problem_list:
-            data = generate_sync_data_for_problem(user_id, user_skill_level, problem)
-            add_user_problem_status(user_id, problem['id'], data)
+        with es_store.bulk_writer() as writer:
+            problem_list = []
+            for problem in available_problems_for_user(user_id):
+                problem_list.append(problem)
+                if len(problem_list) >= _es_size:
+                    add_problem_score_list(user_id, user_skill_level, problem_list, writer)
+                    problem_list = []
+            add_problem_score_list(user_id, user_skill_level, problem_list, writer)
     except Exception as e:
         raise e
 
@@ -354,19 +399,23 @@ def sync_problem_score_for_team(team_id, user_skill_level):
     try:
         team_details = get_team_details(team_id)
         marked_list = {}
-        for member in team_details['member_list']:
-            user_details = get_user_details_by_handle_name(member['user_handle'])
-            if user_details is None:
-                continue
-            user_id = user_details['id']
-            problem_list = available_problems_for_user(user_id)
-            for problem in problem_list:
-                problem_id = problem['id']
-                if problem_id in marked_list:
+        with es_store.bulk_writer() as writer:
+            problem_list = []
+            for member in team_details['member_list']:
+                user_details = get_user_details_by_handle_name(member['user_handle'])
+                if user_details is None:
                     continue
-                marked_list[problem_id] = 1
-                data = generate_sync_data_for_problem(team_id, user_skill_level, problem)
-                add_user_problem_status(team_id, problem['id'], data)
+                user_id = user_details['id']
+                for problem in available_problems_for_user(user_id):
+                    problem_id = problem['id']
+                    if problem_id in marked_list:
+                        continue
+                    marked_list[problem_id] = 1
+                    problem_list.append(problem)
+                    if len(problem_list) >= _es_size:
+                        add_problem_score_list(team_id, user_skill_level, problem_list, writer)
+                        problem_list = []
+            add_problem_score_list(team_id, user_skill_level, problem_list, writer)
     except Exception as e:
         raise e
 
@@ -382,11 +431,7 @@ def sync_category_score_for_team(team_id):
             user_list.append(user_details['id'])
 
         category_list = category_wise_problem_solve_for_users(user_list)
-        for category in category_list:
-            if category['category_root'] == 'root':
-                continue
-            data = generate_sync_data_for_category(team_id, category)
-            add_user_category_data(team_id, category['category_id'], data)
+        sync_category_score_in_topological_order(team_id, category_list)
     except Exception as e:
         raise e
 
@@ -408,10 +453,11 @@ def sync_root_category_score_for_team(team_id):
         root_solved_count = root_category_solved_count_by_solved_problem_list(solved_problems)
         category_list = search_categories({'category_root': 'root'}, 0, 100)
         skill_value = 0
-        for category in category_list:
-            data = generate_sync_data_for_root_category(team_id, category, root_solved_count)
-            add_user_category_data(team_id, category['category_id'], data)
-            skill_value += data['skill_value_by_percentage']
+        with es_store.bulk_writer() as writer:
+            for category in category_list:
+                data = generate_sync_data_for_root_category(team_id, category, root_solved_count)
+                add_user_category_data(team_id, category['category_id'], data, writer)
+                skill_value += data['skill_value_by_percentage']
 
         return skill_value
     except Exception as e:
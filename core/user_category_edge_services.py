@@ -1,21 +1,24 @@
 import time
 import json
-import requests
 from flask import current_app as app
 
-from commons.skillset import Skill
+from extensions.flask_es import es_store
 
-from core.user_services import get_user_details
+from commons.skillset import Skill
 
-_http_headers = {'Content-Type': 'application/json'}
+from core.user_services import get_user_cards
+from core.category_catalogue_services import get_catalogue_category_list
+from core.category_leaderboard_services import update_category_leaderboard, is_category_leaderboard_built, \
+    get_category_leaderboard_page, get_category_leaderboard_page_list, get_category_leaderboard_rank
 
 _es_index_user_category = 'cfs_user_category_edges'
 _es_type = '_doc'
 _es_size = 500
 
+_topper_fields = ['user_id', 'user_handle', 'user_skill_color', 'skill_value', 'rank']
+
 
 def print_user_root_synced_data(user_id):
-    rs = requests.session()
     must = [
         {'term': {'category_root': 'root'}},
         {'term': {'user_id': user_id}},
@@ -23,66 +26,76 @@ def print_user_root_synced_data(user_id):
     query_json = {'query': {'bool': {'must': must}}}
     query_json['size'] = _es_size
 
-    search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user_category, _es_type)
-    response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+    response = es_store.search(_es_index_user_category, query_json)
 
 
 def get_user_root_synced_data_by_id(data_id):
-    rs = requests.session()
-    search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user_category, _es_type, data_id)
-    response = rs.get(url=search_url, headers=_http_headers).json()
+    response = es_store.get(_es_index_user_category, data_id)
+
+
+def generate_user_category_edge_id(user_id, category_id):
+    return f'{user_id}:{category_id}'
 
 
 def get_user_category_data(user_id, category_id):
     try:
-        rs = requests.session()
-        must = [
-            {'term': {'user_id': user_id}},
-            {'term': {'category_id': category_id}}
-        ]
-        query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = 1
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user_category, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        if 'hits' in response:
-            for hit in response['hits']['hits']:
-                edge = hit['_source']
-                edge['id'] = hit['_id']
+        response = es_store.get(_es_index_user_category, generate_user_category_edge_id(user_id, category_id))
+        if 'found' in response:
+            if response['found']:
+                edge = response['_source']
+                edge['id'] = response['_id']
                 return edge
-        return None
+            return None
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
     except Exception as e:
         raise e
 
 
-def add_user_category_data(user_id, category_id, data):
+def get_user_category_data_list(user_id, category_id_list):
     try:
-        rs = requests.session()
-        data['user_id'] = user_id
-        data['category_id'] = category_id
-        edge = get_user_category_data(user_id, category_id)
+        edge_map = {}
+        if len(category_id_list) == 0:
+            return edge_map
+        edge_id_list = [generate_user_category_edge_id(user_id, category_id) for category_id in category_id_list]
+        response = es_store.mget(_es_index_user_category, edge_id_list)
+        if 'docs' in response:
+            for doc in response['docs']:
+                if doc.get('found', False):
+                    edge = doc['_source']
+                    edge['id'] = doc['_id']
+                    edge_map[edge['category_id']] = edge
+            return edge_map
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
 
-        if edge is None:
-            data['created_at'] = int(time.time())
-            data['updated_at'] = int(time.time())
-            url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user_category, _es_type)
-            response = rs.post(url=url, json=data, headers=_http_headers).json()
-            get_user_root_synced_data_by_id(response['_id'])
-            print_user_root_synced_data(user_id)
-            if 'result' in response:
-                return response['_id']
-            raise Exception('Internal server error')
 
-        edge_id = edge['id']
-        edge.pop('id', None)
+def add_user_category_data(user_id, category_id, data, writer=None, ranked=False):
+    # Only user edges are ranked; team syncs write their edges here too and leave ranked unset
+    try:
+        data['user_id'] = user_id
+        data['category_id'] = category_id
+        data['updated_at'] = int(time.time())
+        data.pop('id', None)
 
-        for f in data:
-            edge[f] = data[f]
+        upsert_data = dict(data)
+        upsert_data['created_at'] = data['updated_at']
+        edge_id = generate_user_category_edge_id(user_id, category_id)
+        ranked = ranked and 'skill_value' in data
 
-        edge['updated_at'] = int(time.time())
-        url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user_category, _es_type, edge_id)
-        response = rs.put(url=url, json=edge, headers=_http_headers).json()
+        if writer is not None:
+            writer.upsert(_es_index_user_category, edge_id, data, upsert_data)
+            if ranked:
+                skill_value = data['skill_value']
+                writer.after_flush(lambda: update_category_leaderboard(category_id, user_id, skill_value))
+            return edge_id
 
+        response = es_store.update(_es_index_user_category, edge_id, data, upsert_data=upsert_data)
         if 'result' in response:
+            if ranked:
+                update_category_leaderboard(category_id, user_id, data['skill_value'])
             return response['result']
 
         raise Exception('Internal server error')
@@ -93,16 +106,15 @@ def add_user_category_data(user_id, category_id, data):
 
 def update_root_category_skill_for_user(user_id, root_category_list, root_category_solve_count):
     app.logger.info(f'update_root_category_skill_for_user called for: {user_id}')
-    rs = requests.session()
     user_skill_sum = 0
+    writer = es_store.bulk_writer()
     for cat in root_category_list:
         must = [{"term": {"category_root": cat["category_name"]}}, {"term": {"user_id": user_id}}]
         aggs = {
             "skill_value_by_percentage": {"sum": {"field": "skill_value_by_percentage"}}
         }
         query_json = {"size": 0, "query": {"bool": {"must": must}}, "aggs": aggs}
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user_category, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_user_category, query_json)
         if 'aggregations' in response:
             skill_value = response['aggregations']['skill_value_by_percentage']['value']
             category_id = cat['category_id']
@@ -131,38 +143,138 @@ def update_root_category_skill_for_user(user_id, root_category_list, root_catego
             user_skill_sum += uc_edge['skill_value_by_percentage']
             app.logger.info(f'add uc_edge: {uc_edge}')
             uc_edge.pop('id', None)
-            add_user_category_data(user_id, category_id, uc_edge)
+            add_user_category_data(user_id, category_id, uc_edge, writer, ranked=True)
+    writer.flush()
     return user_skill_sum
 
 
-def get_category_toppers(category_id):
+def generate_topper_list(entry_list, edge_list):
+    user_card_map = get_user_cards([entry['user_id'] for entry in entry_list])
+    item_list = []
+    for idx, entry in enumerate(entry_list):
+        user_details = user_card_map.get(entry['user_id'], None)
+        if user_details is None:
+            app.logger.error(f'User not found: {entry["user_id"]}')
+            continue
+        edge = edge_list[idx]
+        edge['user_handle'] = user_details['username']
+        edge['user_skill_color'] = user_details['skill_color']
+        edge['skill_value'] = float("{:.2f}".format(edge.get('skill_value', 0)))
+        edge['rank'] = entry['rank']
+        item_list.append(edge)
+    return item_list
+
+
+def search_category_toppers(category_id, size):
     try:
-        rs = requests.session()
         must = [
             {'term': {'category_id': category_id}}
         ]
         query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = _es_size
+        query_json['size'] = size
         query_json['sort'] = [{'skill_value': {'order': 'desc'}}]
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user_category, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_user_category, query_json)
         if 'hits' in response:
-            item_list = []
-            rank = 1
+            entry_list = []
+            edge_list = []
             for hit in response['hits']['hits']:
                 edge = hit['_source']
                 edge['id'] = hit['_id']
-                try:
-                    user_details = get_user_details(edge['user_id'])
-                except Exception as e:
-                    app.logger.error(f'User not found: {str(e)}')
+                entry_list.append({'user_id': edge['user_id'], 'rank': len(entry_list) + 1})
+                edge_list.append(edge)
+            return generate_topper_list(entry_list, edge_list)
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def get_category_toppers(category_id, start=0, size=_es_size):
+    # Served from the category's ranked set; until the sets are rebuilt it falls back to sorting the edges
+    try:
+        if not is_category_leaderboard_built():
+            return search_category_toppers(category_id, size)
+        entry_list = get_category_leaderboard_page(category_id, start, size)
+        edge_map = get_user_category_edge_list_for_users(category_id, [entry['user_id'] for entry in entry_list])
+        edge_list = []
+        for entry in entry_list:
+            edge = edge_map.get(entry['user_id'], None)
+            if edge is None:
+                edge = {'user_id': entry['user_id'], 'category_id': category_id, 'skill_value': entry['skill_value']}
+            edge_list.append(edge)
+        return generate_topper_list(entry_list, edge_list)
+    except Exception as e:
+        raise e
+
+
+def get_user_category_edge_list_for_users(category_id, user_id_list):
+    try:
+        edge_map = {}
+        if len(user_id_list) == 0:
+            return edge_map
+        edge_id_list = [generate_user_category_edge_id(user_id, category_id) for user_id in user_id_list]
+        response = es_store.mget(_es_index_user_category, edge_id_list)
+        if 'docs' in response:
+            for doc in response['docs']:
+                if doc.get('found', False):
+                    edge = doc['_source']
+                    edge['id'] = doc['_id']
+                    edge_map[edge['user_id']] = edge
+            return edge_map
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def get_user_category_rank(category_id, user_id):
+    try:
+        return get_category_leaderboard_rank(category_id, user_id)
+    except Exception as e:
+        raise e
+
+
+def get_root_category_toppers(size):
+    try:
+        root_category_list = get_catalogue_category_list('root')
+        if not is_category_leaderboard_built():
+            item_list = []
+            for category in root_category_list:
+                topper_list = []
+                for edge in search_category_toppers(category['category_id'], size):
+                    topper_list.append({field: edge[field] for field in _topper_fields})
+                item_list.append({
+                    'category_id': category['category_id'],
+                    'category_name': category['category_name'],
+                    'topper_list': topper_list,
+                })
+            return item_list
+
+        page_map = get_category_leaderboard_page_list([category['category_id'] for category in root_category_list], size)
+        entry_list = []
+        for category_id in page_map:
+            entry_list += page_map[category_id]
+        user_card_map = get_user_cards([entry['user_id'] for entry in entry_list])
+
+        item_list = []
+        for category in root_category_list:
+            topper_list = []
+            for entry in page_map[category['category_id']]:
+                user_details = user_card_map.get(entry['user_id'], None)
+                if user_details is None:
                     continue
-                edge['user_handle'] = user_details['username']
-                edge['user_skill_color'] = user_details['skill_color']
-                edge['skill_value'] = float("{:.2f}".format(edge.get('skill_value', 0)))
-                edge['rank'] = rank
-                rank += 1
-                item_list.append(edge)
+                topper_list.append({
+                    'user_id': entry['user_id'],
+                    'user_handle': user_details['username'],
+                    'user_skill_color': user_details['skill_color'],
+                    'skill_value': float("{:.2f}".format(entry['skill_value'])),
+                    'rank': entry['rank'],
+                })
+            item_list.append({
+                'category_id': category['category_id'],
+                'category_name': category['category_name'],
+                'topper_list': topper_list,
+            })
         return item_list
     except Exception as e:
         raise e
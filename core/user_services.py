@@ -1,25 +1,28 @@
-import requests
 from flask import current_app as app
+
+from extensions.flask_es import es_store
+from extensions.flask_redis import redis_store
 import time
 import json
 
 from core.follower_services import get_follow_stat
-from core.rating_services import get_user_rating_history
+from core.rating_services import get_user_rating_history_list
 from commons.skillset import Skill
-from core.job_services import last_completed_job_time
-
-_http_headers = {'Content-Type': 'application/json'}
+from core.job_services import last_completed_job_time, last_completed_job_time_list
+from core.leaderboard_services import update_user_leaderboards, get_leaderboard_page, get_leaderboard_size, \
+    is_leaderboard_built, leaderboard_sort_fields
 
 _es_index_user = 'cfs_users'
 _es_type = '_doc'
 _es_size = 2000
 
 public_fields = ['username', 'first_name', 'last_name', 'full_name', 'skill_value', 'skill_title', 'solve_count']
+card_source_fields = ['username', 'skill_title', 'skill_value', 'decreased_skill_value']
 
 
 def get_skill_color(user_id):
-    user_details = get_user_details(user_id)
-    return user_details.get('skill_color', '#000000')
+    user_card = get_user_card(user_id)
+    return user_card.get('skill_color', '#000000')
 
 
 def reformat_user_data(data, rank = 1):
@@ -42,12 +45,85 @@ def reformat_user_data(data, rank = 1):
     return data
 
 
+def _user_card_key(user_id):
+    return f'{app.config["REDIS_PREFIX_USER_CARD"]}:{user_id}'
+
+
+def generate_user_card(user_id, data):
+    skill = Skill()
+    skill_value = data.get('skill_value', 0) - data.get('decreased_skill_value', 0)
+    return {
+        'id': user_id,
+        'username': data['username'],
+        'skill_title': data.get('skill_title', 'NA'),
+        'skill_color': skill.get_color_from_skill_title(data.get('skill_title', 'NA')),
+        'skill_value': float("{:.2f}".format(skill_value)),
+    }
+
+
+def get_user_cards(user_id_list):
+    try:
+        card_map = {}
+        user_id_list = list(dict.fromkeys(user_id_list))
+        if len(user_id_list) == 0:
+            return card_map
+
+        cached_list = redis_store.connection.mget([_user_card_key(user_id) for user_id in user_id_list])
+        missing_list = []
+        for user_id, cached in zip(user_id_list, cached_list):
+            if cached is None:
+                missing_list.append(user_id)
+            else:
+                card_map[user_id] = json.loads(cached)
+        if len(missing_list) == 0:
+            return card_map
+
+        response = es_store.mget(_es_index_user, missing_list, source=','.join(card_source_fields))
+        if 'docs' not in response:
+            app.logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+        ttl = int(app.config.get('USER_CARD_TTL', 3600))
+        pipe = redis_store.connection.pipeline()
+        for doc in response['docs']:
+            if doc.get('found', False):
+                card = generate_user_card(doc['_id'], doc['_source'])
+                card_map[doc['_id']] = card
+                pipe.setex(_user_card_key(doc['_id']), ttl, json.dumps(card))
+        pipe.execute()
+        return card_map
+    except Exception as e:
+        raise e
+
+
+def get_user_card(user_id):
+    try:
+        card_map = get_user_cards([user_id])
+        if user_id not in card_map:
+            raise Exception('User not found')
+        return card_map[user_id]
+    except Exception as e:
+        raise e
+
+
+def invalidate_user_card(user_id):
+    try:
+        redis_store.connection.delete(_user_card_key(user_id))
+    except Exception as e:
+        raise e
+
+
+def invalidate_user_cards(user_id_list):
+    try:
+        if len(user_id_list) > 0:
+            redis_store.connection.delete(*[_user_card_key(user_id) for user_id in user_id_list])
+    except Exception as e:
+        raise e
+
+
 def get_user_details_by_handle_name(username):
     try:
-        rs = requests.session()
         query_json = {'query': {'bool': {'must': [{'match': {'username': username}}]}}}
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_user, query_json)
         if 'hits' in response:
             for hit in response['hits']['hits']:
                 user = hit['_source']
@@ -61,16 +137,13 @@ def get_user_details_by_handle_name(username):
 
 def get_user_details(user_id):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user, _es_type, user_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_user, user_id)
         print('response: ', response)
         if 'found' in response:
             if response['found']:
                 data = response['_source']
                 data['id'] = response['_id']
-                data['follow_stat'] = get_follow_stat(user_id)
-                data['follow_stat'] = get_follow_stat(user_id)
+                data['follow_stat'] = get_follow_stat(user_id, data)
                 data['last_synced_time'] = last_completed_job_time(user_id)
                 data = reformat_user_data(data)
                 return data
@@ -82,20 +155,22 @@ def get_user_details(user_id):
 def update_user_details(user_id, user_data):
     try:
         ignore_fields = ['username', 'password']
-        rs = requests.session()
-
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user, _es_type, user_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_user, user_id)
 
         if 'found' in response:
             if response['found']:
                 user = response['_source']
+                changes = {}
                 for key in user_data:
                     if key not in ignore_fields and user_data[key]:
-                        user[key] = user_data[key]
+                        changes[key] = user_data[key]
+                user.update(changes)
 
-                response = rs.put(url=search_url, json=user, headers=_http_headers).json()
+                # A partial update leaves the follow counters written by follower_services untouched
+                response = es_store.update(_es_index_user, user_id, changes)
                 if 'result' in response:
+                    invalidate_user_card(user_id)
+                    update_user_leaderboards(user_id, user)
                     return response['result']
             return 'not found'
         app.logger.error('Elasticsearch down')
@@ -108,18 +183,16 @@ def update_user_details(user_id, user_data):
 def add_contribution(user_id, value):
     try:
         ignore_fields = ['username', 'password']
-        rs = requests.session()
-
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user, _es_type, user_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_user, user_id)
 
         if 'found' in response:
             if response['found']:
                 user = response['_source']
                 contribution = int(user.get('contribution', 0)) + value
                 user['contribution'] = contribution
-                response = rs.put(url=search_url, json=user, headers=_http_headers).json()
+                response = es_store.update(_es_index_user, user_id, {'contribution': contribution})
                 if 'result' in response:
+                    update_user_leaderboards(user_id, user)
                     return response['result']
             return 'not found'
         app.logger.error('Elasticsearch down')
@@ -131,14 +204,12 @@ def add_contribution(user_id, value):
 
 def get_user_details_public(user_id):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_user, _es_type, user_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_user, user_id)
         print('response: ', response)
         if 'found' in response:
             if response['found']:
                 data = response['_source']
-                data['follow_stat'] = get_follow_stat(user_id)
+                data['follow_stat'] = get_follow_stat(user_id, data)
                 public_data = {}
                 for f in public_fields:
                     public_data[f] = data.get(f, None)
@@ -150,6 +221,20 @@ def get_user_details_public(user_id):
         raise e
 
 
+def add_user_list_stats(user_list):
+    # Every user list page carries the same fields whether it was ranked by Redis or sorted in Elasticsearch
+    try:
+        user_id_list = [user['id'] for user in user_list]
+        rating_history_map = get_user_rating_history_list(user_id_list)
+        synced_time_map = last_completed_job_time_list(user_id_list)
+        for user in user_list:
+            user['follow_stat'] = get_follow_stat(user['id'], user)
+            user['rating_history'] = rating_history_map[user['id']]
+            user['last_synced_time'] = synced_time_map[user['id']]
+    except Exception as e:
+        raise e
+
+
 def search_user(param, from_val, to_val, sort_by = 'updated_at', sort_order = 'desc'):
     try:
         must = []
@@ -170,21 +255,20 @@ def search_user(param, from_val, to_val, sort_by = 'updated_at', sort_order = 'd
 
         query_json['from'] = from_val
         query_json['size'] = to_val
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user, _es_type)
-        response = requests.session().post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_user, query_json)
         print(response)
 
         if 'hits' in response:
             data = []
             rank = 1
+            user_list = []
             for hit in response['hits']['hits']:
                 user = hit['_source']
                 user['id'] = hit['_id']
-                follow_stat = get_follow_stat(user['id'])
-                user['follow_stat'] = follow_stat
-                user['rating_history'] = get_user_rating_history(user['id'])
+                user_list.append(user)
+            add_user_list_stats(user_list)
+            for user in user_list:
                 user['rank'] = rank
-                user['last_synced_time'] = last_completed_job_time(user['id'])
                 rank += 1
                 user = reformat_user_data(user)
                 data.append(user)
@@ -196,8 +280,64 @@ def search_user(param, from_val, to_val, sort_by = 'updated_at', sort_order = 'd
         raise e
 
 
+def search_leaderboard_users(board, start, size, sort_order='desc'):
+    try:
+        entry_list = get_leaderboard_page(board, start, size, sort_order)
+        if len(entry_list) == 0:
+            return []
+        response = es_store.mget(_es_index_user, [entry['user_id'] for entry in entry_list])
+        if 'docs' not in response:
+            app.logger.error('Elasticsearch down, response : ' + str(response))
+            raise Exception('Internal server error')
+        user_list = []
+        for entry, doc in zip(entry_list, response['docs']):
+            if not doc.get('found', False):
+                continue
+            user = doc['_source']
+            user['id'] = doc['_id']
+            user['rank'] = entry['rank']
+            user_list.append(user)
+        add_user_list_stats(user_list)
+        return [reformat_user_data(user) for user in user_list]
+    except Exception as e:
+        raise e
+
+
+def search_ranked_users(param, from_val, size_val, board):
+    # Unfiltered ranking pages come from the leaderboard, filtered ones and an unbuilt board still sort in Elasticsearch
+    try:
+        if len(param) == 0 and is_leaderboard_built(board):
+            return search_leaderboard_users(board, from_val, size_val)
+        sort_by = [field for field, field_board in leaderboard_sort_fields.items() if field_board == board][0]
+        return search_user(param, from_val, size_val, sort_by=sort_by, sort_order='desc')
+    except Exception as e:
+        raise e
+
+
+def search_user_id_pages(param=None):
+    try:
+        param = param or {}
+        must = []
+        for k in ['user_role']:
+            if k in param:
+                must.append({'term': {k: param[k]}})
+        query_json = {'query': {'bool': {'must': must}}}
+        query_json['_source'] = False
+        for hit_list in es_store.search_pages(_es_index_user, query_json):
+            yield [hit['_id'] for hit in hit_list]
+    except Exception as e:
+        raise e
+
+
 def dtsearch_user(param, start, length, sort_by = 'updated_at', sort_order = 'desc'):
     try:
+        board = leaderboard_sort_fields.get(sort_by, None)
+        if not param.get('filter', None) and board is not None and is_leaderboard_built(board):
+            return {
+                'user_list': search_leaderboard_users(board, start, length, sort_order),
+                'total': get_leaderboard_size(board)
+            }
+
         query_json = {'query': {'match_all': {}}}
         text_fields = ['username', 'full_name']
         should = []
@@ -212,19 +352,19 @@ def dtsearch_user(param, start, length, sort_by = 'updated_at', sort_order = 'de
         query_json['sort'] = [{sort_by: {'order': sort_order}}]
         query_json['from'] = start
         query_json['size'] = length
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_user, _es_type)
-        response = requests.session().post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_user, query_json)
         print('response: ', response)
 
         if 'hits' in response:
             data = []
             rank = 1
+            user_list = []
             for hit in response['hits']['hits']:
                 user = hit['_source']
                 user['id'] = hit['_id']
-                follow_stat = get_follow_stat(user['id'])
-                user['follow_stat'] = follow_stat
-                user['rating_history'] = get_user_rating_history(user['id'])
+                user_list.append(user)
+            add_user_list_stats(user_list)
+            for user in user_list:
                 user['rank'] = rank+start
                 user['solve_count'] = user.get('solve_count', 0)
                 user['contribution'] = user.get('contribution', 0)
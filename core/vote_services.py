@@ -1,12 +1,12 @@
 import time
 import json
-import requests
 from flask import current_app as app
 import random
 
-from core.user_services import add_contribution
+from extensions.flask_es import es_store
+from extensions.flask_redis import redis_store
 
-_http_headers = {'Content-Type': 'application/json'}
+from core.user_services import add_contribution
 
 _es_index_vote = 'cfs_votes'
 _es_index_comment = 'cfs_comments'
@@ -18,6 +18,31 @@ _es_size = 100
 LIKE = 'LIKE'
 DISLIKE = 'DISLIKE'
 
+_vote_tally_fields = ['like_count', 'dislike_count']
+_vote_tally_field_by_type = {LIKE: 'like_count', DISLIKE: 'dislike_count'}
+
+# Only bump a tally that is already materialized, a missing one is rebuilt from cfs_votes on the next read.
+# Every vote also bumps the ref's version, so a count taken while the vote landed is not stored.
+_vote_tally_increment_script = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+end
+return nil
+"""
+
+# Stores a tally counted from cfs_votes only if no vote landed on the ref since its version was read
+_vote_tally_store_script = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'like_count', ARGV[2], 'dislike_count', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
 
 class voteManager:
     blog = 5
@@ -27,9 +52,7 @@ class voteManager:
 
 def get_blog_details(blog_id):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_blog, _es_type, blog_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_blog, blog_id)
         print(response)
         if 'found' in response:
             if response['found']:
@@ -46,9 +69,7 @@ def get_blog_details(blog_id):
 
 def get_comment_details(comment_id):
     try:
-        rs = requests.session()
-        search_url = 'http://{}/{}/{}/{}'.format(app.config['ES_HOST'], _es_index_comment, _es_type, comment_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_store.get(_es_index_comment, comment_id)
         if 'found' in response:
             if response['found']:
                 data = response['_source']
@@ -62,18 +83,14 @@ def get_comment_details(comment_id):
 
 def get_vote_count(vote_ref_id, vote_type):
     try:
-        rs = requests.session()
         must = [
             {'term': {'vote_ref_id': vote_ref_id}},
             {'term': {'vote_type': vote_type}}
         ]
         query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_vote, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        print('response: ', json.dumps(response))
-        if 'hits' in response:
-            return response['hits']['total']['value']
+        response = es_store.count(_es_index_vote, query_json)
+        if 'count' in response:
+            return response['count']
         app.logger.error('Elasticsearch down, response: ' + str(response))
         raise Exception('Internal server error')
     except Exception as e:
@@ -82,15 +99,13 @@ def get_vote_count(vote_ref_id, vote_type):
 
 def search_votes(param):
     try:
-        rs = requests.session()
         must = []
         for f in param:
             must.append({'term': {f: param[f]}})
 
         query_json = {'query': {'bool': {'must': must}}}
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(app.config['ES_HOST'], _es_index_vote, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_store.search(_es_index_vote, query_json)
         if 'hits' in response:
             item_list = []
             for hit in response['hits']['hits']:
@@ -104,15 +119,144 @@ def search_votes(param):
         raise e
 
 
-def get_vote_count_list(vote_ref_id):
+def _vote_tally_key(vote_ref_id):
+    return f'{app.config["REDIS_PREFIX_VOTE_TALLY"]}:{vote_ref_id}'
+
+
+def _vote_tally_version_key(vote_ref_id):
+    return f'{app.config["REDIS_PREFIX_VOTE_TALLY"]}_version:{vote_ref_id}'
+
+
+def count_votes_for_ref_list(vote_ref_id_list):
     try:
-        like_count = get_vote_count(vote_ref_id, LIKE)
-        dislike_count = get_vote_count(vote_ref_id, DISLIKE)
-        data = {
-            'like_count': like_count,
-            'dislike_count': dislike_count
+        vote_count_map = {}
+        for vote_ref_id in vote_ref_id_list:
+            vote_count_map[vote_ref_id] = {
+                'like_count': 0,
+                'dislike_count': 0
+            }
+        if len(vote_ref_id_list) == 0:
+            return vote_count_map
+
+        query_json = {'query': {'bool': {'must': [{'terms': {'vote_ref_id': list(vote_ref_id_list)}}]}}}
+        query_json['size'] = 0
+        query_json['aggs'] = {
+            'vote_ref': {
+                'terms': {'field': 'vote_ref_id', 'size': len(vote_ref_id_list)},
+                'aggs': {'vote_type': {'terms': {'field': 'vote_type'}}}
+            }
         }
-        return data
+        response = es_store.search(_es_index_vote, query_json)
+        if 'aggregations' in response:
+            for bucket in response['aggregations']['vote_ref']['buckets']:
+                vote_count = vote_count_map.setdefault(bucket['key'], {'like_count': 0, 'dislike_count': 0})
+                for type_bucket in bucket['vote_type']['buckets']:
+                    if type_bucket['key'] == LIKE:
+                        vote_count['like_count'] = type_bucket['doc_count']
+                    if type_bucket['key'] == DISLIKE:
+                        vote_count['dislike_count'] = type_bucket['doc_count']
+            return vote_count_map
+        app.logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def store_vote_tally_list(vote_count_map, version_map):
+    try:
+        ttl = int(app.config.get('VOTE_TALLY_TTL', 86400))
+        pipe = redis_store.connection.pipeline()
+        for vote_ref_id, vote_count in vote_count_map.items():
+            pipe.eval(_vote_tally_store_script, 2, _vote_tally_key(vote_ref_id), _vote_tally_version_key(vote_ref_id),
+                      version_map.get(vote_ref_id, ''), vote_count['like_count'], vote_count['dislike_count'], ttl)
+        pipe.execute()
+    except Exception as e:
+        raise e
+
+
+def refresh_vote_tally_list(vote_ref_id_list):
+    # Versions are read before counting, so a vote indexed after the count started keeps the count out of Redis
+    try:
+        version_list = redis_store.connection.mget([_vote_tally_version_key(vote_ref_id) for vote_ref_id in vote_ref_id_list])
+        version_map = {vote_ref_id: version or '' for vote_ref_id, version in zip(vote_ref_id_list, version_list)}
+        vote_count_map = count_votes_for_ref_list(vote_ref_id_list)
+        store_vote_tally_list(vote_count_map, version_map)
+        return vote_count_map
+    except Exception as e:
+        raise e
+
+
+def get_vote_count_list_for_ref_list(vote_ref_id_list):
+    try:
+        vote_count_map = {}
+        vote_ref_id_list = list(dict.fromkeys(vote_ref_id_list))
+        if len(vote_ref_id_list) == 0:
+            return vote_count_map
+
+        pipe = redis_store.connection.pipeline()
+        for vote_ref_id in vote_ref_id_list:
+            pipe.hmget(_vote_tally_key(vote_ref_id), _vote_tally_fields)
+        missing_list = []
+        for vote_ref_id, tally in zip(vote_ref_id_list, pipe.execute()):
+            if tally[0] is None or tally[1] is None:
+                missing_list.append(vote_ref_id)
+                continue
+            vote_count_map[vote_ref_id] = {
+                'like_count': int(tally[0]),
+                'dislike_count': int(tally[1])
+            }
+
+        if len(missing_list) > 0:
+            vote_count_map.update(refresh_vote_tally_list(missing_list))
+        return vote_count_map
+    except Exception as e:
+        raise e
+
+
+def get_vote_count_list(vote_ref_id):
+    try:
+        return get_vote_count_list_for_ref_list([vote_ref_id])[vote_ref_id]
+    except Exception as e:
+        raise e
+
+
+def apply_vote_tally(vote_ref_id, vote_type, delta):
+    try:
+        field = _vote_tally_field_by_type.get(vote_type, None)
+        if field is None:
+            return
+        ttl = int(app.config.get('VOTE_TALLY_TTL', 86400))
+        redis_store.connection.eval(_vote_tally_increment_script, 2, _vote_tally_key(vote_ref_id), _vote_tally_version_key(vote_ref_id),
+                                    field, delta, ttl)
+    except Exception as e:
+        raise e
+
+
+def reconcile_vote_tallies():
+    # Each tally is counted again after its version was read, so a vote cast during the walk is never overwritten
+    app.logger.info('reconcile_vote_tallies called')
+    try:
+        vote_ref_id_set = set()
+        query_json = {'query': {'match_all': {}}}
+        query_json['_source'] = ['vote_ref_id', 'vote_type']
+        for hit_list in es_store.search_pages(_es_index_vote, query_json):
+            for hit in hit_list:
+                vote = hit['_source']
+                if vote.get('vote_type', None) in _vote_tally_field_by_type:
+                    vote_ref_id_set.add(vote['vote_ref_id'])
+
+        stale_key_list = []
+        for key in redis_store.connection.scan_iter(match=_vote_tally_key('*')):
+            if key.split(':')[-1] not in vote_ref_id_set:
+                stale_key_list.append(key)
+        if len(stale_key_list) > 0:
+            redis_store.connection.delete(*stale_key_list)
+
+        ref_id_list = list(vote_ref_id_set)
+        for start in range(0, len(ref_id_list), _es_size):
+            refresh_vote_tally_list(ref_id_list[start:start+_es_size])
+        app.logger.info(f'reconcile_vote_tallies completed for {len(ref_id_list)} refs')
+        return len(ref_id_list)
     except Exception as e:
         raise e
 
@@ -128,19 +272,17 @@ def add_vote(data):
 
         if len(vote_list) > 0:
             return {'message': 'already_voted'}
-
-        rs = requests.session()
         data['created_at'] = int(time.time())
         data['updated_at'] = int(time.time())
 
-        post_url = 'http://{}/{}/{}'.format(app.config['ES_HOST'], _es_index_vote, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        response = es_store.index(_es_index_vote, data, params={'refresh': 'wait_for'})
 
         vote_factor = 1
         if data['vote_type'] == DISLIKE:
             vote_factor = -1
 
         if 'result' in response and response['result'] == 'created':
+            apply_vote_tally(data['vote_ref_id'], data['vote_type'], 1)
             if data['vote_topic'] == 'blog':
                 blog_details = get_blog_details(data['vote_ref_id'])
                 blog_writer = blog_details['blog_writer']
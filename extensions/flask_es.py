@@ -0,0 +1,277 @@
+import json
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import current_app
+
+_http_headers = {'Content-Type': 'application/json'}
+_bulk_headers = {'Content-Type': 'application/x-ndjson'}
+
+_es_type = '_doc'
+
+_retry_status = [429, 502, 503, 504]
+_idempotent_methods = frozenset(['HEAD', 'GET', 'PUT', 'DELETE'])
+_read_methods = frozenset(['HEAD', 'GET', 'PUT', 'POST', 'DELETE'])
+_retry_on_conflict = 3
+_pit_keep_alive = '2m'
+
+
+class ElasticsearchBulkWriter:
+
+    def __init__(self, client, bulk_size, params=None):
+        self.client = client
+        self.bulk_size = bulk_size
+        self.params = params
+        self.actions = []
+        self.missing_id_list = []
+        self.flush_callbacks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.actions = []
+            self.flush_callbacks = []
+
+    def upsert(self, index, doc_id, data, upsert_data=None):
+        action = {'update': {'_index': index, '_id': doc_id, 'retry_on_conflict': _retry_on_conflict}}
+        body = {'doc': data}
+        if upsert_data is None:
+            body['doc_as_upsert'] = True
+        else:
+            body['upsert'] = upsert_data
+        self.actions.append((action, body))
+        if len(self.actions) >= self.bulk_size:
+            self.flush()
+
+    def after_flush(self, callback):
+        # Runs once every action queued so far has been stored
+        self.flush_callbacks.append(callback)
+
+    def update(self, index, doc_id, data):
+        # A document deleted in the meantime stays deleted; its id is collected in missing_id_list
+        action = {'update': {'_index': index, '_id': doc_id, 'retry_on_conflict': _retry_on_conflict}}
+        self.actions.append((action, {'doc': data}))
+        if len(self.actions) >= self.bulk_size:
+            self.flush()
+
+    def index(self, index, doc_id, data):
+        self.actions.append(({'index': {'_index': index, '_id': doc_id}}, data))
+        if len(self.actions) >= self.bulk_size:
+            self.flush()
+
+    def delete(self, index, doc_id):
+        self.actions.append(({'delete': {'_index': index, '_id': doc_id}}, None))
+        if len(self.actions) >= self.bulk_size:
+            self.flush()
+
+    def flush(self, params=None):
+        # Callbacks of a failed flush are dropped along with its actions
+        flush_callbacks = self.flush_callbacks
+        self.flush_callbacks = []
+        if len(self.actions) == 0:
+            for callback in flush_callbacks:
+                callback()
+            return None
+        actions = self.actions
+        self.actions = []
+        response = self.client.bulk(actions, params or self.params)
+        if 'items' not in response:
+            raise Exception('Elasticsearch bulk request failed: ' + str(response)[:1000])
+        if response.get('errors', False):
+            for item in response['items']:
+                for action_type, result in item.items():
+                    if action_type == 'update' and result.get('status', None) == 404:
+                        self.missing_id_list.append(result['_id'])
+                        continue
+                    if 'error' in result:
+                        raise Exception('Elasticsearch bulk request failed: ' + str(result['error'])[:1000])
+        for callback in flush_callbacks:
+            callback()
+        return response
+
+
+class FlaskElasticsearch:
+
+    def __init__(self, app=None):
+        self.app = app
+        self.es_host = None
+        self.pool_size = None
+        self.timeout = None
+        self.max_retries = None
+        self.backoff_factor = None
+        self.page_size = None
+        self.bulk_size = None
+        self.session = None
+        self.read_session = None
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.es_host = app.config['ES_HOST']
+        self.pool_size = int(app.config.get('ES_POOL_SIZE', 20))
+        self.timeout = (float(app.config.get('ES_CONNECT_TIMEOUT', 3)), float(app.config.get('ES_READ_TIMEOUT', 30)))
+        self.max_retries = int(app.config.get('ES_MAX_RETRIES', 3))
+        self.backoff_factor = float(app.config.get('ES_RETRY_BACKOFF', 0.2))
+        self.page_size = int(app.config.get('ES_PAGE_SIZE', 1000))
+        self.bulk_size = int(app.config.get('ES_BULK_SIZE', 500))
+        self.session = self._connect(_idempotent_methods)
+        self.read_session = self._connect(_read_methods)
+
+    def _get_app(self):
+        if self.app:
+            return self.app
+        if current_app:
+            return current_app
+        raise RuntimeError('No application found.')
+
+    def _connect(self, retry_methods):
+        # Status retries are limited to retry_methods, connect retries are safe for every request
+        retry_params = {
+            'total': self.max_retries,
+            'connect': self.max_retries,
+            'read': 0,
+            'status': self.max_retries,
+            'backoff_factor': self.backoff_factor,
+            'status_forcelist': _retry_status,
+            'raise_on_status': False,
+        }
+        try:
+            retry = Retry(allowed_methods=retry_methods, **retry_params)
+        except TypeError:
+            retry = Retry(method_whitelist=retry_methods, **retry_params)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry, pool_block=True)
+        session = requests.Session()
+        session.headers.update(_http_headers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @property
+    def connection(self):
+        if self.session is None:
+            raise RuntimeError('Elasticsearch client is not initialized')
+        return self.session
+
+    def url(self, index, *parts):
+        path = '/'.join(str(part) for part in (index, ) + parts)
+        return 'http://{}/{}'.format(self.es_host, path)
+
+    def request(self, method, url, json_body=None, data=None, headers=None, params=None, idempotent=False):
+        # A POST that adds a document or runs a script must not be replayed, only read-only and
+        # plain document requests are sent through the session that retries on 502/503/504
+        session = self.read_session if idempotent else self.connection
+        response = session.request(method, url, json=json_body, data=data, headers=headers,
+                                   params=params, timeout=self.timeout)
+        return response.json()
+
+    def get(self, index, doc_id, params=None):
+        return self.request('GET', self.url(index, _es_type, doc_id), params=params)
+
+    def search(self, index, query_json, params=None):
+        return self.request('POST', self.url(index, _es_type, '_search'), json_body=query_json, params=params,
+                            idempotent=True)
+
+    def count(self, index, query_json=None):
+        return self.request('POST', self.url(index, '_count'), json_body=query_json, idempotent=True)
+
+    def index(self, index, data, doc_id=None, params=None):
+        if doc_id is None:
+            return self.request('POST', self.url(index, _es_type), json_body=data, params=params)
+        return self.request('PUT', self.url(index, _es_type, doc_id), json_body=data, params=params)
+
+    def update(self, index, doc_id, data, upsert=False, params=None, upsert_data=None):
+        body = {'doc': data}
+        if upsert_data is not None:
+            body['upsert'] = upsert_data
+        elif upsert:
+            body['doc_as_upsert'] = True
+        return self.request('POST', self.url(index, '_update', doc_id), json_body=body, params=params,
+                            idempotent=True)
+
+    def script_update(self, index, doc_id, script, upsert=None, params=None):
+        body = {'script': script}
+        if upsert is not None:
+            body['upsert'] = upsert
+        return self.request('POST', self.url(index, '_update', doc_id), json_body=body, params=params)
+
+    def delete(self, index, doc_id, params=None):
+        return self.request('DELETE', self.url(index, _es_type, doc_id), params=params)
+
+    def delete_by_query(self, index, query_json, params=None):
+        return self.request('POST', self.url(index, '_delete_by_query'), json_body=query_json, params=params,
+                            idempotent=True)
+
+    def scroll(self, scroll_id, keep_alive='1m'):
+        body = {'scroll': keep_alive, 'scroll_id': scroll_id}
+        return self.request('POST', self.url('_search', 'scroll'), json_body=body, idempotent=True)
+
+    def clear_scroll(self, scroll_id):
+        return self.request('DELETE', self.url('_search', 'scroll'), json_body={'scroll_id': scroll_id})
+
+    def open_point_in_time(self, index, keep_alive=_pit_keep_alive):
+        return self.request('POST', self.url(index, '_pit'), params={'keep_alive': keep_alive})
+
+    def close_point_in_time(self, pit_id):
+        return self.request('DELETE', self.url('_pit'), json_body={'id': pit_id})
+
+    def search_pages(self, index, query_json, page_size=None, keep_alive=_pit_keep_alive):
+        # Walks every hit of query_json against one point-in-time snapshot, yielding one page of hits at a time
+        response = self.open_point_in_time(index, keep_alive)
+        if 'id' not in response:
+            raise Exception('Elasticsearch point in time request failed: ' + str(response)[:1000])
+        pit_id = response['id']
+        page_size = page_size or self.page_size
+        body = dict(query_json)
+        body.pop('from', None)
+        body['size'] = page_size
+        body['track_total_hits'] = False
+        body['sort'] = list(query_json.get('sort', [])) + [{'_shard_doc': 'asc'}]
+        try:
+            while True:
+                body['pit'] = {'id': pit_id, 'keep_alive': keep_alive}
+                response = self.request('POST', self.url('_search'), json_body=body, idempotent=True)
+                if 'hits' not in response:
+                    raise Exception('Elasticsearch search request failed: ' + str(response)[:1000])
+                pit_id = response.get('pit_id', pit_id)
+                hits = response['hits']['hits']
+                if len(hits) > 0:
+                    yield hits
+                if len(hits) < page_size:
+                    break
+                body['search_after'] = hits[-1]['sort']
+        finally:
+            self.close_point_in_time(pit_id)
+
+    def mget(self, index, doc_ids, source=None):
+        body = {'ids': list(doc_ids)}
+        params = None
+        if source is not None:
+            params = {'_source': source}
+        return self.request('POST', self.url(index, '_mget'), json_body=body, params=params, idempotent=True)
+
+    def msearch(self, index, query_list):
+        lines = []
+        for query_json in query_list:
+            lines.append(json.dumps({'index': index}))
+            lines.append(json.dumps(query_json))
+        data = '\n'.join(lines) + '\n'
+        return self.request('POST', self.url('_msearch'), data=data, headers=_bulk_headers, idempotent=True)
+
+    def bulk(self, actions, params=None):
+        lines = []
+        for action, source in actions:
+            lines.append(json.dumps(action))
+            if source is not None:
+                lines.append(json.dumps(source))
+        data = '\n'.join(lines) + '\n'
+        return self.request('POST', self.url('_bulk'), data=data, headers=_bulk_headers, params=params)
+
+    def bulk_writer(self, params=None):
+        return ElasticsearchBulkWriter(self, self.bulk_size, params)
+
+
+es_store = FlaskElasticsearch()
@@ -4,7 +4,6 @@ import re
 import math
 import time
 import json
-import unittest
 from logging.handlers import TimedRotatingFileHandler
 
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -13,6 +12,14 @@ from flask_script import Manager
 from apis import Config, create_app
 
 from core.rating_sync_services import user_list_sync, team_list_sync
+from core.problem_counter_services import rebuild_problem_counters
+from core.edge_migration_services import migrate_user_edge_ids
+from core.category_catalogue_services import get_catalogue_topological_order, get_catalogue_cyclic_categories
+from core.comment_services import backfill_comment_ref_ids
+from core.vote_services import reconcile_vote_tallies
+from core.follower_services import rebuild_follow_counters
+from core.leaderboard_services import rebuild_leaderboards
+from core.category_leaderboard_services import rebuild_category_leaderboards
 
 
 def db_job():
@@ -50,11 +57,60 @@ def run():
 
 @manager.command
 def test():
-    tests = unittest.TestLoader().discover(f'{Config.BASEDIR}/test', pattern='test*.py')
-    result = unittest.TextTestRunner(verbosity=2).run(tests)
-    if result.wasSuccessful():
-        return 0
-    return 1
+    # The suite under tests/ is written with pytest fixtures, so it runs through pytest
+    import pytest
+    return int(pytest.main(['-v', f'{Config.BASEDIR}/tests']))
+
+
+@manager.command
+def rebuild_counters():
+    problem_count = rebuild_problem_counters()
+    app.logger.info(f'Problem counters rebuilt for {problem_count} problems')
+    print(f'Problem counters rebuilt for {problem_count} problems')
+
+
+@manager.command
+def migrate_edge_ids():
+    stat = migrate_user_edge_ids()
+    print(f'Edge ids migrated: {json.dumps(stat)}')
+    # Collapsed duplicates may have been counted more than once
+    rebuild_counters()
+
+
+@manager.command
+def check_category_dag():
+    cyclic_categories = get_catalogue_cyclic_categories()
+    if len(cyclic_categories) > 0:
+        print(f'Category dependencies do not form a DAG, cyclic categories: {cyclic_categories}')
+        return 1
+    print(f'Category dependencies form a DAG, topological order: {get_catalogue_topological_order()}')
+    return 0
+
+
+@manager.command
+def backfill_comment_refs():
+    updated = backfill_comment_ref_ids()
+    print(f'Comment ref ids backfilled for {updated} comments')
+
+
+@manager.command
+def reconcile_votes():
+    ref_count = reconcile_vote_tallies()
+    print(f'Vote tallies reconciled for {ref_count} refs')
+
+
+@manager.command
+def rebuild_follow_stats():
+    updated = rebuild_follow_counters()
+    print(f'Follow counters rebuilt for {updated} users and teams')
+
+
+@manager.command
+def rebuild_leaderboard():
+    user_count = rebuild_leaderboards()
+    print(f'Leaderboards rebuilt for {user_count} users')
+    category_count = rebuild_category_leaderboards()
+    print(f'Category leaderboards rebuilt for {category_count} categories')
 
 
 if __name__ == '__main__':
@@ -5,6 +5,7 @@ from bs4 import BeautifulSoup
 import re
 
 _http_headers = {'Content-Type': 'application/json'}
+_http_timeout = 30
 
 class CodechefScrapper:
 
@@ -13,7 +14,7 @@ class CodechefScrapper:
         year = 2020
         while year >= 2008:
             url = f'https://www.codechef.com/submissions?sort_by=All&sorting_order=desc&language=All&status=15&year={year}&handle={username}&pcode=&ccode=&Submit=GO'
-            submission_page = rs.get(url=url, headers=_http_headers)
+            submission_page = rs.get(url=url, headers=_http_headers, timeout=_http_timeout)
             soup = BeautifulSoup(submission_page.text, 'html.parser')
             soup.prettify()
             table = soup.find("table",{"class":"dataTable"})
@@ -41,7 +42,7 @@ class CodechefScrapper:
         try:
             rs = requests.session()
             url = f'https://www.codechef.com/status/{problem_id},{username}'
-            submission_page = rs.get(url=url, headers=_http_headers)
+            submission_page = rs.get(url=url, headers=_http_headers, timeout=_http_timeout)
             soup = BeautifulSoup(submission_page.text, 'html.parser')
             table = soup.find("table",{"class":"dataTable"})
             last_ac_submission = None
@@ -69,7 +70,7 @@ class CodechefScrapper:
         try:
             rs = requests.session()
             url = f'https://www.codechef.com/users/{username}'
-            profile_page = rs.get(url=url, headers=_http_headers)
+            profile_page = rs.get(url=url, headers=_http_headers, timeout=_http_timeout)
             soup = BeautifulSoup(profile_page.text, 'html.parser')
 
             problems = []
@@ -98,7 +99,7 @@ class CodechefScrapper:
         try:
             rs = requests.session()
             url = f'https://www.codechef.com/users/{username}'
-            profile_page = rs.get(url=url, headers=_http_headers)
+            profile_page = rs.get(url=url, headers=_http_headers, timeout=_http_timeout)
             soup = BeautifulSoup(profile_page.text, 'html.parser')
 
             contentTable = soup.find('article')
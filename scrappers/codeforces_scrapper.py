@@ -5,17 +5,39 @@ from bs4 import BeautifulSoup
 import re
 
 _http_headers = {'Content-Type': 'application/json'}
+_http_timeout = 30
+
+# A submission without a verdict, still in the queue or only through pretests can still turn into a solve
+_pending_verdicts = ['SUBMITTED', 'TESTING']
+
+
+def is_final_verdict(submission):
+    verdict = submission.get('verdict', None)
+    if verdict is None or verdict in _pending_verdicts:
+        return False
+    return not (verdict == 'OK' and submission.get('testset', None) == 'PRETESTS')
+
+
+def generate_watermark(username, submission, full_scan_at):
+    return {
+        'handle': username,
+        'submission_id': submission['id'],
+        'submission_time': int(submission['creationTimeSeconds']),
+        'full_scan_at': full_scan_at
+    }
 
 
 class CodeforcesScrapper:
 
     rating_history_url = 'https://codeforces.com/api/user.rating?handle='
+    submission_url = 'https://codeforces.com/api/user.status'
+    submission_page_size = 1000
 
     def get_user_info(self, username):
         try:
             rs = requests.session()
             url = f'http://codeforces.com/api/user.status?handle={username}&from=1&count=1000000'
-            submission_list = rs.get(url=url, headers=_http_headers).json()
+            submission_list = rs.get(url=url, headers=_http_headers, timeout=_http_timeout).json()
             submission_list = submission_list['result']
 
             solved_problems = []
@@ -40,15 +62,46 @@ class CodeforcesScrapper:
                 'solved_problems': []
             }
 
-    def get_user_info_heavy(self, username):
-        try:
-            rs = requests.session()
-            url = f'http://codeforces.com/api/user.status?handle={username}&from=1&count=1000000'
-            submission_list = rs.get(url=url, headers=_http_headers).json()
-            submission_list = submission_list['result']
-            solved_problems = {}
-
+    def get_submission_pages(self, username, rs):
+        # Codeforces lists submissions newest first, so pages are walked from the top down
+        start = 1
+        while True:
+            url = f'{self.submission_url}?handle={username}&from={start}&count={self.submission_page_size}'
+            response = rs.get(url=url, headers=_http_headers, timeout=_http_timeout).json()
+            if response.get('status', None) != 'OK':
+                raise Exception(f'Codeforces user.status failed: {response.get("comment", response)}')
+            submission_list = response['result']
+            if len(submission_list) > 0:
+                yield submission_list
+            if len(submission_list) < self.submission_page_size:
+                break
+            start += self.submission_page_size
+
+    def get_user_info_heavy(self, username, watermark=None):
+        rs = requests.session()
+        solved_problems = {}
+        seen_submission_set = set()
+        last_submission_id = watermark['submission_id'] if watermark else 0
+        full_scan_at = watermark.get('full_scan_at', None) if watermark else int(time.time())
+        # The watermark stops at the newest final verdict older than every pending one, so a pending
+        # submission is fetched again on the next sync
+        new_watermark = watermark
+        candidate = None
+        reached_watermark = False
+
+        for submission_list in self.get_submission_pages(username, rs):
             for submission in submission_list:
+                if submission['id'] <= last_submission_id:
+                    reached_watermark = True
+                    break
+                if submission['id'] in seen_submission_set:
+                    continue
+                seen_submission_set.add(submission['id'])
+                if not is_final_verdict(submission):
+                    candidate = None
+                    continue
+                if candidate is None:
+                    candidate = submission
                 if 'verdict' not in submission or 'testset' not in submission:
                     continue
                 if submission['verdict'] == 'OK' and submission['testset'] == 'TESTS':
@@ -66,26 +119,24 @@ class CodeforcesScrapper:
                         'submission_id': submission["id"]
                     }
                     solved_problems[problem]['submission_list'].append(sublink)
-            return {
-                'platform': 'codeforces',
-                'user_name': username,
-                'solved_count': len(solved_problems),
-                'solved_problems': solved_problems
-            }
-        except Exception as e:
-            print('Exception occurred: ', str(e))
-            return {
-                'platform': 'codeforces',
-                'user_name': username,
-                'solved_count': 0,
-                'solved_problems': {}
-            }
+            if reached_watermark:
+                break
+        if candidate is not None:
+            new_watermark = generate_watermark(username, candidate, full_scan_at)
+
+        return {
+            'platform': 'codeforces',
+            'user_name': username,
+            'solved_count': len(solved_problems),
+            'solved_problems': solved_problems,
+            'watermark': new_watermark
+        }
 
     def get_submission_stat(self, username):
         try:
             rs = requests.session()
             url = f'http://codeforces.com/api/user.status?handle={username}&from=1&count=1000'
-            submission_list = rs.get(url=url, headers=_http_headers).json()
+            submission_list = rs.get(url=url, headers=_http_headers, timeout=_http_timeout).json()
             submission_list = submission_list['result']
 
             solved_problems = []
@@ -123,7 +174,7 @@ class CodeforcesScrapper:
         try:
             rs = requests.session()
             url = self.rating_history_url + username
-            rating_history = rs.get(url=url, headers=_http_headers).json()
+            rating_history = rs.get(url=url, headers=_http_headers, timeout=_http_timeout).json()
             return rating_history['result']
         except Exception as e:
             return []
@@ -1,64 +1,153 @@
-from bs4 import BeautifulSoup
+import time
 import json
+import queue
+import threading
+from contextlib import contextmanager
+from urllib.parse import urljoin
+
+import requests
+from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.firefox.options import Options
 
-login_url = 'http://www.lightoj.com/login_main.php'
-user_details_url = 'http://www.lightoj.com/volume_userstat.php?user_id='
-
-
-class LightOJScrapper:
-
-    def get_user_info(self, username, credentials):
-        print(f'get_user_info called for: {username}')
+base_url = 'http://www.lightoj.com'
+login_path = '/login_main.php'
+user_details_path = '/volume_userstat.php?user_id='
+
+_http_timeout = 30
+_pool_lock = threading.Lock()
+_session_pool_map = {}
+
+
+def is_login_page(page_source):
+    return page_source.find('myuserid') != -1 and page_source.find('mypassword') != -1
+
+
+# Logged in sessions are shared across users, replaying the login cookie over plain HTTP
+class LightOJSessionPool:
+
+    def __init__(self, credentials, base_url, pool_size, session_max_age):
+        self.credentials = credentials
+        self.base_url = base_url
+        self.session_max_age = session_max_age
+        self.idle_sessions = queue.Queue()
+        self.slots = threading.Semaphore(pool_size)
+
+    def login_with_form(self, session):
+        response = session.get(self.base_url + login_path, timeout=_http_timeout)
+        soup = BeautifulSoup(response.text, 'html.parser')
+        user_field = soup.find('input', {'name': 'myuserid'})
+        form = user_field.find_parent('form') if user_field else None
+        if form is None:
+            return False
+        form_data = {}
+        for field in form.findAll('input'):
+            if field.get('name'):
+                form_data[field['name']] = field.get('value', '')
+        form_data['myuserid'] = self.credentials['username']
+        form_data['mypassword'] = self.credentials['password']
+        session.post(urljoin(response.url, form.get('action') or response.url), data=form_data, timeout=_http_timeout)
+        return self.is_healthy(session)
+
+    def login_with_browser(self, session):
+        # Fallback when the form can not be posted directly; the browser is only kept for the login
+        options = Options()
+        options.headless = True
+        driver = webdriver.Firefox(options=options)
         try:
-            options = Options()
-            options.headless = True
-            driver = webdriver.Firefox(options=options)
-            driver.get(login_url)
-            print('go to login page')
-
+            driver.get(self.base_url + login_path)
             elem = driver.find_element_by_name("myuserid")
             elem.clear()
-            elem.send_keys(credentials['username'])
-
+            elem.send_keys(self.credentials['username'])
             elem = driver.find_element_by_name("mypassword")
             elem.clear()
-            elem.send_keys(credentials['password'])
-
+            elem.send_keys(self.credentials['password'])
             elem.send_keys(Keys.ENTER)
-            print('login completed')
-
-            url = user_details_url + username
+            for cookie in driver.get_cookies():
+                session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+        finally:
+            driver.quit()
+        return self.is_healthy(session)
 
-            driver.get(url)
-            page_source = driver.page_source
-            print('received problem statistics for user')
-            soup = BeautifulSoup(page_source, 'html.parser')
+    def is_healthy(self, session):
+        response = session.get(self.base_url + user_details_path + self.credentials['username'], timeout=_http_timeout)
+        return response.status_code == 200 and not is_login_page(response.text)
 
-            tables = soup.findAll("table")
+    def create_session(self):
+        session = requests.Session()
+        if not self.login_with_form(session) and not self.login_with_browser(session):
+            raise Exception('Could not log in to lightoj')
+        return {'session': session, 'logged_in_at': time.time()}
 
-            count = 0
-            problem_list_table = None
+    @contextmanager
+    def session(self):
+        self.slots.acquire()
+        try:
+            try:
+                entry = self.idle_sessions.get_nowait()
+            except queue.Empty:
+                entry = None
+            if entry is None or time.time() - entry['logged_in_at'] > self.session_max_age:
+                entry = self.create_session()
+            yield entry
+            # A session that raised is dropped rather than handed to the next user
+            self.idle_sessions.put(entry)
+        finally:
+            self.slots.release()
+
+    def get_page(self, path):
+        for attempt in range(2):
+            with self.session() as entry:
+                page_source = entry['session'].get(self.base_url + path, timeout=_http_timeout).text
+                if not is_login_page(page_source):
+                    return page_source
+                # The cookie expired on the server side, the next checkout logs in again
+                entry['logged_in_at'] = 0
+        raise Exception('lightoj session is not logged in')
 
-            for table in tables:
-                table_data = str(table)
-                if table_data.find("Solved List") != -1:
-                    problem_list_table = table
-                    break
 
-            problems = []
+class LightOJScrapper:
 
-            for link in problem_list_table.findAll('a'):
-                problem_href = str(link['href'])
-                mlist = problem_href.split('=')
-                problem = mlist[len(mlist) - 1]
-                if problem is not None:
-                    problems.append(problem)
+    def __init__(self, base_url=base_url, pool_size=2, session_max_age=1800):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.session_max_age = session_max_age
+
+    def get_session_pool(self, credentials):
+        key = (self.base_url, credentials['username'])
+        with _pool_lock:
+            if key not in _session_pool_map:
+                _session_pool_map[key] = LightOJSessionPool(credentials, self.base_url, self.pool_size, self.session_max_age)
+            return _session_pool_map[key]
+
+    def get_solved_problem_list(self, username, credentials):
+        page_source = self.get_session_pool(credentials).get_page(user_details_path + username)
+        soup = BeautifulSoup(page_source, 'html.parser')
+
+        tables = soup.findAll("table")
+        problem_list_table = None
+
+        for table in tables:
+            table_data = str(table)
+            if table_data.find("Solved List") != -1:
+                problem_list_table = table
+                break
+
+        problems = []
+        for link in problem_list_table.findAll('a'):
+            problem_href = str(link['href'])
+            mlist = problem_href.split('=')
+            problem = mlist[len(mlist) - 1]
+            if problem is not None:
+                problems.append(problem)
+        return problems
 
+    def get_user_info(self, username, credentials):
+        print(f'get_user_info called for: {username}')
+        try:
+            problems = self.get_solved_problem_list(username, credentials)
             print(f'solved problem list: {json.dumps(problems)}')
-            driver.quit()
 
             return {
                 'platform': 'lightoj',
@@ -67,7 +156,7 @@ class LightOJScrapper:
                 'solved_problems': problems
             }
         except Exception as e:
-            print(f'Exception occurred, could not manage to get user statistics from lightoj')
+            print('Exception occurred, could not manage to get user statistics from lightoj')
             print(f'Exception: {str(e)}')
             data = {
                 'platform': 'lightoj',
@@ -81,60 +170,20 @@ class LightOJScrapper:
     def get_user_info_heavy(self, username, credentials):
         print(f'get_user_info called for: {username}')
         try:
-            options = Options()
-            options.headless = True
-            driver = webdriver.Firefox(options=options)
-            driver.get(login_url)
-            print('go to login page')
-
-            elem = driver.find_element_by_name("myuserid")
-            elem.clear()
-            elem.send_keys(credentials['username'])
-
-            elem = driver.find_element_by_name("mypassword")
-            elem.clear()
-            elem.send_keys(credentials['password'])
-
-            elem.send_keys(Keys.ENTER)
-            print('login completed')
-
-            url = user_details_url + username
-
-            driver.get(url)
-            page_source = driver.page_source
-            print('received problem statistics for user')
-            soup = BeautifulSoup(page_source, 'html.parser')
-
-            tables = soup.findAll("table")
-
-            count = 0
-            problem_list_table = None
-
-            for table in tables:
-                table_data = str(table)
-                if table_data.find("Solved List") != -1:
-                    problem_list_table = table
-                    break
-
             solved_problems = {}
 
-            for link in problem_list_table.findAll('a'):
-                problem_href = str(link['href'])
-                mlist = problem_href.split('=')
-                problem = mlist[len(mlist) - 1]
-                if problem is not None:
-                    problem_data = {
-                        'problem_id': problem,
-                        'submission_list': [
-                            {
-                                'submission_link': f'http://lightoj.com/volume_submissions.php'
-                            }
-                        ]
-                    }
-                    solved_problems[problem] = problem_data
+            for problem in self.get_solved_problem_list(username, credentials):
+                problem_data = {
+                    'problem_id': problem,
+                    'submission_list': [
+                        {
+                            'submission_link': 'http://lightoj.com/volume_submissions.php'
+                        }
+                    ]
+                }
+                solved_problems[problem] = problem_data
 
             print(f'solved problem list: {json.dumps(solved_problems)}')
-            driver.quit()
 
             return {
                 'platform': 'lightoj',
@@ -143,7 +192,7 @@ class LightOJScrapper:
                 'solved_problems': solved_problems
             }
         except Exception as e:
-            print(f'Exception occurred, could not manage to get user statistics from lightoj')
+            print('Exception occurred, could not manage to get user statistics from lightoj')
             print(f'Exception: {str(e)}')
             data = {
                 'platform': 'lightoj',
@@ -5,6 +5,7 @@ from bs4 import BeautifulSoup
 import re
 
 _http_headers = {'Content-Type': 'application/json'}
+_http_timeout = 30
 
 
 class SpojScrapper:
@@ -13,7 +14,7 @@ class SpojScrapper:
         try:
             rs = requests.session()
             url = f'http://www.spoj.com/users/{username}'
-            profile_page = rs.get(url=url, headers=_http_headers)
+            profile_page = rs.get(url=url, headers=_http_headers, timeout=_http_timeout)
             soup = BeautifulSoup(profile_page.text, 'html.parser')
 
             problems = []
@@ -42,7 +43,7 @@ class SpojScrapper:
         try:
             rs = requests.session()
             url = f'http://www.spoj.com/users/{username}'
-            profile_page = rs.get(url=url, headers=_http_headers)
+            profile_page = rs.get(url=url, headers=_http_headers, timeout=_http_timeout)
             soup = BeautifulSoup(profile_page.text, 'html.parser')
 
             solved_problems = {}
@@ -82,7 +83,7 @@ class SpojScrapper:
         solved_problems = []
         while start < 1000:
             url = f'https://www.spoj.com/status/{username}/all/start={start}'
-            submission_page = rs.get(url=url, headers=_http_headers)
+            submission_page = rs.get(url=url, headers=_http_headers, timeout=_http_timeout)
             soup = BeautifulSoup(submission_page.text, 'html.parser')
             table = soup.find("table",{"class":"newstatus"})
             for row in table.find_all("tr")[1:]:  # skipping header row
@@ -1,44 +1,112 @@
+import os
 import time
 import json
+import tempfile
+import threading
 import requests
 from bs4 import BeautifulSoup
 import re
 
 _http_headers = {'Content-Type': 'application/json'}
+_http_timeout = 30
+
+# uHunt verdicts 0 and 20 are submissions still waiting in the judge queue
+_pending_verdicts = [0, 20]
+
+_problem_map_lock = threading.Lock()
+_problem_map_state = {
+    'problem_number_list': None,
+    'fetched_at': 0,
+}
 
 
 class UvaScrapper:
 
-    def problem_id_name_map(self):
+    problem_list_url = 'https://uhunt.onlinejudge.org/api/p'
+    problem_map_cache_path = os.path.join(tempfile.gettempdir(), 'codeflares_uva_problem_map.json')
+    problem_map_refresh_interval = 86400
+    problem_map_retry_interval = 600
+
+    def download_problem_number_list(self):
+        rs = requests.session()
+        data = rs.get(url=self.problem_list_url, headers=_http_headers, timeout=_http_timeout).json()
+        # Indexed by uHunt problem id, holding the problem number; ids with no problem stay None
+        problem_number_list = [None] * (max(problem[0] for problem in data) + 1)
+        for problem in data:
+            problem_number_list[problem[0]] = problem[1]
+        return problem_number_list
+
+    def read_problem_map_cache(self):
         try:
-            rs = requests.session()
-            url = f'https://uhunt.onlinejudge.org/api/p'
-            data = rs.get(url=url, headers=_http_headers).json()
-            map = {}
-            for problem in data:
-                map[problem[0]] = problem[1]
-            return map
-        except Exception as e:
-            raise e
+            with open(self.problem_map_cache_path) as cache_file:
+                cache = json.load(cache_file)
+            return cache['problem_number_list'], cache['fetched_at']
+        except (OSError, ValueError, KeyError):
+            return None, 0
+
+    def write_problem_map_cache(self, problem_number_list, fetched_at):
+        try:
+            tmp_path = f'{self.problem_map_cache_path}.{os.getpid()}'
+            with open(tmp_path, 'w') as cache_file:
+                json.dump({'fetched_at': fetched_at, 'problem_number_list': problem_number_list}, cache_file, separators=(',', ':'))
+            os.replace(tmp_path, self.problem_map_cache_path)
+        except OSError as e:
+            print(f'Could not write uva problem map cache: {e}')
+
+    def get_problem_number_list(self, force_refresh=False):
+        with _problem_map_lock:
+            if _problem_map_state['problem_number_list'] is None:
+                problem_number_list, fetched_at = self.read_problem_map_cache()
+                _problem_map_state['problem_number_list'] = problem_number_list
+                _problem_map_state['fetched_at'] = fetched_at
+            age = int(time.time()) - _problem_map_state['fetched_at']
+            if _problem_map_state['problem_number_list'] is None or age > self.problem_map_refresh_interval or \
+                    (force_refresh and age > self.problem_map_retry_interval):
+                try:
+                    problem_number_list = self.download_problem_number_list()
+                    fetched_at = int(time.time())
+                    self.write_problem_map_cache(problem_number_list, fetched_at)
+                    _problem_map_state['problem_number_list'] = problem_number_list
+                    _problem_map_state['fetched_at'] = fetched_at
+                except Exception as e:
+                    # An old map is still good for every problem it knows about
+                    if _problem_map_state['problem_number_list'] is None:
+                        raise e
+                    print(f'Could not refresh uva problem map: {e}')
+            return _problem_map_state['problem_number_list']
+
+    def get_problem_number(self, problem_id):
+        problem_number_list = self.get_problem_number_list()
+        if problem_id >= len(problem_number_list) or problem_number_list[problem_id] is None:
+            # Problems added after the map was taken show up as unknown ids
+            problem_number_list = self.get_problem_number_list(force_refresh=True)
+        if problem_id < len(problem_number_list):
+            return problem_number_list[problem_id]
+        return None
+
+    def get_user_id(self, username, rs):
+        url = f'https://uhunt.onlinejudge.org/api/uname2uid/{username}'
+        return rs.get(url=url, headers=_http_headers, timeout=_http_timeout).json()
+
+    def get_submission_list(self, userid, rs, watermark=None):
+        profile_url = f'https://uhunt.onlinejudge.org/api/subs-user/{userid}'
+        if watermark:
+            # uHunt returns only the submissions after the given submission id
+            profile_url = f'{profile_url}/{watermark["submission_id"]}'
+        return rs.get(url=profile_url, headers=_http_headers, timeout=_http_timeout).json()['subs']
 
     def get_user_info(self, username):
         try:
             rs = requests.session()
-            url = f'https://uhunt.onlinejudge.org/api/uname2uid/{username}'
-            userid = rs.get(url=url, headers=_http_headers).json()
-
-            profile_url = f'https://uhunt.onlinejudge.org/api/subs-user/{userid}'
-            problem_map = self.problem_id_name_map()
-
-            profile_data = rs.get(url=profile_url, headers=_http_headers).json()
+            userid = self.get_user_id(username, rs)
 
             problems = []
 
-            all_submissions = profile_data['subs']
+            all_submissions = self.get_submission_list(userid, rs)
             for sub in all_submissions:
-                problem_id = problem_map[sub[1]]
+                problem_id = self.get_problem_number(sub[1])
                 verdict = sub[2]
-                if verdict == 90:
+                if verdict == 90 and problem_id is not None:
                     if problem_id not in problems:
                         problems.append(problem_id)
 
@@ -56,50 +124,59 @@ class UvaScrapper:
                 'solved_problems': []
             }
 
-    def get_user_info_heavy(self, username):
-        try:
-            rs = requests.session()
-            url = f'https://uhunt.onlinejudge.org/api/uname2uid/{username}'
-            userid = rs.get(url=url, headers=_http_headers).json()
-
-            profile_url = f'https://uhunt.onlinejudge.org/api/subs-user/{userid}'
-            problem_map = self.problem_id_name_map()
-
-            profile_data = rs.get(url=profile_url, headers=_http_headers).json()
-
-            solved_problems = {}
-
-            all_submissions = profile_data['subs']
-            for sub in all_submissions:
-                problem_id = problem_map[sub[1]]
-                verdict = sub[2]
-                submission_time = sub[4]
-                if verdict == 90:
-                    if problem_id not in solved_problems:
-                        problem_data = {
-                            'problem_id': problem_id,
-                            'submission_list': [
-                                {
-                                    'submission_link': f'https://uhunt.onlinejudge.org/id/{userid}',
-                                    'submission_time': submission_time
-                                }
-                            ]
-                        }
-                        solved_problems[problem_id] = problem_data
-
-            return {
-                'platform': 'uva',
-                'user_name': username,
-                'solved_count': len(solved_problems),
-                'solved_problems': solved_problems
-            }
-        except Exception as e:
-            return {
-                'platform': 'uva',
-                'user_name': username,
-                'solved_count': 0,
-                'solved_problems': {}
-            }
+    def get_user_info_heavy(self, username, watermark=None):
+        rs = requests.session()
+        userid = self.get_user_id(username, rs)
+
+        solved_problems = {}
+        full_scan_at = watermark.get('full_scan_at', None) if watermark else int(time.time())
+        # The watermark only moves over final verdicts of problems that resolved to a number, and stops
+        # before the oldest submission that has to be looked at again on the next sync
+        blocked_submission_id = None
+        final_submission_list = []
+
+        all_submissions = self.get_submission_list(userid, rs, watermark)
+        for sub in all_submissions:
+            problem_id = self.get_problem_number(sub[1])
+            verdict = sub[2]
+            submission_time = sub[4]
+            if verdict in _pending_verdicts or problem_id is None:
+                if blocked_submission_id is None or sub[0] < blocked_submission_id:
+                    blocked_submission_id = sub[0]
+                continue
+            final_submission_list.append(sub)
+            if verdict == 90 and problem_id is not None:
+                if problem_id not in solved_problems:
+                    problem_data = {
+                        'problem_id': problem_id,
+                        'submission_list': [
+                            {
+                                'submission_link': f'https://uhunt.onlinejudge.org/id/{userid}',
+                                'submission_time': submission_time
+                            }
+                        ]
+                    }
+                    solved_problems[problem_id] = problem_data
+
+        new_watermark = watermark
+        for sub in final_submission_list:
+            if blocked_submission_id is not None and sub[0] > blocked_submission_id:
+                continue
+            if new_watermark is None or sub[0] > new_watermark['submission_id']:
+                new_watermark = {
+                    'handle': username,
+                    'submission_id': sub[0],
+                    'submission_time': sub[4],
+                    'full_scan_at': full_scan_at
+                }
+
+        return {
+            'platform': 'uva',
+            'user_name': username,
+            'solved_count': len(solved_problems),
+            'solved_problems': solved_problems,
+            'watermark': new_watermark
+        }
 
 
 if __name__ == '__main__':
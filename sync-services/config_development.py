@@ -1,9 +1,34 @@
 class ConfigDevelopment:
     SERVER_HOST = 'http://localhost:5056/api'
     ES_HOST = 'localhost:9200'
+    ES_POOL_SIZE = 10
+    ES_CONNECT_TIMEOUT = 3
+    ES_READ_TIMEOUT = 60
+    ES_MAX_RETRIES = 3
+    ES_RETRY_BACKOFF = 0.2
+    ES_BULK_SIZE = 500
+    ES_PAGE_SIZE = 1000
     REDIS_HOST = '127.0.0.1'
     REDIS_PORT = '6379'
     REDIS_PREFIX_USER_JOB = 'codeflares:user:job'
     REDIS_PREFIX_USER_PENDING_JOB = 'codeflares:user:job:pending'
     REDIS_PREFIX_USER_JOB_LIMIT = 3
     REDIS_PREFIX_USER_JOB_TIMEOUT = 1440
+    REDIS_PREFIX_SYNC_QUEUE = 'codeflares:sync:queue'
+    REDIS_PREFIX_CATEGORY_CATALOGUE = 'codeflares:category:catalogue'
+    REDIS_PREFIX_USER_CARD = 'codeflares:user:card'
+    REDIS_PREFIX_LEADERBOARD = 'codeflares:leaderboard'
+    REDIS_PREFIX_CATEGORY_LEADERBOARD = 'codeflares:leaderboard:category'
+    CATEGORY_CATALOGUE_TTL = 3600
+    CATEGORY_CATALOGUE_RETRY_INTERVAL = 5
+    JUDGE_FETCH_TIMEOUT = 300
+    JUDGE_FETCH_MAX_IN_FLIGHT = 10
+    JUDGE_FULL_SCAN_INTERVAL = 604800
+    SYNC_WORKER_COUNT = 1
+    SYNC_JOB_POLL_INTERVAL = 5
+    SYNC_JOB_MAX_ATTEMPTS = 3
+    SYNC_JOB_COALESCE_TTL = 21600
+    SYNC_BULK_JOB_SHARE = 4
+    SYNC_PROGRESS_TTL = 604800
+    SYNC_JOB_TIMEOUT = 3600
+    SYNC_WORKER_SHUTDOWN_TIMEOUT = 60
@@ -2,6 +2,8 @@ import argparse
 import json
 import math
 
+import numpy as np
+
 from .skillset import Skill
 
 eps = 0.0000001
@@ -9,7 +11,14 @@ eps = 0.0000001
 
 class ProblemScoreGenerator:
 
-    def calculate(self, problem_diff, category_level):
+    def __init__(self):
+        self.skill = Skill()
+        self.level_dx_cache = {}
+        self.level_score_cache = {}
+
+    def get_level_dx(self, category_level):
+        if category_level in self.level_dx_cache:
+            return self.level_dx_cache[category_level]
         up = category_level + 1
         down = category_level - 0.5
         level_dx = []
@@ -29,14 +38,33 @@ class ProblemScoreGenerator:
         if down > 0.0:
             level_dx.append([0, down-eps])
 
+        self.level_dx_cache[category_level] = level_dx
+        return level_dx
+
+    def get_level_score_table(self, category_level):
+        # Interval bounds and score ranges for one category level as arrays, in matching order
+        if category_level in self.level_score_cache:
+            return self.level_score_cache[category_level]
+        level_dx = self.get_level_dx(category_level)
+        level_start = np.array([level[0] for level in level_dx], dtype=np.float64)
+        level_end = np.array([level[1] for level in level_dx], dtype=np.float64)
+        score_range = [self.skill.get_problem_relevent_score_from_level(idx) for idx in range(len(level_dx))]
+        score_start = np.array([score[0] for score in score_range], dtype=np.float64)
+        score_end = np.array([score[1] for score in score_range], dtype=np.float64)
+        table = (level_start, level_end, score_start, score_end)
+        self.level_score_cache[category_level] = table
+        return table
+
+    def calculate(self, problem_diff, category_level):
+        level_dx = self.get_level_dx(category_level)
+
         level_idx = 0
         for idx, level in enumerate(level_dx):
             if problem_diff >= level[0] and problem_diff <= level[1]:
                 level_idx = idx
                 break
 
-        skill = Skill()
-        score_range = skill.get_problem_relevent_score_from_level(level_idx)
+        score_range = self.skill.get_problem_relevent_score_from_level(level_idx)
         score_dif = score_range[1] - score_range[0]
         level_range_val = level_dx[level_idx][1] - level_dx[level_idx][0]
         if problem_diff > category_level:
@@ -54,6 +82,19 @@ class ProblemScoreGenerator:
             score = max(score, 0)
             return score
 
+    def calculate_list(self, problem_diff_array, category_level):
+        level_start, level_end, score_start, score_end = self.get_level_score_table(category_level)
+        inside = (problem_diff_array[:, None] >= level_start[None, :]) & (problem_diff_array[:, None] <= level_end[None, :])
+        # argmax picks the first matching interval, and 0 when nothing matches, like calculate does
+        level_idx = np.argmax(inside, axis=1)
+        start = level_start[level_idx]
+        end = level_end[level_idx]
+        score_dif = score_end[level_idx] - score_start[level_idx]
+        level_range_val = end - start
+        dx_end = np.where(problem_diff_array > category_level, end - problem_diff_array, problem_diff_array - start)
+        score = score_start[level_idx] + score_dif * dx_end / level_range_val
+        return np.maximum(np.minimum(score, 100), 0)
+
     def generate_score(self, problem_diff, category_level_list, user_skill_level):
         category_len = len(category_level_list)
         if category_len == 0:
@@ -65,3 +106,35 @@ class ProblemScoreGenerator:
             score_sum += cur_score
         score = score_sum/category_len
         return {'score': score}
+
+    def generate_score_list(self, problem_diff_list, category_level_lists, user_skill_level):
+        problem_count = len(problem_diff_list)
+        if problem_count == 0:
+            return []
+        problem_diff_array = np.array(problem_diff_list, dtype=np.float64)
+        category_len = np.array([len(level_list) for level_list in category_level_lists], dtype=np.int64)
+        max_category_len = int(category_len.max())
+
+        # One vectorized pass per distinct category level over every problem
+        level_pos = {}
+        level_score_list = []
+        level_pos_matrix = np.zeros((problem_count, max(max_category_len, 1)), dtype=np.int64)
+        for row, level_list in enumerate(category_level_lists):
+            for column, category_level in enumerate(level_list):
+                if category_level not in level_pos:
+                    level_pos[category_level] = len(level_score_list)
+                    level_score_list.append(self.calculate_list(problem_diff_array, category_level))
+                level_pos_matrix[row, column] = level_pos[category_level]
+
+        # Columns are added left to right so the sums match generate_score bit for bit
+        score_sum = np.zeros(problem_count, dtype=np.float64)
+        if len(level_score_list) > 0:
+            level_score = np.vstack(level_score_list)
+            row_idx = np.arange(problem_count)
+            for column in range(max_category_len):
+                column_score = level_score[level_pos_matrix[:, column], row_idx]
+                score_sum = np.where(category_len > column, score_sum + column_score, score_sum)
+
+        default_score = (10.0 - user_skill_level)*100.0/10.0
+        score = np.where(category_len > 0, score_sum / np.maximum(category_len, 1), default_score)
+        return [{'score': float(value)} for value in score]
@@ -5,21 +5,74 @@ from bs4 import BeautifulSoup
 import re
 
 _http_headers = {'Content-Type': 'application/json'}
+_http_timeout = 30
+
+# A submission without a verdict, still in the queue or only through pretests can still turn into a solve
+_pending_verdicts = ['SUBMITTED', 'TESTING']
+
+
+def is_final_verdict(submission):
+    verdict = submission.get('verdict', None)
+    if verdict is None or verdict in _pending_verdicts:
+        return False
+    return not (verdict == 'OK' and submission.get('testset', None) == 'PRETESTS')
+
+
+def generate_watermark(username, submission, full_scan_at):
+    return {
+        'handle': username,
+        'submission_id': submission['id'],
+        'submission_time': int(submission['creationTimeSeconds']),
+        'full_scan_at': full_scan_at
+    }
 
 
 class CodeforcesScrapper:
 
     rating_history_url = 'https://codeforces.com/api/user.rating?handle='
+    submission_url = 'https://codeforces.com/api/user.status'
+    submission_page_size = 1000
 
-    def get_user_info_heavy(self, username):
-        try:
-            rs = requests.session()
-            url = f'http://codeforces.com/api/user.status?handle={username}&from=1&count=1000000'
-            submission_list = rs.get(url=url, headers=_http_headers).json()
-            submission_list = submission_list['result']
-            cf_solved_problems = {}
+    def get_submission_pages(self, username, rs):
+        # Codeforces lists submissions newest first, so pages are walked from the top down
+        start = 1
+        while True:
+            url = f'{self.submission_url}?handle={username}&from={start}&count={self.submission_page_size}'
+            response = rs.get(url=url, headers=_http_headers, timeout=_http_timeout).json()
+            if response.get('status', None) != 'OK':
+                raise Exception(f'Codeforces user.status failed: {response.get("comment", response)}')
+            submission_list = response['result']
+            if len(submission_list) > 0:
+                yield submission_list
+            if len(submission_list) < self.submission_page_size:
+                break
+            start += self.submission_page_size
 
+    def get_user_info_incremental(self, username, watermark=None):
+        rs = requests.session()
+        cf_solved_problems = {}
+        seen_submission_set = set()
+        last_submission_id = watermark['submission_id'] if watermark else 0
+        full_scan_at = watermark.get('full_scan_at', None) if watermark else int(time.time())
+        # The watermark stops at the newest final verdict older than every pending one, so a pending
+        # submission is fetched again on the next sync
+        new_watermark = watermark
+        candidate = None
+        reached_watermark = False
+
+        for submission_list in self.get_submission_pages(username, rs):
             for submission in submission_list:
+                if submission['id'] <= last_submission_id:
+                    reached_watermark = True
+                    break
+                if submission['id'] in seen_submission_set:
+                    continue
+                seen_submission_set.add(submission['id'])
+                if not is_final_verdict(submission):
+                    candidate = None
+                    continue
+                if candidate is None:
+                    candidate = submission
                 try:
                     if 'verdict' not in submission or 'testset' not in submission:
                         continue
@@ -39,9 +92,21 @@ class CodeforcesScrapper:
                         }
                         cf_solved_problems[problem]['submission_list'].append(sublink)
                 except Exception as e:
-                    print(f'Exception occurred while parsing uva data for user: {username}, submission: {submission}, exception: {e}')
+                    print(f'Exception occurred while parsing codeforces data for user: {username}, submission: {submission}, exception: {e}')
                     continue
-            return cf_solved_problems
+            if reached_watermark:
+                break
+        if candidate is not None:
+            new_watermark = generate_watermark(username, candidate, full_scan_at)
+
+        return {
+            'solved_problems': cf_solved_problems,
+            'watermark': new_watermark
+        }
+
+    def get_user_info_heavy(self, username):
+        try:
+            return self.get_user_info_incremental(username)['solved_problems']
         except Exception as e:
             print(f'Error occurred: {e}')
             return {}
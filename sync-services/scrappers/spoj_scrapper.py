@@ -5,6 +5,7 @@ from bs4 import BeautifulSoup
 import re
 
 _http_headers = {'Content-Type': 'application/json'}
+_http_timeout = 30
 
 
 class SpojScrapper:
@@ -13,7 +14,7 @@ class SpojScrapper:
         try:
             rs = requests.session()
             url = f'http://www.spoj.com/users/{username}'
-            profile_page = rs.get(url=url, headers=_http_headers)
+            profile_page = rs.get(url=url, headers=_http_headers, timeout=_http_timeout)
             soup = BeautifulSoup(profile_page.text, 'html.parser')
             solved_problems = {}
             contentTable = soup.find('table', {"class": "table-condensed"})
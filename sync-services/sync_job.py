@@ -6,14 +6,20 @@ import json
 import unittest
 import requests
 import math
+import copy
+import signal
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import timedelta
 from logging.handlers import TimedRotatingFileHandler
 
-from apscheduler.schedulers.background import BackgroundScheduler
 from redis import Redis
 
 from config_development import ConfigDevelopment
 from config_production import ConfigProduction
+from es_client import ElasticsearchClient
 
 from scrappers.codechef_scrapper import CodechefScrapper
 from scrappers.loj_scrapper import LightOJScrapper
@@ -24,6 +30,7 @@ from models.category_score_model import CategoryScoreGenerator
 from models.category_skill_model import CategorySkillGenerator
 from models.problem_score_model import ProblemScoreGenerator
 from models.skillset import Skill
+from models.category_dag import CategoryDependencyGraph
 
 environ = os.getenv('SCRIPT_ENV', 'dev')
 global config
@@ -46,6 +53,7 @@ handler.extMatch = re.compile(r"^\d{8}$")
 logger.addHandler(handler)
 
 redis_client = Redis(config.REDIS_HOST, config.REDIS_PORT, db=0, decode_responses=True)
+es_client = ElasticsearchClient(config)
 
 rs = requests.session()
 _http_headers = {'Content-Type': 'application/json'}
@@ -57,8 +65,6 @@ ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD')
 access_token = None
 login_api = f'{config.SERVER_HOST}/auth/login'
 team_training_model_sync_api = f'{config.SERVER_HOST}/team/sync/training-model/'
-job_search_url = f'{config.SERVER_HOST}/job/search'
-job_url = f'{config.SERVER_HOST}/job/'
 
 
 _es_index_user = 'cfs_users'
@@ -70,11 +76,19 @@ _es_index_category_dependency = 'cfs_category_dependencies'
 _es_user_user_notification = 'cfs_notifications'
 _es_index_user_team_edge = 'cfs_user_team_edges'
 _es_index_team = 'cfs_teams'
+_es_index_problem_counter = 'cfs_problem_counters'
+_es_index_jobs = 'cfs_sync_jobs'
 _es_type = '_doc'
+_watermarked_judges = ['codeforces', 'uva']
 _es_size = 10000
+_es_catalogue_size = 10000
+_es_page_size = 1000
+
+_available_problem_source = ['problem_difficulty', 'problem_type', 'categories']
 
-_es_max_solved_problem = 10000
 _bucket_size = 100
+_fan_out_chunk_size = 500
+_es_retry_on_conflict = 5
 
 SOLVED = 'SOLVED'
 UNSOLVED = 'UNSOLVED'
@@ -83,6 +97,8 @@ FLAGGED = 'FLAGGED'
 approved = 'approved'
 READ = 'READ'
 UNREAD = 'UNREAD'
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
 
 uva = UvaScrapper()
 codeforces = CodeforcesScrapper()
@@ -157,7 +173,6 @@ def add_new_job(user_id):
 
 def get_access_token():
     try:
-        global rs
         login_data = {
             "username": ADMIN_USER,
             "password": ADMIN_PASSWORD
@@ -170,7 +185,6 @@ def get_access_token():
 
 def get_header():
     try:
-        global rs
         global access_token
         if access_token is None:
             access_token = get_access_token()
@@ -192,12 +206,10 @@ def get_header():
 
 def add_notification(data):
     try:
-        global rs
         data['created_at'] = int(time.time())
         data['updated_at'] = int(time.time())
         data['status'] = UNREAD
-        post_url = 'http://{}/{}/{}'.format(config.ES_HOST, _es_user_user_notification, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
+        response = es_client.index(_es_user_user_notification, data)
         if 'result' in response and response['result'] == 'created':
             return response['_id'], 201
         logger.error('Elasticsearch down, response: ' + str(response))
@@ -217,7 +229,6 @@ def add_notification(data):
 
 def search_user_ids(param, from_val, size_val):
     try:
-        global rs
         must = []
         text_fields = ['username', 'email', 'mobile']
         keyword_fields = ['user_role']
@@ -237,8 +248,7 @@ def search_user_ids(param, from_val, size_val):
         query_json['_source'] = False
         query_json['from'] = from_val
         query_json['size'] = size_val
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_client.search(_es_index_user, query_json)
 
         if 'hits' in response:
             data = []
@@ -253,10 +263,8 @@ def search_user_ids(param, from_val, size_val):
 
 def get_user_details_by_handle_name(username):
     try:
-        global rs
         query_json = {'query': {'bool': {'must': [{'match': {'username': username}}]}}}
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_client.search(_es_index_user, query_json)
         if 'hits' in response:
             for hit in response['hits']['hits']:
                 data = hit['_source']
@@ -269,9 +277,7 @@ def get_user_details_by_handle_name(username):
 
 def get_user_details(user_id):
     try:
-        global rs
-        search_url = 'http://{}/{}/{}/{}'.format(config.ES_HOST, _es_index_user, _es_type, user_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_client.get(_es_index_user, user_id)
         if 'found' in response:
             if response['found']:
                 data = response['_source']
@@ -284,17 +290,14 @@ def get_user_details(user_id):
 
 def get_solved_problem_count_for_user(user_id):
     try:
-        global rs
         must = [
             {'term': {'user_id': user_id}},
             {'term': {'status': SOLVED}}
         ]
         query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = 1
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_problem_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        if 'hits' in response:
-            return response['hits']['total']['value']
+        response = es_client.count(_es_index_problem_user, query_json)
+        if 'count' in response:
+            return response['count']
         return 0
     except Exception as e:
         raise e
@@ -302,15 +305,13 @@ def get_solved_problem_count_for_user(user_id):
 
 def generate_skill_value_for_user(user_id):
     try:
-        global rs
         must = [
             {'term': {'category_root': 'root'}},
             {'term': {'user_id': user_id}},
         ]
         query_json = {'query': {'bool': {'must': must}}}
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_user_category, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_client.search(_es_index_user_category, query_json)
         if 'hits' not in response:
             raise Exception('Internal server error')
         skill_value = 0
@@ -340,20 +341,38 @@ def sync_overall_stat_for_user(user_id, skill_value = None):
         raise e
 
 
+def update_user_leaderboards(user_id, user):
+    try:
+        scores = {
+            'skill': float(user.get('skill_value', 0) or 0) - float(user.get('decreased_skill_value', 0) or 0),
+            'solve_count': int(user.get('solve_count', 0) or 0),
+            'contribution': int(user.get('contribution', 0) or 0),
+        }
+        pipe = redis_client.pipeline()
+        for board, score in scores.items():
+            pipe.zadd(f'{config.REDIS_PREFIX_LEADERBOARD}:{board}', {user_id: score})
+        pipe.execute()
+    except Exception as e:
+        raise e
+
+
 def update_user_details(user_id, user_data):
     try:
-        global rs
         ignore_fields = ['username', 'password']
-        search_url = 'http://{}/{}/{}/{}'.format(config.ES_HOST, _es_index_user, _es_type, user_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_client.get(_es_index_user, user_id)
         if 'found' in response:
             if response['found']:
                 user = response['_source']
+                changes = {}
                 for key in user_data:
                     if key not in ignore_fields:
-                        user[key] = user_data[key]
-                response = rs.put(url=search_url, json=user, headers=_http_headers).json()
+                        changes[key] = user_data[key]
+                user.update(changes)
+                # A partial update leaves the follow counters written by the API untouched
+                response = es_client.update(_es_index_user, user_id, changes)
                 if 'result' in response:
+                    redis_client.delete(f'{config.REDIS_PREFIX_USER_CARD}:{user_id}')
+                    update_user_leaderboards(user_id, user)
                     return response['result']
         logger.error('Elasticsearch down')
         return response
@@ -368,15 +387,109 @@ def update_user_details(user_id, user_data):
 ######################### CATEGORY SERVICES #########################
 
 
+category_catalogue_lock = threading.Lock()
+category_catalogue_state = {
+    'catalogue': None,
+    'stale': True,
+    'subscriber': None,
+}
+
+
+def listen_category_catalogue_updates(channel):
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+            category_catalogue_state['stale'] = True
+            for message in pubsub.listen():
+                catalogue = category_catalogue_state['catalogue']
+                if catalogue is None or str(message['data']) != str(catalogue['version']):
+                    category_catalogue_state['stale'] = True
+        except Exception as e:
+            category_catalogue_state['stale'] = True
+            time.sleep(config.CATEGORY_CATALOGUE_RETRY_INTERVAL)
+
+
+def start_category_catalogue_subscriber():
+    subscriber = category_catalogue_state['subscriber']
+    if subscriber is not None and subscriber.is_alive():
+        return
+    channel = f'{config.REDIS_PREFIX_CATEGORY_CATALOGUE}:channel'
+    subscriber = threading.Thread(target=listen_category_catalogue_updates, name='category-catalogue-subscriber',
+                                  args=(channel, ), daemon=True)
+    subscriber.start()
+    category_catalogue_state['subscriber'] = subscriber
+
+
+def load_category_catalogue():
+    logger.info('load_category_catalogue called')
+    try:
+        version = redis_client.get(f'{config.REDIS_PREFIX_CATEGORY_CATALOGUE}:version')
+        catalogue = {
+            'version': int(version) if version else 0,
+            'loaded_at': int(time.time()),
+            'category_by_id': {},
+            'category_id_by_root': {},
+            'dependency_list_by_category': {},
+            'dependent_list_by_category': {},
+        }
+        query_json = {'query': {'match_all': {}}, 'size': _es_catalogue_size}
+        response = es_client.search(_es_index_category, query_json)
+        if 'hits' not in response:
+            logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+        for hit in response['hits']['hits']:
+            category = hit['_source']
+            catalogue['category_by_id'][hit['_id']] = category
+            catalogue['category_id_by_root'].setdefault(category['category_root'], []).append(hit['_id'])
+
+        response = es_client.search(_es_index_category_dependency, query_json)
+        if 'hits' not in response:
+            logger.error('Elasticsearch down, response: ' + str(response))
+            raise Exception('Internal server error')
+        edge_list = []
+        for hit in response['hits']['hits']:
+            edge = hit['_source']
+            catalogue['dependency_list_by_category'].setdefault(edge['category_id_1'], []).append(edge)
+            catalogue['dependent_list_by_category'].setdefault(edge['category_id_2'], []).append(edge)
+            edge_list.append(edge)
+
+        dependency_graph = CategoryDependencyGraph(list(catalogue['category_by_id'].keys()), edge_list)
+        if not dependency_graph.is_acyclic():
+            logger.error(f'Category dependencies do not form a DAG, cyclic categories: {dependency_graph.cyclic_categories}')
+        catalogue['topological_order'] = dependency_graph.get_topological_order()
+        logger.info(f'load_category_catalogue completed for version: {catalogue["version"]}')
+        return catalogue
+    except Exception as e:
+        raise e
+
+
+def get_category_catalogue():
+    start_category_catalogue_subscriber()
+    catalogue = category_catalogue_state['catalogue']
+    if catalogue is None or category_catalogue_state['stale'] or catalogue['loaded_at'] + config.CATEGORY_CATALOGUE_TTL < int(time.time()):
+        with category_catalogue_lock:
+            catalogue = category_catalogue_state['catalogue']
+            if catalogue is None or category_catalogue_state['stale'] or catalogue['loaded_at'] + config.CATEGORY_CATALOGUE_TTL < int(time.time()):
+                category_catalogue_state['stale'] = False
+                try:
+                    catalogue = load_category_catalogue()
+                except Exception as e:
+                    category_catalogue_state['stale'] = True
+                    raise e
+                category_catalogue_state['catalogue'] = catalogue
+    return catalogue
+
+
 
 
 def find_category_dependency_list_for_multiple_categories(category_list):
     try:
+        catalogue = get_category_catalogue()
         dependent_categories = []
         for category in category_list:
-            dep_list = find_category_dependency_list(category)
-            for category_data in dep_list:
-                category_id = category_data['category_id']
+            for edge in catalogue['dependency_list_by_category'].get(category, []):
+                category_id = edge['category_id_2']
                 if category_id not in dependent_categories:
                     dependent_categories.append(category_id)
         return dependent_categories
@@ -384,41 +497,53 @@ def find_category_dependency_list_for_multiple_categories(category_list):
         raise e
 
 
+def generate_user_category_edge_id(user_id, category_id):
+    return f'{user_id}:{category_id}'
+
+
 def get_user_category_data(user_id, category_id):
     try:
-        global rs
-        must = [
-            {'term': {'user_id': user_id}},
-            {'term': {'category_id': category_id}}
-        ]
-        query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = 1
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_user_category, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        if 'hits' in response:
-            if response['hits']['total']['value'] > 1:
-                logger.error(f'Abnormal user category edges: {response}')
-                raise Exception('Abnormal user category edges')
-            for hit in response['hits']['hits']:
-                edge = hit['_source']
-                edge['id'] = hit['_id']
+        response = es_client.get(_es_index_user_category, generate_user_category_edge_id(user_id, category_id))
+        if 'found' in response:
+            if response['found']:
+                edge = response['_source']
+                edge['id'] = response['_id']
                 return edge
-        return None
+            return None
+        logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def get_user_category_data_list(user_id, category_id_list):
+    try:
+        edge_map = {}
+        if len(category_id_list) == 0:
+            return edge_map
+        edge_id_list = [generate_user_category_edge_id(user_id, category_id) for category_id in category_id_list]
+        response = es_client.mget(_es_index_user_category, edge_id_list)
+        if 'docs' in response:
+            for doc in response['docs']:
+                if doc.get('found', False):
+                    edge = doc['_source']
+                    edge['id'] = doc['_id']
+                    edge_map[edge['category_id']] = edge
+            return edge_map
+        logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
     except Exception as e:
         raise e
 
 
 def get_category_details(cat_id):
     try:
-        global rs
-        search_url = 'http://{}/{}/{}/{}'.format(config.ES_HOST, _es_index_category, _es_type, cat_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
-        if 'found' in response:
-            if response['found']:
-                data = response['_source']
-                data['category_id'] = response['_id']
-                data['problem_count'] = 0
-                return data
+        catalogue = get_category_catalogue()
+        if cat_id in catalogue['category_by_id']:
+            data = copy.deepcopy(catalogue['category_by_id'][cat_id])
+            data['category_id'] = cat_id
+            data['problem_count'] = 0
+            return data
         return None
     except Exception as e:
         raise e
@@ -426,25 +551,15 @@ def get_category_details(cat_id):
 
 def find_category_dependency_list(category_id_1):
     try:
-        global rs
-        must = [
-            {'term': {'category_id_1': category_id_1}}
-        ]
-        query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_category_dependency, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        catalogue = get_category_catalogue()
         item_list = []
-        if 'hits' in response:
-            for hit in response['hits']['hits']:
-                category = hit['_source']
-                category.pop('category_id_1', None)
-                category['category_info'] = get_category_details(category['category_id_2'])
-                category['category_id'] = category['category_id_2']
-                category.pop('category_id_2', None)
-                item_list.append(category)
-            return item_list
-        logger.error('Elasticsearch down, response: ' + str(response))
+        for edge in catalogue['dependency_list_by_category'].get(category_id_1, []):
+            category = copy.deepcopy(edge)
+            category.pop('category_id_1', None)
+            category['category_info'] = get_category_details(category['category_id_2'])
+            category['category_id'] = category['category_id_2']
+            category.pop('category_id_2', None)
+            item_list.append(category)
         return item_list
     except Exception as e:
         raise e
@@ -452,55 +567,48 @@ def find_category_dependency_list(category_id_1):
 
 def find_dependent_category_list(category_id_2):
     try:
-        global rs
-        must = [
-            {'term': {'category_id_2': category_id_2}}
-        ]
-        query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_category_dependency, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        catalogue = get_category_catalogue()
         item_list = []
-        if 'hits' in response:
-            for hit in response['hits']['hits']:
-                category = hit['_source']
-                category.pop('category_id_2', None)
-                category['category_info'] = get_category_details(category['category_id_1'])
-                category['category_id'] = category['category_id_1']
-                category.pop('category_id_1', None)
-                item_list.append(category)
-            return item_list
-        logger.error('Elasticsearch down, response: ' + str(response))
+        for edge in catalogue['dependent_list_by_category'].get(category_id_2, []):
+            category = copy.deepcopy(edge)
+            category.pop('category_id_2', None)
+            category['category_info'] = get_category_details(category['category_id_1'])
+            category['category_id'] = category['category_id_1']
+            category.pop('category_id_1', None)
+            item_list.append(category)
         return item_list
     except Exception as e:
         raise e
 
 
-def add_user_category_data(user_id, category_id, data):
+def update_category_leaderboard(category_id, user_id, skill_value):
+    redis_client.zadd(f'{config.REDIS_PREFIX_CATEGORY_LEADERBOARD}:{category_id}', {user_id: float(skill_value or 0)})
+
+
+def add_user_category_data(user_id, category_id, data, writer=None, ranked=False):
+    # Only user edges are ranked; team syncs write their edges here too and leave ranked unset
     try:
-        global rs
         data['user_id'] = user_id
         data['category_id'] = category_id
-        edge = get_user_category_data(user_id, category_id)
-
-        if edge is None:
-            data['created_at'] = int(time.time())
-            data['updated_at'] = int(time.time())
-            url = 'http://{}/{}/{}'.format(config.ES_HOST, _es_index_user_category, _es_type)
-            response = rs.post(url=url, json=data, headers=_http_headers).json()
-            if 'result' in response:
-                return response['_id']
-            raise Exception('Internal server error')
+        data['updated_at'] = int(time.time())
+        data.pop('id', None)
 
-        edge_id = edge['id']
-        edge.pop('id', None)
-        for f in data:
-            edge[f] = data[f]
+        upsert_data = dict(data)
+        upsert_data['created_at'] = data['updated_at']
+        edge_id = generate_user_category_edge_id(user_id, category_id)
+        ranked = ranked and 'skill_value' in data
 
-        edge['updated_at'] = int(time.time())
-        url = 'http://{}/{}/{}/{}'.format(config.ES_HOST, _es_index_user_category, _es_type, edge_id)
-        response = rs.put(url=url, json=edge, headers=_http_headers).json()
+        if writer is not None:
+            writer.upsert(_es_index_user_category, edge_id, data, upsert_data)
+            if ranked:
+                skill_value = data['skill_value']
+                writer.after_flush(lambda: update_category_leaderboard(category_id, user_id, skill_value))
+            return edge_id
+
+        response = es_client.update(_es_index_user_category, edge_id, data, upsert_data=upsert_data)
         if 'result' in response:
+            if ranked:
+                update_category_leaderboard(category_id, user_id, data['skill_value'])
             return response['result']
         raise Exception('Internal server error')
     except Exception as e:
@@ -510,23 +618,24 @@ def add_user_category_data(user_id, category_id, data):
 def clean_user_category_history(user_id):
     try:
         logger.info(f'clean_user_problem_history for: user_id: {user_id}')
-        global rs
         must = [
             {'term': {'user_id': user_id}}
         ]
         query_json = {'query': {'bool': {'must': must}}}
-        search_url = 'http://{}/{}/_delete_by_query'.format(config.ES_HOST, _es_index_user_category)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_client.delete_by_query(_es_index_user_category, query_json)
         if 'deleted' not in response:
             logger.error('ES Down')
             raise Exception(str(response))
+        pipe = redis_client.pipeline()
+        for category_id in get_category_catalogue()['category_by_id']:
+            pipe.zrem(f'{config.REDIS_PREFIX_CATEGORY_LEADERBOARD}:{category_id}', user_id)
+        pipe.execute()
     except Exception as e:
         raise e
 
 
 def search_categories(param, from_value, size_value):
     try:
-        global rs
         must = []
         keyword_fields = ['category_title', 'category_root']
 
@@ -550,8 +659,30 @@ def search_categories(param, from_value, size_value):
 
         query_json['from'] = from_value
         query_json['size'] = size_value
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_category, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+
+        text_search = False
+        for f in param:
+            if f not in keyword_fields and param[f]:
+                text_search = True
+
+        if text_search:
+            response = es_client.search(_es_index_category, query_json)
+        else:
+            catalogue = get_category_catalogue()
+            category_root = param.get('category_root', None)
+            if category_root:
+                category_id_list = catalogue['category_id_by_root'].get(category_root, [])
+            else:
+                category_id_list = list(catalogue['category_by_id'].keys())
+            hits = []
+            for category_id in category_id_list:
+                category = catalogue['category_by_id'][category_id]
+                if 'category_root' not in param and category['category_root'] == 'root':
+                    continue
+                if param.get('category_title', None) and category.get('category_title', None) != param['category_title']:
+                    continue
+                hits.append({'_id': category_id, '_source': copy.deepcopy(category)})
+            response = {'hits': {'hits': hits[from_value:from_value+size_value]}}
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
@@ -570,16 +701,15 @@ def search_categories(param, from_value, size_value):
 def update_root_category_skill_for_user(user_id, root_category_list, root_category_solve_count):
     # logger.info(f'update_root_category_skill_for_user called for: {user_id}')
     try:
-        global rs
         user_skill_sum = 0
+        writer = es_client.bulk_writer()
         for cat in root_category_list:
             must = [{"term": {"category_root": cat["category_name"]}}, {"term": {"user_id": user_id}}]
             aggs = {
                 "skill_value_by_percentage": {"sum": {"field": "skill_value_by_percentage"}}
             }
             query_json = {"size": 0, "query": {"bool": {"must": must}}, "aggs": aggs}
-            search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_user_category, _es_type)
-            response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+            response = es_client.search(_es_index_user_category, query_json)
             if 'aggregations' in response:
                 skill_value = response['aggregations']['skill_value_by_percentage']['value']
                 new_solve_count = root_category_solve_count.get(cat['category_name'], 0)
@@ -602,7 +732,8 @@ def update_root_category_skill_for_user(user_id, root_category_list, root_catego
                 uc_edge['skill_value_by_percentage'] = uc_edge['skill_value'] * float(cat['score_percentage']) / 100.0
                 user_skill_sum += uc_edge['skill_value_by_percentage']
                 uc_edge.pop('id', None)
-                add_user_category_data(user_id, cat['category_id'], uc_edge)
+                add_user_category_data(user_id, cat['category_id'], uc_edge, writer, ranked=True)
+        writer.flush()
         return user_skill_sum
     except Exception as e:
         raise Exception('Internal server error')
@@ -616,31 +747,44 @@ def update_root_category_skill_for_user(user_id, root_category_list, root_catego
 
 
 
+def find_unavailable_problem_id_set_for_user(user_id):
+    try:
+        problem_id_set = set()
+        must = [{'term': {'user_id': user_id}}]
+        must_not = [{'term': {'status': UNSOLVED}}]
+        query_json = {'query': {'bool': {'must': must, 'must_not': must_not}}}
+        query_json['_source'] = ['problem_id']
+        for hit_list in es_client.search_pages(_es_index_problem_user, query_json):
+            for hit in hit_list:
+                problem_id_set.add(hit['_source']['problem_id'])
+        return problem_id_set
+    except Exception as e:
+        raise e
+
+
 def available_problems_for_user(user_id):
+    # Yields the slim problem documents the scorer needs, skipping anything the user already solved, flagged or parked
     try:
+        unavailable_id_set = find_unavailable_problem_id_set_for_user(user_id)
         param = {
             'active_status': approved
         }
-        problem_list = search_problems(param, 0, _es_size)
-        available_list = []
-        for problem in problem_list:
-            edge = get_user_problem_status(user_id, problem['id'])
-            if edge is None:
-                available_list.append(problem)
-            else:
-                status = edge.get('status', None)
-                if status == UNSOLVED:
-                    available_list.append(problem)
-        return available_list
+        query_json = generate_query_params_for_problem_index(param)
+        query_json['_source'] = _available_problem_source
+        for hit_list in es_client.search_pages(_es_index_problem, query_json):
+            for hit in hit_list:
+                if hit['_id'] in unavailable_id_set:
+                    continue
+                data = hit['_source']
+                data['id'] = hit['_id']
+                yield data
     except Exception as e:
         raise e
 
 
 def find_problem_dependency_list(problem_id):
     try:
-        global rs
-        search_url = 'http://{}/{}/{}/{}'.format(config.ES_HOST, _es_index_problem, _es_type, problem_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_client.get(_es_index_problem, problem_id)
         item_list = []
         if 'found' in response:
             if response['found']:
@@ -689,12 +833,10 @@ def generate_query_params_for_problem_index(param):
 
 def search_problems(param, from_value, size_value):
     try:
-        global rs
         query_json = generate_query_params_for_problem_index(param)
         query_json['from'] = from_value
         query_json['size'] = size_value
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_problem, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_client.search(_es_index_problem, query_json)
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
@@ -709,7 +851,6 @@ def search_problems(param, from_value, size_value):
 
 def search_problems_filtered_by_categories_for_users(uc_edge_list):
     try:
-        global rs
         should = []
         for category_id in uc_edge_list:
             uc_edge = uc_edge_list[category_id]
@@ -729,8 +870,7 @@ def search_problems_filtered_by_categories_for_users(uc_edge_list):
 
         query_json['from'] = 0
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_problem, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_client.search(_es_index_problem, query_json)
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
@@ -743,48 +883,61 @@ def search_problems_filtered_by_categories_for_users(uc_edge_list):
         raise e
 
 
+def generate_user_problem_edge_id(user_id, problem_id):
+    return f'{user_id}:{problem_id}'
+
+
 def get_user_problem_status(user_id, problem_id):
     try:
-        global rs
-        must = [
-            {'term': {'user_id': user_id}},
-            {'term': {'problem_id': problem_id}}
-        ]
-        query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = 1
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_problem_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
-        if 'hits' in response:
-            for hit in response['hits']['hits']:
-                edge = hit['_source']
-                edge['id'] = hit['_id']
+        response = es_client.get(_es_index_problem_user, generate_user_problem_edge_id(user_id, problem_id))
+        if 'found' in response:
+            if response['found']:
+                edge = response['_source']
+                edge['id'] = response['_id']
                 return edge
-        return None
+            return None
+        logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
     except Exception as e:
         raise e
 
 
-def add_user_problem_status(user_id, problem_id, data):
+def get_user_problem_status_for_problem_list(user_id, problem_id_list):
     try:
-        global rs
-        edge = get_user_problem_status(user_id, problem_id)
-        if edge is None:
-            data['created_at'] = int(time.time())
-            data['updated_at'] = int(time.time())
-            post_url = 'http://{}/{}/{}'.format(config.ES_HOST, _es_index_problem_user, _es_type)
-            response = rs.post(url=post_url, json=data, headers=_http_headers).json()
-            if 'result' in response:
-                return response['_id']
-            raise Exception('Internal server error')
+        edge_map = {}
+        if len(problem_id_list) == 0:
+            return edge_map
+        edge_id_list = [generate_user_problem_edge_id(user_id, problem_id) for problem_id in problem_id_list]
+        response = es_client.mget(_es_index_problem_user, edge_id_list)
+        if 'docs' in response:
+            for doc in response['docs']:
+                if doc.get('found', False):
+                    edge = doc['_source']
+                    edge['id'] = doc['_id']
+                    edge_map[edge['problem_id']] = edge
+            return edge_map
+        logger.error('Elasticsearch down, response: ' + str(response))
+        raise Exception('Internal server error')
+    except Exception as e:
+        raise e
+
+
+def add_user_problem_status(user_id, problem_id, data, writer=None):
+    try:
+        data['user_id'] = user_id
+        data['problem_id'] = problem_id
+        data['updated_at'] = int(time.time())
+        data.pop('id', None)
+
+        upsert_data = dict(data)
+        upsert_data['created_at'] = data['updated_at']
+        edge_id = generate_user_problem_edge_id(user_id, problem_id)
 
-        edge_id = edge['id']
-        edge.pop('id', None)
-        for f in data:
-            edge[f] = data[f]
+        if writer is not None:
+            writer.upsert(_es_index_problem_user, edge_id, data, upsert_data)
+            return edge_id
 
-        edge['updated_at'] = int(time.time())
-        url = 'http://{}/{}/{}/{}'.format(config.ES_HOST, _es_index_problem_user, _es_type, edge_id)
-        response = rs.put(url=url, json=edge, headers=_http_headers).json()
+        response = es_client.update(_es_index_problem_user, edge_id, data, upsert_data=upsert_data)
         if 'result' in response:
             return response['result']
         raise Exception('Internal server error')
@@ -792,16 +945,82 @@ def add_user_problem_status(user_id, problem_id, data):
         raise Exception('Internal server error')
 
 
+_problem_counter_script = """
+ctx._source.solve_count = Math.max(0, ctx._source.solve_count + params.solve_count);
+ctx._source.attempt_count = Math.max(0, ctx._source.attempt_count + params.attempt_count);
+if (params.solved_at != null && (ctx._source.last_solved_at == null || ctx._source.last_solved_at < params.solved_at)) {
+    ctx._source.last_solved_at = params.solved_at;
+}
+ctx._source.updated_at = params.updated_at;
+"""
+
+
+def generate_problem_counter_update(problem_id, solve_count, attempt_count, solved_at=None):
+    script = {
+        'source': _problem_counter_script,
+        'lang': 'painless',
+        'params': {
+            'solve_count': solve_count,
+            'attempt_count': attempt_count,
+            'solved_at': solved_at,
+            'updated_at': int(time.time()),
+        }
+    }
+    upsert = {
+        'problem_id': problem_id,
+        'solve_count': max(0, solve_count),
+        'attempt_count': max(0, attempt_count),
+        'last_solved_at': solved_at,
+        'updated_at': int(time.time()),
+    }
+    return script, upsert
+
+
+def add_solved_problem_counter(problem_id, attempt_count, solved_at):
+    try:
+        script, upsert = generate_problem_counter_update(problem_id, 1, attempt_count, solved_at)
+        params = {'retry_on_conflict': _es_retry_on_conflict}
+        response = es_client.script_update(_es_index_problem_counter, problem_id, script, upsert, params)
+        if 'result' not in response:
+            logger.error('ES Down')
+            raise Exception(str(response))
+    except Exception as e:
+        raise e
+
+
+def remove_solved_problem_counters_for_user(user_id):
+    try:
+        must = [
+            {'term': {'user_id': user_id}},
+            {'term': {'status': SOLVED}}
+        ]
+        query_json = {'query': {'bool': {'must': must}}}
+        query_json['_source'] = ['problem_id', 'submission_list']
+        for hit_list in es_client.search_pages(_es_index_problem_user, query_json):
+            actions = []
+            for hit in hit_list:
+                edge = hit['_source']
+                attempt_count = len(edge.get('submission_list', []) or [])
+                script, upsert = generate_problem_counter_update(edge['problem_id'], -1, -attempt_count)
+                action = {'update': {'_index': _es_index_problem_counter, '_id': edge['problem_id'], 'retry_on_conflict': _es_retry_on_conflict}}
+                actions.append((action, {'script': script, 'upsert': upsert}))
+            response = es_client.bulk(actions)
+            if 'items' not in response or response.get('errors', False):
+                logger.error('ES Down')
+                raise Exception(str(response)[:1000])
+    except Exception as e:
+        raise e
+
+
 def clean_user_problem_history(user_id):
     try:
         logger.info(f'clean_user_problem_history for: user_id: {user_id}')
-        global rs
+        remove_solved_problem_counters_for_user(user_id)
         must = [
             {'term': {'user_id': user_id}}
         ]
         query_json = {'query': {'bool': {'must': must}}}
-        search_url = 'http://{}/{}/_delete_by_query'.format(config.ES_HOST, _es_index_problem_user)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_client.delete_by_query(_es_index_problem_user, query_json)
         if 'deleted' not in response:
             logger.error('ES Down')
             raise Exception(str(response))
@@ -815,9 +1034,14 @@ def update_user_problem_score(user_id, user_skill_level, updated_categories):
         problem_score_generator = ProblemScoreGenerator()
         problem_list = search_problems_filtered_by_categories_for_users(updated_categories)
 
+        writer = es_client.bulk_writer()
+        up_edge_list = []
+        problem_diff_list = []
+        category_level_lists = []
+        edge_map = get_user_problem_status_for_problem_list(user_id, [problem['id'] for problem in problem_list])
         for problem in problem_list:
             problem_id = problem['id']
-            up_edge = get_user_problem_status(user_id, problem_id)
+            up_edge = edge_map.get(problem_id, None)
 
             if up_edge is None:
                 up_edge = {
@@ -856,34 +1080,57 @@ def update_user_problem_score(user_id, user_skill_level, updated_categories):
                             uc_edge[key] = 0
                     updated_categories[category_id] = uc_edge
                 dcat_level_list.append(uc_edge['skill_level'])
-            relevant_score = problem_score_generator.generate_score(int(float(problem['problem_difficulty'])), dcat_level_list, user_skill_level)
+            up_edge_list.append(up_edge)
+            problem_diff_list.append(int(float(problem['problem_difficulty'])))
+            category_level_lists.append(dcat_level_list)
+
+        relevant_score_list = problem_score_generator.generate_score_list(problem_diff_list, category_level_lists, user_skill_level)
+        for up_edge, relevant_score in zip(up_edge_list, relevant_score_list):
             up_edge['relevant_score'] = relevant_score['score']
             up_edge.pop('id', None)
-            # logger.info(f'final up_edge {up_edge}')
-            add_user_problem_status(user_id, problem_id, up_edge)
-            # logger.info(f'user problem status added')
+            add_user_problem_status(user_id, up_edge['problem_id'], up_edge, writer)
+        writer.flush()
     except Exception as e:
         raise Exception('Internal server error')
 
 
+_solved_edge_script = """
+if (ctx._source.status == params.data.status) {
+    ctx.op = 'noop';
+} else {
+    ctx._source.putAll(params.data);
+}
+"""
+
+
+def mark_user_problem_solved(user_id, problem_id, data):
+    # Only the update that moves the edge to SOLVED reports a change, an overlapping sync sees a noop
+    script = {'source': _solved_edge_script, 'lang': 'painless', 'params': {'data': data}}
+    params = {'retry_on_conflict': _es_retry_on_conflict}
+    response = es_client.script_update(_es_index_problem_user, generate_user_problem_edge_id(user_id, problem_id), script, data, params)
+    if 'result' not in response:
+        raise Exception('Internal server error')
+    return response['result'] != 'noop'
+
+
 def apply_solved_problem_for_user(user_id, problem_id, problem_details, submission_list, updated_categories, root_category_solve_count):
     # logger.info(f'apply_solved_problem_for_user for user_id: {user_id}, problem_id: {problem_id}')
     try:
         up_edge = get_user_problem_status(user_id, problem_id)
         if up_edge is not None and up_edge['status'] == SOLVED:
             return
-        global rs
         data = {
             'user_id': user_id,
             'problem_id': problem_id,
             'submission_list': submission_list,
-            'status': SOLVED
+            'status': SOLVED,
+            'created_at': int(time.time()),
+            'updated_at': int(time.time())
         }
         # Insert User Problem Solved Status Here
-        post_url = 'http://{}/{}/{}'.format(config.ES_HOST, _es_index_problem_user, _es_type)
-        response = rs.post(url=post_url, json=data, headers=_http_headers).json()
-        if 'result' not in response:
-            raise Exception('Internal server error')
+        if not mark_user_problem_solved(user_id, problem_id, data):
+            return
+        add_solved_problem_counter(problem_id, len(submission_list), data['created_at'])
 
         problem_difficulty = int(math.ceil(float(problem_details['problem_difficulty'])))
         dep_cat_list = problem_details.get('categories', [])
@@ -1004,11 +1251,13 @@ def sync_problem_bucket(user_id, oj_problem_set):
                 dcat_uc_edge['relevant_score'] += cont_dx
                 updated_categories[dcat_id] = dcat_uc_edge
 
-        for category_id in updated_categories:
-            uc_edge = updated_categories[category_id]
-            uc_edge.pop('old_skill_level', None)
-            uc_edge.pop('id', None)
-            add_user_category_data(user_id, category_id, uc_edge)
+        # The root category aggregation below reads these edges, so wait for the refresh on flush
+        with es_client.bulk_writer({'refresh': 'wait_for'}) as writer:
+            for category_id in updated_categories:
+                uc_edge = updated_categories[category_id]
+                uc_edge.pop('old_skill_level', None)
+                uc_edge.pop('id', None)
+                add_user_category_data(user_id, category_id, uc_edge, writer, ranked=True)
 
         root_category_list = search_categories({"category_root": "root"}, 0, _es_size)
         user_skill = update_root_category_skill_for_user(user_id, root_category_list, root_category_solve_count)
@@ -1021,76 +1270,112 @@ def sync_problem_bucket(user_id, oj_problem_set):
         raise e
 
 
+def get_judge_watermark(user_info, oj_name):
+    # A watermark only holds for the handle it was taken from. Solves of problems that were not approved yet
+    # sit behind the watermark, so it is dropped for a full scan once every full scan interval
+    watermark = user_info.get(f'{oj_name}_watermark', None)
+    if not watermark or watermark.get('handle', None) != user_info.get(f'{oj_name}_handle', None):
+        return None
+    if time.time() - (watermark.get('full_scan_at', None) or 0) >= int(getattr(config, 'JUDGE_FULL_SCAN_INTERVAL', 604800)):
+        return None
+    return watermark
+
+
+def save_judge_watermarks(user_id, oj_problem_set):
+    try:
+        user_data = {}
+        for problem_set in oj_problem_set:
+            if problem_set.get('watermark', None):
+                user_data[f'{problem_set["oj_name"]}_watermark'] = problem_set['watermark']
+        if len(user_data) > 0:
+            update_user_details(user_id, user_data)
+    except Exception as e:
+        raise e
+
+
+def generate_judge_fetcher_list(user_info):
+    allowed_judges = ['codeforces', 'codechef', 'uva', 'spoj', 'lightoj']
+    fetcher_list = []
+    for oj_name in allowed_judges:
+        handle = user_info.get(f'{oj_name}_handle', None)
+        if not handle:
+            continue
+        if oj_name == 'codeforces':
+            watermark = get_judge_watermark(user_info, oj_name)
+            fetcher_list.append((oj_name, partial(codeforces.get_user_info_incremental, handle, watermark)))
+        if oj_name == 'codechef':
+            fetcher_list.append((oj_name, partial(codechef.get_user_info_heavy, handle)))
+        if oj_name == 'uva':
+            watermark = get_judge_watermark(user_info, oj_name)
+            fetcher_list.append((oj_name, partial(uva.get_user_info_incremental, handle, watermark)))
+        if oj_name == 'spoj':
+            fetcher_list.append((oj_name, partial(spoj.get_user_info_heavy, handle)))
+        if oj_name == 'lightoj':
+            credentials = {
+                'username': os.getenv('LIGHTOJ_USERNAME'),
+                'password': os.getenv('LIGHTOJ_PASSWORD')
+            }
+            fetcher_list.append((oj_name, partial(lightoj.get_user_info_heavy, handle, credentials)))
+    return fetcher_list
+
+
+judge_fetch_slots = threading.BoundedSemaphore(int(getattr(config, 'JUDGE_FETCH_MAX_IN_FLIGHT', 10)))
+
+
+def run_judge_fetcher(fetcher):
+    try:
+        return fetcher()
+    finally:
+        judge_fetch_slots.release()
+
+
+def fetch_judge_problem_set(fetcher_list):
+    # Judges are scrapped side by side; one that fails or overruns the timeout is left out of this sync
+    timeout = float(getattr(config, 'JUDGE_FETCH_TIMEOUT', 300))
+    deadline = time.time() + timeout
+    oj_problem_set = []
+    if len(fetcher_list) == 0:
+        return oj_problem_set
+    executor = ThreadPoolExecutor(max_workers=len(fetcher_list))
+    try:
+        future_list = []
+        for oj_name, fetcher in fetcher_list:
+            # A scrap holds its slot until the scrapper returns, so scraps that outlived an earlier timeout
+            # still count against the cap instead of piling up in the worker
+            if not judge_fetch_slots.acquire(timeout=max(0, deadline - time.time())):
+                logger.error(f'Scrap {oj_name} skipped, no scrap slot freed up within {timeout} seconds')
+                continue
+            logger.info(f'Scrap {oj_name} Problems')
+            future_list.append((oj_name, executor.submit(run_judge_fetcher, fetcher)))
+        wait([future for oj_name, future in future_list], timeout=max(0, deadline - time.time()))
+        for oj_name, future in future_list:
+            if not future.done():
+                logger.error(f'Scrap {oj_name} timed out after {timeout} seconds')
+                continue
+            if future.exception() is not None:
+                logger.error(f'Scrap {oj_name} failed: {future.exception()}')
+                continue
+            solved_problems = future.result()
+            problem_set = {'oj_name': oj_name}
+            if oj_name in _watermarked_judges:
+                problem_set['watermark'] = solved_problems['watermark']
+                solved_problems = solved_problems['solved_problems']
+            problem_set['problem_list'] = solved_problems
+            oj_problem_set.append(problem_set)
+            logger.info(f'Scrap {oj_name} Completed, solved count: {len(solved_problems)}')
+        return oj_problem_set
+    finally:
+        executor.shutdown(wait=False)
+
+
 def synch_user_problem_data_from_ojs(user_id):
     logger.info(f'synch_user_problem_data_from_ojs for user_id: {user_id}')
     try:
         user_info = get_user_details(user_id)
-        allowed_judges = ['codeforces', 'uva', 'codechef', 'spoj', 'lightoj']
-
-        oj_problem_set = []
-
-        logger.info('Scrap codeforces Problems')
-        if 'codeforces' in allowed_judges:
-            handle = user_info.get('codeforces_handle', None)
-            if handle:
-                solved_problems = codeforces.get_user_info_heavy(handle)
-                oj_problem_set.append({
-                    'problem_list': solved_problems,
-                    'oj_name': 'codeforces'
-                })
-        logger.info('Scrap codeforces Completed')
-
-        logger.info('Scrap codechef Problems')
-        if 'codechef' in allowed_judges:
-            handle = user_info.get('codechef_handle', None)
-            if handle:
-                solved_problems = codechef.get_user_info_heavy(handle)
-                oj_problem_set.append({
-                    'problem_list': solved_problems,
-                    'oj_name': 'codechef'
-                })
-        logger.info('Scrap codechef Completed')
-
-        logger.info('Scrap uva Problems')
-        if 'uva' in allowed_judges:
-            handle = user_info.get('uva_handle', None)
-            if handle:
-                solved_problems = uva.get_user_info_heavy(handle)
-                oj_problem_set.append({
-                    'problem_list': solved_problems,
-                    'oj_name': 'uva'
-                })
-        logger.info('Scrap uva Completed')
-
-        logger.info('Scrap spoj Problems')
-        if 'spoj' in allowed_judges:
-            handle = user_info.get('spoj_handle', None)
-            if handle:
-                solved_problems = spoj.get_user_info_heavy(handle)
-                oj_problem_set.append({
-                    'problem_list': solved_problems,
-                    'oj_name': 'spoj'
-                })
-        logger.info('Scrap spoj Completed')
-
-        logger.info('Scrap lightoj Problems')
-        if 'lightoj' in allowed_judges:
-            handle = user_info.get('lightoj_handle', None)
-            if handle:
-                credentials = {
-                    'username': os.getenv('LIGHTOJ_USERNAME'),
-                    'password': os.getenv('LIGHTOJ_PASSWORD')
-                }
-                solved_problems = lightoj.get_user_info_heavy(handle, credentials)
-                # print('problem_stat: ', problem_stat)
-                oj_problem_set.append({
-                    'problem_list': solved_problems,
-                    'oj_name': 'lightoj'
-                })
-        logger.info('Scrap lightoj Completed')
-
+        oj_problem_set = fetch_judge_problem_set(generate_judge_fetcher_list(user_info))
         sync_problem_bucket(user_id, oj_problem_set)
-
+        # Watermarks move only after the new submissions are stored, so a failed sync is retried in full
+        save_judge_watermarks(user_id, oj_problem_set)
     except Exception as e:
         raise e
 
@@ -1122,7 +1407,6 @@ def user_problem_data_sync_process(user_id):
 
 def search_team_ids(param, from_val, size_val):
     try:
-        global rs
         must = []
         keyword_fields = ['team_leader_id', 'team_type']
 
@@ -1139,8 +1423,7 @@ def search_team_ids(param, from_val, size_val):
         query_json['from'] = from_val
         query_json['size'] = size_val
         query_json['_source'] = False
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_team, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_client.search(_es_index_team, query_json)
         if 'hits' in response:
             item_list = []
             for hit in response['hits']['hits']:
@@ -1155,16 +1438,12 @@ def search_team_ids(param, from_val, size_val):
 
 def update_team_details(team_id, post_data):
     try:
-        global rs
-        search_url = 'http://{}/{}/{}/{}'.format(config.ES_HOST, _es_index_team, _es_type, team_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_client.get(_es_index_team, team_id)
         if 'found' in response:
             if response['found']:
-                data = response['_source']
-                for key, value in post_data.items():
-                    data[key] = value
-                data['updated_at'] = int(time.time())
-                response = rs.put(url=search_url, json=data, headers=_http_headers).json()
+                changes = dict(post_data)
+                changes['updated_at'] = int(time.time())
+                response = es_client.update(_es_index_team, team_id, changes)
                 if 'result' in response:
                     return response['result']
                 else:
@@ -1180,14 +1459,12 @@ def update_team_details(team_id, post_data):
 
 def get_all_users_from_team(team_id):
     try:
-        global rs
         must = [
             {'term': {'team_id': team_id}},
         ]
         query_json = {'query': {'bool': {'must': must}}}
         query_json['size'] = _es_size
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_user_team_edge, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_client.search(_es_index_user_team_edge, query_json)
         item_list = []
         if 'hits' in response:
             for hit in response['hits']['hits']:
@@ -1201,9 +1478,7 @@ def get_all_users_from_team(team_id):
 
 def get_team_details(team_id):
     try:
-        global rs
-        search_url = 'http://{}/{}/{}/{}'.format(config.ES_HOST, _es_index_team, _es_type, team_id)
-        response = rs.get(url=search_url, headers=_http_headers).json()
+        response = es_client.get(_es_index_team, team_id)
 
         if 'found' in response:
             if response['found']:
@@ -1229,7 +1504,6 @@ def get_team_details(team_id):
 
 def find_problems_for_user_by_status_filtered(status, user_id):
     try:
-        global rs
         should = []
         for s in status:
             should.append({'term': {'status': s}})
@@ -1239,15 +1513,12 @@ def find_problems_for_user_by_status_filtered(status, user_id):
             {"bool": {"should": should}}
         ]
         query_json = {'query': {'bool': {'must': must}}}
-        query_json['size'] = _es_max_solved_problem
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_problem_user, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        query_json['_source'] = ['problem_id']
 
         problem_list = []
-        if 'hits' in response:
-            for hit in response['hits']['hits']:
-                edge = hit['_source']
-                problem_list.append(edge['problem_id'])
+        for hit_list in es_client.search_pages(_es_index_problem_user, query_json):
+            for hit in hit_list:
+                problem_list.append(hit['_source']['problem_id'])
         return problem_list
     except Exception as e:
         raise e
@@ -1290,16 +1561,23 @@ def category_wise_problem_solve_for_users(user_list):
         raise e
 
 
-def generate_sync_data_for_category(user_id, category):
+def generate_sync_data_for_category(user_id, category, skill_level_map = None):
     try:
         category_skill_generator = CategorySkillGenerator()
         factor = float(category.get('factor', 1))
         skill_stat = category_skill_generator.generate_skill(category['solved_stat']['difficulty_wise_count'], factor)
 
+        if skill_level_map is None:
+            skill_level_map = {}
+
         dependent_skill_level = []
-        dependent_categories = find_category_dependency_list(category['category_id'])
+        catalogue = get_category_catalogue()
+        dependent_categories = catalogue['dependency_list_by_category'].get(category['category_id'], [])
         for dcat in dependent_categories:
-            category_details = get_user_category_data(user_id, dcat['category_id'])
+            if dcat['category_id_2'] in skill_level_map:
+                dependent_skill_level.append(skill_level_map[dcat['category_id_2']])
+                continue
+            category_details = get_user_category_data(user_id, dcat['category_id_2'])
             category_level = 0
             if category_details:
                 category_level = category_details.get('skill_level', 0)
@@ -1325,6 +1603,30 @@ def generate_sync_data_for_category(user_id, category):
         raise e
 
 
+def sync_category_score_in_topological_order(user_id, category_list, ranked=False):
+    try:
+        category_map = {}
+        for category in category_list:
+            category_map[category['category_id']] = category
+
+        ordered_category_list = []
+        for category_id in get_category_catalogue()['topological_order']:
+            if category_id in category_map:
+                ordered_category_list.append(category_map.pop(category_id))
+        ordered_category_list += list(category_map.values())
+
+        skill_level_map = {}
+        with es_client.bulk_writer({'refresh': 'wait_for'}) as writer:
+            for category in ordered_category_list:
+                if category['category_root'] == 'root':
+                    continue
+                data = generate_sync_data_for_category(user_id, category, skill_level_map)
+                skill_level_map[category['category_id']] = data['skill_level']
+                add_user_category_data(user_id, category['category_id'], data, writer, ranked)
+    except Exception as e:
+        raise e
+
+
 def sync_category_score_for_team(team_id):
     try:
         team_details = get_team_details(team_id)
@@ -1336,11 +1638,7 @@ def sync_category_score_for_team(team_id):
             user_list.append(user_details['id'])
 
         category_list = category_wise_problem_solve_for_users(user_list)
-        for category in category_list:
-            if category['category_root'] == 'root':
-                continue
-            data = generate_sync_data_for_category(team_id, category)
-            add_user_category_data(team_id, category['category_id'], data)
+        sync_category_score_in_topological_order(team_id, category_list)
     except Exception as e:
         raise e
 
@@ -1363,7 +1661,6 @@ def root_category_solved_count_by_solved_problem_list(solve_problems):
 
 def generate_sync_data_for_root_category(user_id, category, root_solved_count):
     try:
-        global rs
         skill_obj = Skill()
         must = [
             {'term': {'category_root': category['category_name']}},
@@ -1376,8 +1673,7 @@ def generate_sync_data_for_root_category(user_id, category, root_solved_count):
         query_json['aggs'] = aggregate
         query_json['size'] = 0
 
-        search_url = 'http://{}/{}/{}/_search'.format(config.ES_HOST, _es_index_user_category, _es_type)
-        response = rs.post(url=search_url, json=query_json, headers=_http_headers).json()
+        response = es_client.search(_es_index_user_category, query_json)
 
         if 'aggregations' not in response:
             raise Exception('Internal server error')
@@ -1418,10 +1714,11 @@ def sync_root_category_score_for_team(team_id):
         root_solved_count = root_category_solved_count_by_solved_problem_list(solved_problems)
         category_list = search_categories({'category_root': 'root'}, 0, 100)
         skill_value = 0
-        for category in category_list:
-            data = generate_sync_data_for_root_category(team_id, category, root_solved_count)
-            add_user_category_data(team_id, category['category_id'], data)
-            skill_value += data['skill_value_by_percentage']
+        with es_client.bulk_writer() as writer:
+            for category in category_list:
+                data = generate_sync_data_for_root_category(team_id, category, root_solved_count)
+                add_user_category_data(team_id, category['category_id'], data, writer)
+                skill_value += data['skill_value_by_percentage']
 
         return skill_value
     except Exception as e:
@@ -1459,44 +1756,65 @@ def sync_overall_stat_for_team(team_id, skill_value = None):
         raise e
 
 
-def generate_sync_data_for_problem(user_id, user_skill_level, problem):
-    try:
+def find_scoring_category_id_list(problem):
+    dependent_categories = problem.get('categories', None)
+    if dependent_categories is None:
         dependent_categories = find_problem_dependency_list(problem['id'])
-        problem_score_generator = ProblemScoreGenerator()
-        problem_type = problem.get('problem_type', None)
-        if problem_type == 'classical':
-            dependent_category_id_list = []
-            for category in dependent_categories:
-                category_id = category['category_id']
-                dependent_category_id_list.append(category_id)
-            dependent_dependent_category_list = find_category_dependency_list_for_multiple_categories(dependent_category_id_list)
-            category_level_list = []
-            for category_id in dependent_dependent_category_list:
-                category_details = get_user_category_data(user_id, category_id)
-                category_level = 0
-                if category_details:
-                    category_level = category_details.get('skill_level', 0)
-                category_level_list.append(category_level)
-            relevant_score = problem_score_generator.generate_score(int(float(problem['problem_difficulty'])),
-                                                                    category_level_list, user_skill_level)
-        else:
+    dependent_category_id_list = [category['category_id'] for category in dependent_categories]
+    if problem.get('problem_type', None) == 'classical':
+        return find_category_dependency_list_for_multiple_categories(dependent_category_id_list)
+    return dependent_category_id_list
+
+
+def generate_sync_data_for_problem_list(user_id, user_skill_level, problem_list):
+    try:
+        category_id_lists = [find_scoring_category_id_list(problem) for problem in problem_list]
+        category_id_set = set()
+        for category_id_list in category_id_lists:
+            category_id_set.update(category_id_list)
+        edge_map = get_user_category_data_list(user_id, list(category_id_set))
+
+        problem_diff_list = []
+        category_level_lists = []
+        for problem, category_id_list in zip(problem_list, category_id_lists):
             category_level_list = []
-            for category in dependent_categories:
-                category_id = category['category_id']
-                category_details = get_user_category_data(user_id, category_id)
+            for category_id in category_id_list:
+                category_details = edge_map.get(category_id, None)
                 category_level = 0
                 if category_details:
                     category_level = category_details.get('skill_level', 0)
                 category_level_list.append(category_level)
-            relevant_score = problem_score_generator.generate_score(int(float(problem['problem_difficulty'])),
-                                                                    category_level_list, user_skill_level)
-        data = {
-            'problem_id': problem['id'],
-            'relevant_score': relevant_score['score'],
-            'user_id': user_id,
-            'status': 'UNSOLVED'
-        }
-        return data
+            problem_diff_list.append(int(float(problem['problem_difficulty'])))
+            category_level_lists.append(category_level_list)
+
+        problem_score_generator = ProblemScoreGenerator()
+        relevant_score_list = problem_score_generator.generate_score_list(problem_diff_list, category_level_lists, user_skill_level)
+        data_list = []
+        for problem, relevant_score in zip(problem_list, relevant_score_list):
+            data = {
+                'problem_id': problem['id'],
+                'relevant_score': relevant_score['score'],
+                'user_id': user_id,
+                'status': 'UNSOLVED'
+            }
+            data_list.append(data)
+        return data_list
+    except Exception as e:
+        raise e
+
+
+def generate_sync_data_for_problem(user_id, user_skill_level, problem):
+    try:
+        return generate_sync_data_for_problem_list(user_id, user_skill_level, [problem])[0]
+    except Exception as e:
+        raise e
+
+
+def add_problem_score_list(user_id, user_skill_level, problem_list, writer):
+    try:
+        data_list = generate_sync_data_for_problem_list(user_id, user_skill_level, problem_list)
+        for data in data_list:
+            add_user_problem_status(user_id, data['problem_id'], data, writer)
     except Exception as e:
         raise e
 
@@ -1505,19 +1823,23 @@ def sync_problem_score_for_team(team_id, user_skill_level):
     try:
         team_details = get_team_details(team_id)
         marked_list = {}
-        for member in team_details['member_list']:
-            user_details = get_user_details_by_handle_name(member['user_handle'])
-            if user_details is None:
-                continue
-            user_id = user_details['id']
-            problem_list = available_problems_for_user(user_id)
-            for problem in problem_list:
-                problem_id = problem['id']
-                if problem_id in marked_list:
+        with es_client.bulk_writer() as writer:
+            problem_list = []
+            for member in team_details['member_list']:
+                user_details = get_user_details_by_handle_name(member['user_handle'])
+                if user_details is None:
                     continue
-                marked_list[problem_id] = 1
-                data = generate_sync_data_for_problem(team_id, user_skill_level, problem)
-                add_user_problem_status(team_id, problem['id'], data)
+                user_id = user_details['id']
+                for problem in available_problems_for_user(user_id):
+                    problem_id = problem['id']
+                    if problem_id in marked_list:
+                        continue
+                    marked_list[problem_id] = 1
+                    problem_list.append(problem)
+                    if len(problem_list) >= _es_page_size:
+                        add_problem_score_list(team_id, user_skill_level, problem_list, writer)
+                        problem_list = []
+            add_problem_score_list(team_id, user_skill_level, problem_list, writer)
     except Exception as e:
         raise e
 
@@ -1570,6 +1892,8 @@ def clean_user_sync_history(user_id):
         user_data['total_score'] = 0
         user_data['target_score'] = 0
         user_data['solve_count'] = 0
+        for oj_name in _watermarked_judges:
+            user_data[f'{oj_name}_watermark'] = None
         update_user_details(user_id, user_data)
         clean_user_problem_history(user_id)
         clean_user_category_history(user_id)
@@ -1597,47 +1921,109 @@ def clean_team_sync_history(team_id):
         raise Exception('Internal server error')
 
 
-def sync_all_users(restore_sync=False):
+_finished_job_progress = {'COMPLETED': 'done', 'FAILED': 'failed', 'COALESCED': 'coalesced'}
+
+
+def _sync_progress_key(parent_job_id):
+    return _sync_queue_key(f'progress:{parent_job_id}')
+
+
+def update_sync_progress(parent_job_id, field, amount=1):
+    pipe = redis_client.pipeline()
+    pipe.hincrby(_sync_progress_key(parent_job_id), field, amount)
+    pipe.expire(_sync_progress_key(parent_job_id), config.SYNC_PROGRESS_TTL)
+    pipe.execute()
+
+
+def load_job_status_map(job_id_list):
+    try:
+        response = es_client.mget(_es_index_jobs, job_id_list, source='status')
+        if 'docs' not in response:
+            logger.error('ES Down, response: ' + str(response))
+            raise Exception(str(response))
+        return {doc['_id']: doc['_source']['status'] for doc in response['docs'] if doc.get('found', False)}
+    except Exception as e:
+        raise e
+
+
+def fan_out_jobs(parent_job_id, job_type, ref_id_list):
+    # Child ids derive from the parent, so a retried fan-out finds the records of its earlier attempt.
+    # Finished children are only counted again, since the retry started the progress over; the others
+    # keep their record and are queued unless they still are.
+    now = int(time.time())
+    job_id_list = [f'{parent_job_id}:{ref_id}' for ref_id in ref_id_list]
+    status_map = load_job_status_map(job_id_list)
+    writer = es_client.bulk_writer()
+    finished_count_map = {}
+    pending_list = []
+    for job_id, ref_id in zip(job_id_list, ref_id_list):
+        status = status_map.get(job_id, None)
+        if status in _finished_job_progress:
+            field = _finished_job_progress[status]
+            finished_count_map[field] = finished_count_map.get(field, 0) + 1
+            continue
+        pending_list.append((job_id, ref_id))
+        if status is not None:
+            continue
+        data = {
+            'job_ref_id': ref_id,
+            'job_type': job_type,
+            'job_lane': BULK,
+            'parent_job_id': parent_job_id,
+            'status': 'PENDING',
+            'created_at': now,
+            'updated_at': now,
+        }
+        writer.index(_es_index_jobs, job_id, data)
+    writer.flush()
+    update_sync_progress(parent_job_id, 'total', len(job_id_list))
+
+    pipe = redis_client.pipeline()
+    for job_id, ref_id in pending_list:
+        payload = json.dumps({'id': job_id, 'job_type': job_type, 'job_ref_id': ref_id, 'job_lane': BULK, 'parent_job_id': parent_job_id}, sort_keys=True)
+        keys = [_sync_queue_key(f'coalesce:{job_type}:{ref_id}'), _sync_queue_key('queued'), _pending_lane_key(INTERACTIVE),
+                _pending_lane_key(BULK), _sync_queue_key('wakeup')]
+        pipe.eval(_enqueue_sync_job_script, len(keys), *keys, job_id, payload, BULK, config.SYNC_JOB_COALESCE_TTL)
+    coalesced_count = finished_count_map.pop('coalesced', 0)
+    for (job_id, ref_id), coalesced_job_id in zip(pending_list, pipe.execute()):
+        # A child the earlier attempt queued is still on its way and is counted when it finishes
+        if coalesced_job_id and coalesced_job_id != job_id:
+            writer.upsert(_es_index_jobs, job_id, {'status': 'COALESCED', 'updated_at': int(time.time())})
+            coalesced_count += 1
+    writer.flush()
+    if coalesced_count > 0:
+        update_sync_progress(parent_job_id, 'coalesced', coalesced_count)
+    for field, count in finished_count_map.items():
+        update_sync_progress(parent_job_id, field, count)
+
+
+def fan_out_all(parent_job_id, index, job_type):
+    try:
+        redis_client.delete(_sync_progress_key(parent_job_id))
+        redis_client.hset(_sync_progress_key(parent_job_id), 'started_at', int(time.time()))
+        query_json = {'query': {'match_all': {}}}
+        query_json['_source'] = False
+        for hit_list in es_client.search_pages(index, query_json, page_size=_fan_out_chunk_size):
+            fan_out_jobs(parent_job_id, job_type, [hit['_id'] for hit in hit_list])
+        redis_client.hset(_sync_progress_key(parent_job_id), 'fan_out_completed_at', int(time.time()))
+        redis_client.expire(_sync_progress_key(parent_job_id), config.SYNC_PROGRESS_TTL)
+    except Exception as e:
+        raise e
+
+
+def sync_all_users(parent_job_id, restore_sync=False):
     try:
         logger.info(f'sync_all_users called')
-        print(f'sync_all_users called')
-        user_size = 20
-        page = 0
-        while 1:
-            user_list = search_user_ids({}, page*user_size, user_size)
-            if len(user_list) == 0:
-                break
-            for user_id in user_list:
-                print('restore: ', user_id)
-                job_data = {
-                    'job_ref_id': user_id,
-                    'job_type': 'USER_SYNC'
-                }
-                if restore_sync:
-                    job_data['job_type'] = 'USER_SYNC_RESTORE'
-                create_job(job_data)
-            page += 1
+        fan_out_all(parent_job_id, _es_index_user, 'USER_SYNC_RESTORE' if restore_sync else 'USER_SYNC')
         logger.info(f'sync_all_users completed')
     except Exception as e:
         raise Exception('Internal server error')
 
 
-def sync_all_teams(restore_sync = False):
+def sync_all_teams(parent_job_id, restore_sync=False):
     try:
         logger.info(f'sync_all_teams called')
-        user_size = 20
-        page = 0
-        while 1:
-            team_list = search_team_ids({}, page*user_size, user_size)
-            if len(team_list) == 0:
-                break
-
-            for team_id in team_list:
-                if restore_sync:
-                    clean_team_sync_history(team_id)
-                team_problem_sync(team_id)
-
-            page += 1
+        fan_out_all(parent_job_id, _es_index_team, 'TEAM_SYNC_RESTORE' if restore_sync else 'TEAM_SYNC')
         logger.info(f'sync_all_teams completed')
     except Exception as e:
         raise Exception('Internal server error')
@@ -1671,94 +2057,302 @@ def team_problem_sync(team_id):
         raise Exception('Internal server error')
 
 
-def search_job():
+def update_job(job_id, status):
     try:
-        global rs
-        auth_header = get_header()
-        logger.debug('search_job called')
-        search_param = {
-            'status': 'PENDING',
-            'sort_order': 'asc',
-        }
-        response = rs.post(url=job_search_url, json=search_param, headers=auth_header).json()
-        logger.debug('response: ' + str(response))
-        return response['job_list']
+        logger.debug(f'update_job called for {job_id}, status: {status}')
+        response = es_client.update(_es_index_jobs, job_id, {'status': status, 'updated_at': int(time.time())})
+        if 'result' not in response:
+            logger.error('ES Down, response: ' + str(response))
+            raise Exception(str(response))
     except Exception as e:
         raise Exception('Internal server error')
 
 
-def update_job(job_id, status):
+class JobTimeout(Exception):
+    pass
+
+
+def _raise_job_timeout(signum, frame):
+    raise JobTimeout('Job timed out')
+
+
+# A job id that is still queued or running comes back as its own id. A bulk job promoted by an interactive
+# request is rewritten with its new lane, so a retry or an expired lease sends it back to the interactive lane
+_enqueue_sync_job_script = """
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1 then
+    return ARGV[1]
+end
+local existing = redis.call('GET', KEYS[1])
+if existing then
+    local existing_job = cjson.decode(existing)
+    if ARGV[3] == 'interactive' and existing_job['job_lane'] == 'bulk' and redis.call('LREM', KEYS[4], 1, existing) == 1 then
+        existing_job['job_lane'] = 'interactive'
+        local promoted = cjson.encode(existing_job)
+        redis.call('SET', KEYS[1], promoted, 'EX', ARGV[4])
+        redis.call('LPUSH', KEYS[3], promoted)
+    end
+    return existing_job['id']
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[4])
+redis.call('SADD', KEYS[2], ARGV[1])
+if ARGV[3] == 'interactive' then
+    redis.call('LPUSH', KEYS[3], ARGV[2])
+else
+    redis.call('LPUSH', KEYS[4], ARGV[2])
+end
+redis.call('LPUSH', KEYS[5], 1)
+redis.call('LTRIM', KEYS[5], 0, 99)
+return false
+"""
+
+_pick_job_script = """
+local first_lane, second_lane = KEYS[1], KEYS[2]
+if redis.call('LLEN', KEYS[1]) > 0 and redis.call('LLEN', KEYS[2]) > 0 then
+    if redis.call('INCR', KEYS[5]) % tonumber(ARGV[2]) == 0 then
+        first_lane, second_lane = KEYS[2], KEYS[1]
+    end
+end
+for _, lane in ipairs({first_lane, second_lane}) do
+    local payload = redis.call('RPOPLPUSH', lane, KEYS[3])
+    if payload then
+        local job = cjson.decode(payload)
+        local coalesce_key = ARGV[1] .. ':coalesce:' .. job['job_type'] .. ':' .. job['job_ref_id']
+        if redis.call('GET', coalesce_key) == payload then
+            redis.call('DEL', coalesce_key)
+        end
+        redis.call('ZADD', KEYS[4], ARGV[3], payload)
+        return payload
+    end
+end
+return false
+"""
+
+_requeue_expired_jobs_script = """
+local dead_list = {}
+for _, payload in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])) do
+    redis.call('ZREM', KEYS[3], payload)
+    redis.call('LREM', KEYS[2], 1, payload)
+    local job = cjson.decode(payload)
+    if redis.call('HINCRBY', KEYS[4], job['id'], 1) >= tonumber(ARGV[2]) then
+        redis.call('HDEL', KEYS[4], job['id'])
+        redis.call('SREM', KEYS[6], job['id'])
+        redis.call('LPUSH', KEYS[5], payload)
+        table.insert(dead_list, payload)
+    elseif job['job_lane'] == 'bulk' then
+        redis.call('LPUSH', KEYS[7], payload)
+    else
+        redis.call('LPUSH', KEYS[1], payload)
+    end
+end
+return dead_list
+"""
+
+
+def _sync_queue_key(name):
+    return f'{config.REDIS_PREFIX_SYNC_QUEUE}:{name}'
+
+
+def _pending_lane_key(job_lane):
+    return _sync_queue_key(f'pending:{job_lane}')
+
+
+def enqueue_sync_job(job_id, job_type, job_ref_id, job_lane):
+    # Returns the id of the pending job this one was folded into, or None when it was queued itself
+    payload = json.dumps({'id': job_id, 'job_type': job_type, 'job_ref_id': job_ref_id, 'job_lane': job_lane}, sort_keys=True)
+    keys = [_sync_queue_key(f'coalesce:{job_type}:{job_ref_id}'), _sync_queue_key('queued'), _pending_lane_key(INTERACTIVE),
+            _pending_lane_key(BULK), _sync_queue_key('wakeup')]
+    return redis_client.eval(_enqueue_sync_job_script, len(keys), *keys, job_id, payload, job_lane, config.SYNC_JOB_COALESCE_TTL)
+
+
+def enqueue_pending_jobs():
+    # Picks up PENDING jobs that never reached the queue, e.g. ones created while Redis was unreachable
     try:
-        global rs
-        auth_header = get_header()
-        logger.debug('update_job called')
-        url = job_url + job_id
-        response = rs.put(url=url, json={'status': status}, headers=auth_header).json()
-        logger.debug('response: ' + str(response))
+        queued_count = 0
+        query_json = {'query': {'bool': {'must': [{'term': {'status': 'PENDING'}}]}}}
+        query_json['sort'] = [{'created_at': {'order': 'asc'}}]
+        query_json['_source'] = ['job_ref_id', 'job_type', 'job_lane']
+        for hit_list in es_client.search_pages(_es_index_jobs, query_json):
+            for hit in hit_list:
+                if redis_client.sismember(_sync_queue_key('queued'), hit['_id']):
+                    continue
+                job = hit['_source']
+                coalesced_job_id = enqueue_sync_job(hit['_id'], job['job_type'], job['job_ref_id'], job.get('job_lane', INTERACTIVE))
+                if coalesced_job_id:
+                    update_job(hit['_id'], 'COALESCED')
+                else:
+                    queued_count += 1
+        logger.info(f'enqueue_pending_jobs queued {queued_count} jobs')
     except Exception as e:
-        raise Exception('Internal server error')
+        raise e
 
 
-def create_job(job_data):
+def pick_job():
+    # Interactive jobs go first, but every SYNC_BULK_JOB_SHARE-th pick serves the bulk lane so fan-outs keep moving
+    lease_deadline = int(time.time()) + config.SYNC_JOB_TIMEOUT + config.SYNC_JOB_POLL_INTERVAL
+    keys = [_pending_lane_key(INTERACTIVE), _pending_lane_key(BULK), _sync_queue_key('processing'),
+            _sync_queue_key('leases'), _sync_queue_key('bulk_turn')]
+    return redis_client.eval(_pick_job_script, len(keys), *keys, config.REDIS_PREFIX_SYNC_QUEUE, config.SYNC_BULK_JOB_SHARE, lease_deadline)
+
+
+def requeue_expired_jobs():
+    # Jobs whose lease ran out belong to a worker that died; they go back to their lane or to the dead letter list
+    keys = [_pending_lane_key(INTERACTIVE), _sync_queue_key('processing'), _sync_queue_key('leases'),
+            _sync_queue_key('attempts'), _sync_queue_key('dead'), _sync_queue_key('queued'), _pending_lane_key(BULK)]
+    dead_list = redis_client.eval(_requeue_expired_jobs_script, len(keys), *keys, int(time.time()), config.SYNC_JOB_MAX_ATTEMPTS)
+    for payload in dead_list:
+        logger.error('JOB MOVED TO DEAD LETTER LIST AFTER LEASE EXPIRED: ' + payload)
+        cur_job = json.loads(payload)
+        update_job(cur_job['id'], 'FAILED')
+        if cur_job.get('parent_job_id', None):
+            update_sync_progress(cur_job['parent_job_id'], 'failed')
+
+
+def acknowledge_job(payload, job_id):
+    pipe = redis_client.pipeline()
+    pipe.lrem(_sync_queue_key('processing'), 1, payload)
+    pipe.zrem(_sync_queue_key('leases'), payload)
+    pipe.hdel(_sync_queue_key('attempts'), job_id)
+    pipe.srem(_sync_queue_key('queued'), job_id)
+    pipe.execute()
+
+
+def retry_job(payload, cur_job):
+    attempts = redis_client.hincrby(_sync_queue_key('attempts'), cur_job['id'], 1)
+    pipe = redis_client.pipeline()
+    pipe.lrem(_sync_queue_key('processing'), 1, payload)
+    pipe.zrem(_sync_queue_key('leases'), payload)
+    if attempts >= config.SYNC_JOB_MAX_ATTEMPTS:
+        pipe.hdel(_sync_queue_key('attempts'), cur_job['id'])
+        pipe.srem(_sync_queue_key('queued'), cur_job['id'])
+        pipe.lpush(_sync_queue_key('dead'), payload)
+    else:
+        pipe.lpush(_pending_lane_key(cur_job.get('job_lane', INTERACTIVE)), payload)
+        pipe.lpush(_sync_queue_key('wakeup'), 1)
+    pipe.execute()
+    return attempts < config.SYNC_JOB_MAX_ATTEMPTS
+
+
+def record_job_failure(payload, cur_job):
+    if retry_job(payload, cur_job):
+        update_job(cur_job['id'], 'PENDING')
+        return
+    update_job(cur_job['id'], 'FAILED')
+    if cur_job.get('parent_job_id', None):
+        update_sync_progress(cur_job['parent_job_id'], 'failed')
+
+
+def process_job(cur_job):
+    job_ref_id = cur_job['job_ref_id']
+    if cur_job['job_type'] == 'USER_SYNC':
+        user_problem_sync(job_ref_id)
+    elif cur_job['job_type'] == 'TEAM_SYNC':
+        team_problem_sync(job_ref_id)
+    elif cur_job['job_type'] == 'USER_SYNC_RESTORE':
+        clean_user_sync_history(job_ref_id)
+        user_problem_sync(job_ref_id)
+    elif cur_job['job_type'] == 'TEAM_SYNC_RESTORE':
+        clean_team_sync_history(job_ref_id)
+        team_problem_sync(job_ref_id)
+    elif cur_job['job_type'] == 'SYNC_ALL_USERS':
+        sync_all_users(cur_job['id'], restore_sync=False)
+    elif cur_job['job_type'] == 'RESTORE_ALL_USERS':
+        sync_all_users(cur_job['id'], restore_sync=True)
+    elif cur_job['job_type'] == 'SYNC_ALL_TEAMS':
+        sync_all_teams(cur_job['id'], restore_sync=False)
+    elif cur_job['job_type'] == 'RESTORE_ALL_TEAMS':
+        sync_all_teams(cur_job['id'], restore_sync=True)
+
+
+def run_job(payload, worker_name):
+    cur_job = json.loads(payload)
+    response = es_client.get(_es_index_jobs, cur_job['id'])
+    if response.get('found', False) and response['_source']['status'] in ['COMPLETED', 'FAILED']:
+        # Delivery is at least once, so a job finished by an earlier delivery is only acknowledged
+        acknowledge_job(payload, cur_job['id'])
+        return
+    logger.debug(f'{worker_name} PROCESS JOB: ' + payload)
+    update_job(cur_job['id'], 'PROCESSING')
+    previous_handler = signal.signal(signal.SIGALRM, _raise_job_timeout)
+    signal.alarm(config.SYNC_JOB_TIMEOUT)
     try:
-        global rs
-        auth_header = get_header()
-        logger.debug('create_job called')
-        response = rs.post(url=job_url, json=job_data, headers=auth_header).json()
-        logger.debug('response: ' + str(response))
+        process_job(cur_job)
+    except JobTimeout:
+        signal.alarm(0)
+        logger.error(f'{worker_name} JOB TIMED OUT AFTER {config.SYNC_JOB_TIMEOUT} SECONDS: ' + payload)
+        record_job_failure(payload, cur_job)
+        return
     except Exception as e:
-        raise Exception('Internal server error')
-
-
-def db_job():
-    curtime = int(time.time())
-    logger.info('RUN CRON JOB FOR SYNCING DATA AT: ' + str(curtime))
-    while(1):
+        signal.alarm(0)
+        logger.error(f'{worker_name} JOB FAILED: {payload}, exception: {e}')
+        record_job_failure(payload, cur_job)
+        return
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous_handler)
+    update_job(cur_job['id'], 'COMPLETED')
+    acknowledge_job(payload, cur_job['id'])
+    if cur_job.get('parent_job_id', None):
+        update_sync_progress(cur_job['parent_job_id'], 'done')
+    logger.debug(f'{worker_name} COMPLETED JOB: ' + payload)
+
+
+def run_job_worker(worker_name, stop_event, enqueue_backlog=False):
+    logger.info(f'{worker_name} started')
+    if enqueue_backlog:
+        enqueue_pending_jobs()
+    while not stop_event.is_set():
         try:
-            pending_job_list = search_job()
-            if len(pending_job_list) == 0:
-                break
-            for cur_job in pending_job_list:
-                logger.debug('PROCESS JOB: ' + json.dumps(cur_job))
-                print('PROCESS JOB: ' + json.dumps(cur_job))
-                update_job(cur_job['id'], 'PROCESSING')
-                job_ref_id = cur_job['job_ref_id']
-
-                if cur_job['job_type'] == 'USER_SYNC':
-                    user_problem_sync(job_ref_id)
-                elif cur_job['job_type'] == 'TEAM_SYNC':
-                    team_problem_sync(job_ref_id)
-                elif cur_job['job_type'] == 'USER_SYNC_RESTORE':
-                    clean_user_sync_history(job_ref_id)
-                    user_problem_sync(job_ref_id)
-                elif cur_job['job_type'] == 'TEAM_SYNC_RESTORE':
-                    clean_team_sync_history(job_ref_id)
-                    team_problem_sync(job_ref_id)
-                elif cur_job['job_type'] == 'SYNC_ALL_USERS':
-                    sync_all_users(restore_sync=False)
-                elif cur_job['job_type'] == 'RESTORE_ALL_USERS':
-                    sync_all_users(restore_sync=True)
-                elif cur_job['job_type'] == 'SYNC_ALL_TEAMS':
-                    sync_all_teams(restore_sync=False)
-                elif cur_job['job_type'] == 'RESTORE_ALL_TEAMS':
-                    sync_all_teams(restore_sync=True)
-
-                update_job(cur_job['id'], 'COMPLETED')
-                logger.debug('COMPLETED JOB: ' + json.dumps(cur_job))
-                print('COMPLETED JOB: ' + json.dumps(cur_job))
+            requeue_expired_jobs()
+            payload = pick_job()
+            if payload is None:
+                # Blocks until a job is pushed, so pickup does not wait for a polling round
+                redis_client.brpop(_sync_queue_key('wakeup'), config.SYNC_JOB_POLL_INTERVAL)
+                continue
+            run_job(payload, worker_name)
         except Exception as e:
-            logger.info(f'Exception occurred while running cron job: {e}')
+            logger.error(f'Exception occurred in {worker_name}: {e}')
+            stop_event.wait(config.SYNC_JOB_POLL_INTERVAL)
+    logger.info(f'{worker_name} stopped')
+
 
+def start_job_workers(worker_count):
+    stop_event = multiprocessing.Event()
 
-cron_job = BackgroundScheduler(daemon=True)
-cron_job.add_job(db_job, 'interval', seconds=120)
-cron_job.start()
+    def stop_workers(signum, frame):
+        logger.info(f'Received signal {signum}, stopping after the running jobs')
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+
+    if worker_count <= 1:
+        run_job_worker('sync-worker-0', stop_event, enqueue_backlog=True)
+        return
+
+    # Workers are forked before this process opens any connection, so none of them share a socket
+    worker_list = [None] * worker_count
+    while not stop_event.is_set():
+        for index in range(worker_count):
+            worker = worker_list[index]
+            if worker is not None and worker.is_alive():
+                continue
+            if worker is not None:
+                logger.error(f'{worker.name} exited with code {worker.exitcode}, restarting')
+            worker = multiprocessing.Process(target=run_job_worker, name=f'sync-worker-{index}',
+                                             args=(f'sync-worker-{index}', stop_event, index == 0))
+            worker.start()
+            worker_list[index] = worker
+        stop_event.wait(config.SYNC_JOB_POLL_INTERVAL)
+
+    for worker in worker_list:
+        worker.join(config.SYNC_WORKER_SHUTDOWN_TIMEOUT)
+        if worker.is_alive():
+            logger.error(f'{worker.name} did not stop in {config.SYNC_WORKER_SHUTDOWN_TIMEOUT} seconds, killing it')
+            worker.kill()
+            worker.join()
 
 
 if __name__ == '__main__':
     logger.info('Sync Job Script successfully started running')
     print('Sync Job Script successfully started running')
-    print('Run initial job')
-    db_job()
-    while(1):
-        pass
+    start_job_workers(config.SYNC_WORKER_COUNT)
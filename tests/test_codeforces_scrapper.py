@@ -0,0 +1,108 @@
+import importlib.util
+import os
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+
+_root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(_root_dir, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def submission(submission_id, problem_index, verdict='OK', testset='TESTS'):
+    data = {
+        'id': submission_id,
+        'contestId': 1000,
+        'creationTimeSeconds': 1600000000 + submission_id,
+        'problem': {'contestId': 1000, 'index': problem_index},
+    }
+    if verdict is not None:
+        data['verdict'] = verdict
+    if testset is not None:
+        data['testset'] = testset
+    return data
+
+
+@pytest.fixture(params=['core', 'sync'])
+def fetch_solved(request, monkeypatch):
+    if request.param == 'core':
+        module = load_module('core_codeforces_scrapper', 'scrappers/codeforces_scrapper.py')
+        fetch_name = 'get_user_info_heavy'
+    else:
+        module = load_module('sync_codeforces_scrapper', 'sync-services/scrappers/codeforces_scrapper.py')
+        fetch_name = 'get_user_info_incremental'
+
+    def fetch(submission_list, watermark=None):
+        scrapper = module.CodeforcesScrapper()
+        # Codeforces returns submissions newest first
+        submission_list = sorted(submission_list, key=lambda data: data['id'], reverse=True)
+        monkeypatch.setattr(scrapper, 'get_submission_pages', lambda username, rs: iter([submission_list]))
+        return getattr(scrapper, fetch_name)('tourist', watermark)
+    return fetch
+
+
+def test_watermark_stops_before_pending_verdict(fetch_solved):
+    result = fetch_solved([
+        submission(101, 'A', 'WRONG_ANSWER'),
+        submission(102, 'B'),
+        submission(103, 'C', None, None),
+        submission(104, 'D'),
+    ])
+    assert result['watermark']['submission_id'] == 102
+    assert result['watermark']['handle'] == 'tourist'
+    assert set(result['solved_problems']) == {'1000/B', '1000/D'}
+
+
+def test_pending_verdict_is_credited_on_next_sync(fetch_solved):
+    first = fetch_solved([
+        submission(101, 'A'),
+        submission(102, 'B', 'TESTING'),
+        submission(103, 'C'),
+    ])
+    assert first['watermark']['submission_id'] == 101
+
+    second = fetch_solved([
+        submission(101, 'A'),
+        submission(102, 'B'),
+        submission(103, 'C'),
+        submission(104, 'D', 'TIME_LIMIT_EXCEEDED'),
+    ], first['watermark'])
+    assert second['watermark']['submission_id'] == 104
+    assert set(second['solved_problems']) == {'1000/B', '1000/C'}
+
+
+def test_pretests_pass_is_pending(fetch_solved):
+    result = fetch_solved([
+        submission(101, 'A'),
+        submission(102, 'B', 'OK', 'PRETESTS'),
+    ])
+    assert result['watermark']['submission_id'] == 101
+    assert set(result['solved_problems']) == {'1000/A'}
+
+
+def test_watermark_holds_when_everything_new_is_pending(fetch_solved):
+    watermark = {'handle': 'tourist', 'submission_id': 100, 'submission_time': 1600000100, 'full_scan_at': 1600000000}
+    result = fetch_solved([
+        submission(100, 'A'),
+        submission(101, 'B', 'SUBMITTED'),
+        submission(102, 'C', None, None),
+    ], watermark)
+    assert result['watermark'] == watermark
+    assert result['solved_problems'] == {}
+
+
+def test_full_scan_time_is_carried_forward(fetch_solved):
+    first = fetch_solved([submission(101, 'A')])
+    assert first['watermark']['full_scan_at'] > 0
+
+    watermark = dict(first['watermark'], full_scan_at=1600000000)
+    second = fetch_solved([submission(101, 'A'), submission(102, 'B')], watermark)
+    assert second['watermark']['submission_id'] == 102
+    assert second['watermark']['full_scan_at'] == 1600000000
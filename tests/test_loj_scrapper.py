@@ -0,0 +1,150 @@
+import importlib.util
+import os
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+pytest.importorskip('selenium')
+
+_root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_fixture_dir = os.path.join(_root_dir, 'tests', 'fixtures', 'lightoj')
+
+_credentials = {'username': 'codeflares', 'password': 'secret'}
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(_root_dir, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def read_fixture(name):
+    with open(os.path.join(_fixture_dir, name), 'rb') as fixture_file:
+        return fixture_file.read()
+
+
+class LightOJFixtureServer(ThreadingHTTPServer):
+    # Serves the recorded pages, the user statistics page only behind a cookie handed out by the login form
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), LightOJFixtureHandler)
+        self.session_tokens = set()
+        self.login_count = 0
+        self.userstat_requests = []
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def expire_sessions(self):
+        self.session_tokens.clear()
+
+
+class LightOJFixtureHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_page(self, body, cookie=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        if cookie:
+            self.send_header('Set-Cookie', cookie)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def session_token(self):
+        for cookie in self.headers.get('Cookie', '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == 'PHPSESSID':
+                return value
+        return None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/volume_userstat.php' and self.session_token() in self.server.session_tokens:
+            self.server.userstat_requests.append(parse_qs(url.query)['user_id'][0])
+            self.send_page(read_fixture('volume_userstat.html'))
+            return
+        self.send_page(read_fixture('login_main.html'))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        if urlparse(self.path).path != '/login_check.php' or form.get('myuserid') != [_credentials['username']] or \
+                form.get('mypassword') != [_credentials['password']]:
+            self.send_page(read_fixture('login_main.html'))
+            return
+        token = uuid.uuid4().hex
+        self.server.session_tokens.add(token)
+        self.server.login_count += 1
+        self.send_page(b'<html><body>Welcome</body></html>', cookie=f'PHPSESSID={token}; Path=/')
+
+
+@pytest.fixture
+def server():
+    server = LightOJFixtureServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=['core', 'sync'])
+def loj_module(request, monkeypatch):
+    if request.param == 'core':
+        module = load_module('core_loj_scrapper', 'scrappers/loj_scrapper.py')
+    else:
+        module = load_module('sync_loj_scrapper', 'sync-services/scrappers/loj_scrapper.py')
+
+    def login_with_browser(pool, session):
+        raise AssertionError('the fixture login form should not need a browser')
+    monkeypatch.setattr(module.LightOJSessionPool, 'login_with_browser', login_with_browser)
+    return module
+
+
+@pytest.fixture
+def scrapper(server, loj_module):
+    return loj_module.LightOJScrapper(base_url=server.base_url)
+
+
+def test_login_and_parse_solved_list(server, scrapper):
+    solved_problems = scrapper.get_user_info_heavy('flash_7', _credentials)
+    if 'solved_problems' in solved_problems:
+        solved_problems = solved_problems['solved_problems']
+
+    assert sorted(solved_problems) == ['1000', '1001', '1112']
+    assert solved_problems['1000']['problem_id'] == '1000'
+    assert server.login_count == 1
+    assert server.userstat_requests[-1] == 'flash_7'
+
+
+def test_session_is_shared_across_users(server, scrapper):
+    assert scrapper.get_solved_problem_list('flash_7', _credentials) == ['1000', '1001', '1112']
+    assert scrapper.get_solved_problem_list('sabbir', _credentials) == ['1000', '1001', '1112']
+    assert server.login_count == 1
+
+
+def test_expired_cookie_logs_in_again(server, scrapper):
+    scrapper.get_solved_problem_list('flash_7', _credentials)
+    server.expire_sessions()
+
+    assert scrapper.get_solved_problem_list('sabbir', _credentials) == ['1000', '1001', '1112']
+    assert server.login_count == 2
+    assert server.userstat_requests[-1] == 'sabbir'
+
+
+def test_wrong_credentials_are_reported(server, scrapper, loj_module, monkeypatch):
+    monkeypatch.setattr(loj_module.LightOJSessionPool, 'login_with_browser', lambda pool, session: False)
+    credentials = {'username': 'codeflares', 'password': 'wrong'}
+    with pytest.raises(Exception, match='Could not log in to lightoj'):
+        scrapper.get_solved_problem_list('flash_7', credentials)
+    assert server.login_count == 0
@@ -0,0 +1,96 @@
+import importlib.util
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+_root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_sync_model():
+    # sync-services/models uses relative imports, so it is loaded as its own package next to the core copy
+    package_dir = os.path.join(_root_dir, 'sync-services', 'models')
+    spec = importlib.util.spec_from_file_location('sync_models', os.path.join(package_dir, '__init__.py'),
+                                                  submodule_search_locations=[package_dir])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules['sync_models'] = package
+    spec = importlib.util.spec_from_file_location('sync_models.problem_score_model',
+                                                  os.path.join(package_dir, 'problem_score_model.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['sync_models.problem_score_model'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_core_model():
+    pytest.importorskip('flask')
+    if _root_dir not in sys.path:
+        sys.path.insert(0, _root_dir)
+    return importlib.import_module('models.problem_score_model')
+
+
+@pytest.fixture(params=['core', 'sync'])
+def score_generator(request):
+    if request.param == 'core':
+        return load_core_model().ProblemScoreGenerator()
+    return load_sync_model().ProblemScoreGenerator()
+
+
+def random_problem_list(rng, problem_count):
+    problem_diff_list = []
+    category_level_lists = []
+    for _ in range(problem_count):
+        # Half the difficulties sit on the 0.5 grid so interval bounds are hit exactly
+        if rng.random() < 0.5:
+            problem_diff_list.append(rng.randint(0, 20) / 2.0)
+        else:
+            problem_diff_list.append(rng.uniform(0, 10))
+        category_count = rng.randint(0, 5)
+        category_level_lists.append([rng.choice([rng.randint(0, 10), round(rng.uniform(0, 10), 2)])
+                                     for _ in range(category_count)])
+    return problem_diff_list, category_level_lists
+
+
+def scalar_score_list(score_generator, problem_diff_list, category_level_lists, user_skill_level):
+    return [score_generator.generate_score(problem_diff, category_level_list, user_skill_level)
+            for problem_diff, category_level_list in zip(problem_diff_list, category_level_lists)]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_generate_score_list_matches_generate_score(score_generator, seed):
+    rng = random.Random(seed)
+    problem_diff_list, category_level_lists = random_problem_list(rng, rng.randint(1, 200))
+    user_skill_level = rng.uniform(0, 10)
+
+    expected = scalar_score_list(score_generator, problem_diff_list, category_level_lists, user_skill_level)
+    actual = score_generator.generate_score_list(problem_diff_list, category_level_lists, user_skill_level)
+    assert actual == expected
+
+
+def test_calculate_list_matches_calculate(score_generator):
+    problem_diff_array = np.linspace(0, 10, 1001)
+    for category_level in [0, 0.5, 1, 3.33, 5, 7.5, 9, 10]:
+        expected = [score_generator.calculate(float(problem_diff), category_level) for problem_diff in problem_diff_array]
+        assert score_generator.calculate_list(problem_diff_array, category_level).tolist() == expected
+
+
+def test_generate_score_list_without_categories(score_generator):
+    problem_diff_list = [0, 2.5, 7.25, 10]
+    category_level_lists = [[] for _ in problem_diff_list]
+
+    expected = scalar_score_list(score_generator, problem_diff_list, category_level_lists, 4.2)
+    assert score_generator.generate_score_list(problem_diff_list, category_level_lists, 4.2) == expected
+
+
+def test_generate_score_list_mixes_empty_and_filled_categories(score_generator):
+    problem_diff_list = [1.5, 6, 3.75]
+    category_level_lists = [[], [5, 7], []]
+
+    expected = scalar_score_list(score_generator, problem_diff_list, category_level_lists, 2)
+    assert score_generator.generate_score_list(problem_diff_list, category_level_lists, 2) == expected
+
+
+def test_generate_score_list_empty_input(score_generator):
+    assert score_generator.generate_score_list([], [], 3) == []
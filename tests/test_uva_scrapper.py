@@ -0,0 +1,75 @@
+import importlib.util
+import os
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+
+_root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# uHunt problem id to problem number, id 3 is a problem the map does not know yet
+_problem_number_map = {1: 100, 2: 101, 4: 103}
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(_root_dir, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def submission(submission_id, problem_id, verdict=90):
+    return [submission_id, problem_id, verdict, 0, 1600000000 + submission_id]
+
+
+@pytest.fixture(params=['core', 'sync'])
+def fetch_solved(request, monkeypatch):
+    if request.param == 'core':
+        module = load_module('core_uva_scrapper', 'scrappers/uva_scrapper.py')
+        fetch_name = 'get_user_info_heavy'
+    else:
+        module = load_module('sync_uva_scrapper', 'sync-services/scrappers/uva_scrapper.py')
+        fetch_name = 'get_user_info_incremental'
+
+    def fetch(submission_list, watermark=None):
+        scrapper = module.UvaScrapper()
+        monkeypatch.setattr(scrapper, 'get_user_id', lambda username, rs: 7)
+        monkeypatch.setattr(scrapper, 'get_problem_number', lambda problem_id: _problem_number_map.get(problem_id, None))
+        min_submission_id = watermark['submission_id'] if watermark else 0
+        monkeypatch.setattr(scrapper, 'get_submission_list', lambda userid, rs, watermark=None: [
+            sub for sub in submission_list if sub[0] > min_submission_id
+        ])
+        return getattr(scrapper, fetch_name)('flash_7', watermark)
+    return fetch
+
+
+def test_watermark_stops_before_queued_verdict(fetch_solved):
+    result = fetch_solved([
+        submission(11, 1),
+        submission(12, 2, 70),
+        submission(13, 4, 20),
+        submission(14, 2),
+    ])
+    assert result['watermark']['submission_id'] == 12
+    assert set(result['solved_problems']) == {100, 101}
+
+
+def test_watermark_stops_before_unknown_problem(fetch_solved):
+    result = fetch_solved([
+        submission(11, 1),
+        submission(12, 3),
+        submission(13, 2),
+    ])
+    assert result['watermark']['submission_id'] == 11
+    assert set(result['solved_problems']) == {100, 101}
+
+
+def test_queued_verdict_is_credited_on_next_sync(fetch_solved):
+    first = fetch_solved([submission(11, 1), submission(12, 4, 0)])
+    assert first['watermark']['submission_id'] == 11
+
+    second = fetch_solved([submission(11, 1), submission(12, 4)], first['watermark'])
+    assert second['watermark']['submission_id'] == 12
+    assert second['watermark']['full_scan_at'] == first['watermark']['full_scan_at']
+    assert set(second['solved_problems']) == {103}